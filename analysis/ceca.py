@@ -5,9 +5,12 @@
 
 import argparse
 import enum
+import heapq
+import itertools
 import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import chipwhisperer.analyzer as cwa
@@ -15,15 +18,18 @@ import codetiming
 import more_itertools
 import networkx as nx
 import numpy as np
-import ray
 import scared
 
 # Append ot-sca root directory to path such that ceca.py can find the
 # project_library module located in the capture/ directory.
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(ABS_PATH + '/..')
+import util.ceca_stats as ceca_stats  # noqa : E402
 from capture.project_library.project import ProjectConfig  # noqa : E402
 from capture.project_library.project import SCAProject  # noqa : E402
+from capture.project_library.project import get_project_type  # noqa : E402
+from util.leakage_models import aes_inverse_key_schedule  # noqa : E402
+from util.parallel import ScratchSpace  # noqa : E402
 
 """A distributed implementation of the correlation-enhanced power analysis
 collision attack.
@@ -61,7 +67,47 @@ class AttackDirection(str, enum.Enum):
     OUTPUT = "output"
 
 
-@ray.remote
+def open_project(project_file):
+    """Opens a Chipwhisperer or ot_trace_library project for reading."""
+    # ChipWhisperer, ot_trace_library or ot_memmap_library project?
+    project_type = get_project_type(project_file)
+
+    # Open the project.
+    project_cfg = ProjectConfig(type = project_type,
+                                path = project_file,
+                                wave_dtype = np.uint16,
+                                overwrite = False
+                                )
+    project = SCAProject(project_cfg)
+    project.open_project()
+    return project
+
+
+def load_traces(project, trace_slice, attack_window, attack_direction):
+    """Loads the texts and the traces in the attack window of a slice of traces.
+
+    Args:
+        project: An open ``SCAProject``.
+        trace_slice: Traces to load.
+        attack_window: Samples to load.
+        attack_direction: Attack direction.
+
+    Returns:
+        A tuple ``(texts, traces)`` with the plaintexts or ciphertexts and the
+        traces.
+    """
+    if attack_direction == AttackDirection.INPUT:
+        texts = project.get_plaintexts_array(trace_slice.start, trace_slice.stop)
+    else:
+        texts = project.get_ciphertexts_array(trace_slice.start, trace_slice.stop)
+
+    # Only read the samples in the attack window.
+    traces = project.get_waves_array(trace_slice.start, trace_slice.stop,
+                                     attack_window.start,
+                                     attack_window.stop - attack_window.start)
+    return texts, traces
+
+
 class TraceWorker:
     """Class for performing distributed computations on power traces.
 
@@ -72,14 +118,20 @@ class TraceWorker:
     can be performed by simply calling the methods of these workers. Individual
     results of these workers can then be aggregated to produce the final result.
 
-    This class is a Ray actor (https://docs.ray.io/en/master/index.html) and can
-    be used as follows:
-    >>> workers = [TraceWorker.remote(...) for ...]
-    >>> tasks = [worker.compute_stats.remote() for worker in workers]
-    >>> results = ray.get(tasks)
+    By default, a worker loads its traces once and keeps them in memory. In
+    streaming mode, i.e., if a chunk size is given, every pass over the traces
+    loads them from the project chunk by chunk such that the memory of a worker
+    is bounded by the chunk size instead of the number of traces. In both modes,
+    filtering only updates a boolean mask of the traces to use.
+
+    The workers are run by one of the execution backends in ``WORKER_BACKENDS``,
+    e.g., as Ray actors (https://docs.ray.io/en/master/index.html):
+    >>> workers = RayWorkers([(project_file, trace_slice, ...) for ...])
+    >>> results = list(workers.run("compute_stats"))
     """
 
-    def __init__(self, project_file, trace_slice, attack_window, attack_direction):
+    def __init__(self, project_file, trace_slice, attack_window, attack_direction,
+                 chunk_size=None):
         """Inits a TraceWorker.
 
         Args:
@@ -87,34 +139,63 @@ class TraceWorker:
             trace_slice: Traces assigned to this worker.
             attack_window: Samples to process.
             attack_direction: Attack direction.
+            chunk_size: Number of traces loaded at a time in streaming mode.
+                By default, all traces of the worker are kept in memory.
         """
-        # ChipWhisperer or ot_trace_library project?
-        project_type = "cw"
-        if ".db" in project_file:
-            project_type = 'ot_trace_library'
-
-        # Open the project.
-        project_cfg = ProjectConfig(type = project_type,
-                                    path = project_file,
-                                    wave_dtype = np.uint16,
-                                    overwrite = False
-                                    )
-        self.project = SCAProject(project_cfg)
-        self.project.open_project()
-
-        # TODO: Consider more efficient formats.
-        self.num_samples = attack_window.stop - attack_window.start
-        if attack_direction == AttackDirection.INPUT:
-            self.texts = np.vstack(self.project.get_plaintexts(
-                trace_slice.start, trace_slice.stop))
-        else:
-            self.texts = np.vstack(self.project.get_ciphertexts(
-                trace_slice.start, trace_slice.stop))
+        self.project_file = project_file
+        self.trace_slice = trace_slice
+        self.attack_window = attack_window
+        self.attack_direction = attack_direction
+        self.chunk_size = chunk_size
+        self.texts, self.traces, self.traces_to_use = self._load_traces()
 
-        self.traces = np.asarray(self.project.get_waves(
-            trace_slice.start, trace_slice.stop))[:, attack_window]
+    def _load_traces(self):
+        """Loads the traces of the worker.
 
-        self.project.close(save=False)
+        Returns:
+            A tuple ``(texts, traces, traces_to_use)`` with the texts, the traces
+            and the filtering mask of the worker. In streaming mode, the texts and
+            the traces are ``None`` and are loaded in every pass, see
+            ``iter_chunks()``.
+        """
+        if self.chunk_size is None:
+            project = open_project(self.project_file)
+            texts, traces = load_traces(project, self.trace_slice, self.attack_window,
+                                        self.attack_direction)
+            project.close(save=False)
+        else:
+            texts, traces = None, None
+        # Filtering only clears the entries of the noisy traces.
+        traces_to_use = np.ones(self.trace_slice.stop - self.trace_slice.start, dtype=bool)
+        return texts, traces, traces_to_use
+
+    def iter_chunks(self):
+        """Iterates over the traces of the worker.
+
+        Yields:
+            Tuples ``(traces_to_use, texts, traces)`` for consecutive chunks of
+            traces, where ``traces_to_use`` is a view of the filtering mask of
+            the chunk. Without a chunk size, all traces are a single chunk.
+        """
+        if self.chunk_size is None:
+            yield self.traces_to_use, self.texts, self.traces
+            return
+        num_traces = self.traces_to_use.shape[0]
+        project = open_project(self.project_file)
+        try:
+            for start in range(0, num_traces, self.chunk_size):
+                stop = min(start + self.chunk_size, num_traces)
+                texts, traces = load_traces(
+                    project,
+                    slice(self.trace_slice.start + start, self.trace_slice.start + stop),
+                    self.attack_window, self.attack_direction)
+                yield self.traces_to_use[start:stop], texts, traces
+        finally:
+            project.close(save=False)
+
+    def num_traces(self):
+        """Returns the number of remaining traces."""
+        return int(self.traces_to_use.sum())
 
     def compute_stats(self):
         """Computes sums and sums of deviation products of traces.
@@ -123,16 +204,18 @@ class TraceWorker:
         deviation of a set of traces in a distributed manner using Eq. 22 in
         "Numerically Stable Parallel Computation of (Co-)Variance" by E.
         Schubert and M. Gertz (https://dbs.ifi.uni-heidelberg.de/files/Team/
-        eschubert/publications/SSDBM18-covariance-authorcopy.pdf).
+        eschubert/publications/SSDBM18-covariance-authorcopy.pdf), see
+        ``util.ceca_stats.merge_stats()``. The same equation merges the results
+        of the chunks of a worker.
 
         Returns:
             Number of traces, their sums, and sums of deviation products.
         """
-        cnt = self.traces.shape[0]
-        sum_ = self.traces.sum(axis=0)
-        mean = sum_ / cnt
-        sum_dev_prods = ((self.traces - mean) ** 2).sum(axis=0)
-        return (cnt, sum_, sum_dev_prods)
+        stats = (0, None, None)
+        for traces_to_use, _, traces in self.iter_chunks():
+            stats = ceca_stats.merge_stats(stats,
+                                           ceca_stats.compute_stats(traces[traces_to_use]))
+        return stats
 
     def filter_noisy_traces(self, min_trace, max_trace):
         """Filters traces with values outside the allowable range.
@@ -144,17 +227,20 @@ class TraceWorker:
         Returns:
             Number of remaining traces.
         """
-        traces_to_use = np.all(
-            (self.traces >= min_trace) & (self.traces <= max_trace), axis=1
-        )
-        self.traces = self.traces[traces_to_use]
-        self.texts = self.texts[traces_to_use]
-        return self.traces.shape[0]
+        for traces_to_use, _, traces in self.iter_chunks():
+            traces_to_use &= np.all((traces >= min_trace) & (traces <= max_trace), axis=1)
+        return self.num_traces()
 
-    def count_and_sum_text_traces(self):
+    def count_and_sum_text_traces(self, chunk_size=None):
         """Computes the number of traces and sums of these traces for all values
         of each text byte.
 
+        The traces are processed in chunks, see
+        ``util.ceca_stats.count_and_sum_text_traces()``.
+
+        Args:
+            chunk_size: Number of traces processed at a time.
+
         Returns:
             A tuple ``(cnts, sums)``, where
                 - ``cnts`` is a (16, 256, 1) array where ``cnts[i, j, 0]`` gives the
@@ -162,28 +248,182 @@ class TraceWorker:
                 - ``sums`` is a (16, 256, NUM_SAMPLES) array where ``sums[i, j, :]``
                   gives the sum of traces where text byte i is j.
         """
-        sums = np.zeros((16, 256, self.num_samples))
-        # Need to specify the last dimension for broadcasting to work during
-        # aggregation.
-        cnts = np.zeros((16, 256, 1))
-        for byte_pos in range(16):
-            # While a little bit more complex, below code is more efficient than
-            # a naive implementation that searches for all possible byte values
-            # in ``self.texts``.
-            sorted_indices = self.texts[:, byte_pos].argsort()
-            sorted_bytes = self.texts[sorted_indices, byte_pos]
-            # Find the indices where byte values change.
-            val_changes = np.where(np.roll(sorted_bytes, 1) != sorted_bytes)[0]
-            # Append the number of rows to be able to use ``pairwise``.
-            val_indices = list(val_changes) + [sorted_bytes.shape[0]]
-            for (start, end) in more_itertools.pairwise(val_indices):
-                byte_val = sorted_bytes[start]
-                cnts[byte_pos, byte_val] = end - start
-                act_indices = sorted_indices[start:end]
-                sums[byte_pos, byte_val] = self.traces[act_indices].sum(axis=0)
+        cnts, sums = None, None
+        for traces_to_use, texts, traces in self.iter_chunks():
+            cnts, sums = ceca_stats.count_and_sum_text_traces(texts[traces_to_use],
+                                                              traces[traces_to_use],
+                                                              cnts, sums,
+                                                              chunk_size=chunk_size)
         return cnts, sums
 
 
+class LocalWorkers:
+    """Runs ``TraceWorker`` instances one after another in this process."""
+
+    def __init__(self, worker_args):
+        """Inits the workers.
+
+        Args:
+            worker_args: ``TraceWorker`` arguments of every worker.
+        """
+        self.workers = [TraceWorker(*args) for args in worker_args]
+
+    def run(self, method, *args):
+        """Calls a ``TraceWorker`` method of all workers.
+
+        Yields:
+            The results of the workers in the order in which they complete.
+        """
+        for worker in self.workers:
+            yield getattr(worker, method)(*args)
+
+    def close(self):
+        pass
+
+
+class RayWorkers:
+    """Runs ``TraceWorker`` instances as Ray actors.
+
+    The working directory is uploaded to the Ray cluster.
+    """
+
+    def __init__(self, worker_args):
+        """Inits the workers.
+
+        Args:
+            worker_args: ``TraceWorker`` arguments of every worker.
+        """
+        # Ray is only needed for this backend.
+        import ray
+        self.ray = ray
+        ray.init(runtime_env={"working_dir": "../",
+                              "excludes": ["*.db", "*.cwp", "*.npy", "*.bit",
+                                           "*/lfs/*", "*.pack"]})
+        actor = ray.remote(TraceWorker)
+        self.workers = [actor.remote(*args) for args in worker_args]
+
+    def run(self, method, *args):
+        """Calls a ``TraceWorker`` method of all workers.
+
+        Yields:
+            The results of the workers in the order in which they complete.
+        """
+        tasks = [getattr(worker, method).remote(*args) for worker in self.workers]
+        while tasks:
+            done, tasks = self.ray.wait(tasks)
+            yield self.ray.get(done[0])
+
+    def close(self):
+        self.ray.shutdown()
+
+
+# Shared arrays of the process of a ``ProcessPoolWorkers`` pool.
+_shared_arrays = None
+
+
+def _open_shared_arrays(array_specs):
+    """Maps the shared arrays into a process of a ``ProcessPoolWorkers`` pool."""
+    global _shared_arrays
+    _shared_arrays = {name: np.memmap(filename, dtype=dtype, mode="r+", shape=shape)
+                      for name, (filename, dtype, shape) in array_specs.items()}
+
+
+def _load_shared_traces(project_file, trace_slice, attack_window, attack_direction,
+                        chunk_size=None):
+    """Loads the traces of a worker into the shared arrays."""
+    project = open_project(project_file)
+    texts, traces = load_traces(project, trace_slice, attack_window, attack_direction)
+    project.close(save=False)
+    _shared_arrays["texts"][trace_slice] = texts
+    _shared_arrays["traces"][trace_slice] = traces
+
+
+class SharedTraceWorker(TraceWorker):
+    """A ``TraceWorker`` operating on a slice of the shared arrays."""
+
+    def _load_traces(self):
+        """Returns views of the slice of the worker of the shared arrays.
+
+        Filtering updates the view of the shared mask in place.
+        """
+        if self.chunk_size is None:
+            texts = _shared_arrays["texts"][self.trace_slice]
+            traces = _shared_arrays["traces"][self.trace_slice]
+        else:
+            texts, traces = None, None
+        return texts, traces, _shared_arrays["traces_to_use"][self.trace_slice]
+
+
+def _run_shared_worker(worker_args, method, args):
+    """Calls a ``TraceWorker`` method for a slice of the shared arrays."""
+    return getattr(SharedTraceWorker(*worker_args), method)(*args)
+
+
+class ProcessPoolWorkers:
+    """Runs ``TraceWorker`` methods in a pool of local processes.
+
+    The texts, the traces and the filtering mask of all workers are stored in
+    memory-mapped scratch files shared by all processes, see
+    ``util.parallel.ScratchSpace``. Every call of a ``TraceWorker`` method is a
+    task operating on the slice of a worker in place. Set TMPDIR, e.g., to
+    /dev/shm, to keep the scratch files in memory. In streaming mode, only the
+    filtering mask is shared and the tasks load their traces chunk by chunk.
+    """
+
+    def __init__(self, worker_args):
+        """Inits the workers and loads their traces in parallel.
+
+        Args:
+            worker_args: ``TraceWorker`` arguments of every worker.
+        """
+        project_file, _, attack_window, _, chunk_size = worker_args[0]
+        self.worker_args = worker_args
+        num_traces = worker_args[-1][1].stop
+        num_samples = attack_window.stop - attack_window.start
+
+        self.scratch = ScratchSpace()
+        arrays = {"traces_to_use": self.scratch.zeros(num_traces, bool)}
+        arrays["traces_to_use"][:] = True
+        arrays["traces_to_use"].flush()
+        if chunk_size is None:
+            project = open_project(project_file)
+            wave_dtype = project.dtype()
+            project.close(save=False)
+            arrays["texts"] = self.scratch.zeros((num_traces, 16), np.uint8)
+            arrays["traces"] = self.scratch.zeros((num_traces, num_samples), wave_dtype)
+        array_specs = {name: (array.filename, array.dtype, array.shape)
+                       for name, array in arrays.items()}
+        self.pool = ProcessPoolExecutor(max_workers=len(worker_args),
+                                        initializer=_open_shared_arrays,
+                                        initargs=(array_specs,))
+        if chunk_size is None:
+            for future in as_completed([self.pool.submit(_load_shared_traces, *args)
+                                        for args in worker_args]):
+                future.result()
+
+    def run(self, method, *args):
+        """Calls a ``TraceWorker`` method of all workers.
+
+        Yields:
+            The results of the workers in the order in which they complete.
+        """
+        tasks = [self.pool.submit(_run_shared_worker, worker_args, method, args)
+                 for worker_args in self.worker_args]
+        for task in as_completed(tasks):
+            yield task.result()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+# Execution backends for the ``TraceWorker`` instances.
+WORKER_BACKENDS = {
+    "ray": RayWorkers,
+    "process": ProcessPoolWorkers,
+    "local": LocalWorkers,
+}
+
+
 def compute_mean_and_std(workers):
     """Computes mean and standard deviation of all traces.
 
@@ -194,38 +434,23 @@ def compute_mean_and_std(workers):
     instances.
 
     Args:
-        workers: ``TraceWorker`` handles.
+        workers: ``TraceWorker`` instances run by one of the ``WORKER_BACKENDS``.
 
     Returns:
         Mean and standard deviation of all traces.
     """
-    tasks = [worker.compute_stats.remote() for worker in workers]
-
-    running_sum_dev_prods = None
-    running_sum = None
-    running_cnt = 0
-    while tasks:
-        done, tasks = ray.wait(tasks)
-        cnt, sum_, sum_dev_prods = ray.get(done[0])
-        if running_cnt == 0:
-            running_sum_dev_prods = np.copy(sum_dev_prods)
-            running_sum = np.copy(sum_)
-            running_cnt += cnt
-        else:
-            running_sum_dev_prods += sum_dev_prods + (
-                (cnt * running_sum - running_cnt * sum_) ** 2 /
-                (cnt * running_cnt * (cnt + running_cnt))
-            )
-            running_sum += sum_
-            running_cnt += cnt
-    return running_sum / running_cnt, np.sqrt(running_sum_dev_prods / running_cnt)
+    stats = (0, None, None)
+    for worker_stats in workers.run("compute_stats"):
+        stats = ceca_stats.merge_stats(stats, worker_stats)
+    cnt, sum_, sum_dev_prods = stats
+    return sum_ / cnt, np.sqrt(sum_dev_prods / cnt)
 
 
 def filter_noisy_traces(workers, mean_trace, std_trace, max_std):
     """Signals ``TraceWorker`` instances to filter noisy traces.
 
     Args:
-        workers:``TraceWorker`` handles.
+        workers: ``TraceWorker`` instances run by one of the ``WORKER_BACKENDS``.
         mean_trace: Mean of all traces.
         std_trace: Standard deviation of all traces.
         max_std: Allowed number of standard deviations from the mean trace.
@@ -235,15 +460,7 @@ def filter_noisy_traces(workers, mean_trace, std_trace, max_std):
     """
     min_trace = mean_trace - max_std * std_trace
     max_trace = mean_trace + max_std * std_trace
-    tasks = [
-        worker.filter_noisy_traces.remote(min_trace, max_trace) for worker in workers
-    ]
-
-    running_cnt = 0
-    while tasks:
-        done, tasks = ray.wait(tasks)
-        running_cnt += ray.get(done[0])
-    return running_cnt
+    return sum(workers.run("filter_noisy_traces", min_trace, max_trace))
 
 
 def compute_mean_text_traces(workers):
@@ -253,19 +470,15 @@ def compute_mean_text_traces(workers):
     their results.
 
     Args:
-        workers: ``TraceWorker`` handles.
+        workers: ``TraceWorker`` instances run by one of the ``WORKER_BACKENDS``.
 
     Returns:
         A (16, 256, NUM_SAMPLES) array A, where A[i, j, :] is the mean of all
         traces where text byte i is j.
     """
-    tasks = [worker.count_and_sum_text_traces.remote() for worker in workers]
-
     running_cnt = None
     running_sum = None
-    while tasks:
-        done, tasks = ray.wait(tasks)
-        cnt, sum_ = ray.get(done[0])
+    for cnt, sum_ in workers.run("count_and_sum_text_traces"):
         if running_cnt is None:
             running_cnt = np.copy(cnt)
             running_sum = np.copy(sum_)
@@ -282,38 +495,22 @@ def compute_pairwise_diffs_and_scores(mean_traces):
     bytes.
 
     This function correlates mean text traces to pick the most likely
-    differences.
+    differences, see ``util.ceca_stats.compute_diff_corrcoefs()``.
 
     Args:
         mean_traces: A (16, 256, NUM_SAMPLES) array of mean text traces.
 
     Returns:
-        A (16, 16, 2) array A, where A[i, j, 0] is the difference with the
-        largest correlation coefficient between text bytes i and j, and
-        A[i, j, 1] is the corresponding confidence score.
+        A tuple ``(pairwise_diffs_scores, diff_corrcoefs)``, where
+            - ``pairwise_diffs_scores`` is a (16, 16, 2) array A, where
+              A[i, j, 0] is the difference with the largest correlation
+              coefficient between text bytes i and j, and A[i, j, 1] is the
+              corresponding confidence score, and
+            - ``diff_corrcoefs`` is a (16, 16, 256) array with the correlation
+              coefficients of all differences, used for key enumeration.
     """
-    pairwise_diffs_scores = np.zeros((16, 16, 2))
-    # All possible values of text byte a.
-    alphas = np.arange(256)
-    # All possible differences.
-    diffs = np.arange(256)[:, np.newaxis]
-    # Values of text byte b for all possible differences: A (256, 256)
-    # array where betas[i, j] = diffs[i] ^ alphas[j]
-    betas = alphas ^ diffs
-    # Compute the most likely differences between all pairs of text bytes.
-    for a in range(16):
-        for b in range(a + 1, 16):
-            corrcoefs = np.corrcoef(mean_traces[a], mean_traces[b])
-            # np.corrcoef returns the values that we want in the upper right
-            # quadrant.
-            diff_corrcoefs = corrcoefs[alphas, 256 + betas].sum(axis=1)
-            best_diff = diff_corrcoefs.argmax()
-            # TODO: Analyze the effect of /diff_corrcoefs.mean() below.
-            pairwise_diffs_scores[(a, b), (b, a)] = (
-                best_diff,
-                diff_corrcoefs[best_diff] / diff_corrcoefs.mean(),
-            )
-    return pairwise_diffs_scores
+    diff_corrcoefs = ceca_stats.compute_diff_corrcoefs(mean_traces)
+    return ceca_stats.find_pairwise_diffs_and_scores(diff_corrcoefs), diff_corrcoefs
 
 
 class DiffScore:
@@ -356,8 +553,8 @@ class DiffScore:
         return f"DiffScore({self._val})"
 
 
-def find_best_diffs(pairwise_diffs_scores):
-    """Finds the most likely differences between key bytes.
+def find_best_paths(pairwise_diffs_scores):
+    """Finds the paths of the most likely differences between key bytes.
 
     This function finds the most likely differences between key bytes using
     pairwise differences between all key bytes and their scores computed from
@@ -380,7 +577,8 @@ def find_best_diffs(pairwise_diffs_scores):
             key bytes and their confidence scores.
 
     Returns:
-        An array of differences where the ith element is key[0] ^ key[i].
+        A dictionary of paths, where ``paths[i]`` is the list of key bytes on
+        the path from key byte 0 to key byte i.
     """
     # Define an undirected graph where nodes are key bytes, edges represent
     # differences, and edge weights are confidence scores.
@@ -391,7 +589,22 @@ def find_best_diffs(pairwise_diffs_scores):
             # the most likely differences between key bytes.
             G.add_edge(a, b, weight=DiffScore(pairwise_diffs_scores[a, b, 1]))
     # Find paths from key byte 0 to all other bytes.
-    paths = nx.algorithms.shortest_paths.weighted.single_source_dijkstra_path(G, 0)
+    return nx.algorithms.shortest_paths.weighted.single_source_dijkstra_path(G, 0)
+
+
+def find_best_diffs(pairwise_diffs_scores):
+    """Finds the most likely differences between key bytes.
+
+    See ``find_best_paths()``.
+
+    Args:
+        pairwise_diffs_scores: A 16x16x2 matrix of pairwise differences between
+            key bytes and their confidence scores.
+
+    Returns:
+        An array of differences where the ith element is key[0] ^ key[i].
+    """
+    paths = find_best_paths(pairwise_diffs_scores)
     # Recover the paths and corresponding differences from key byte 0 to all
     # other bytes.
     diffs = np.zeros(16, dtype=np.uint8)
@@ -410,28 +623,168 @@ def recover_key(diffs, attack_direction, plaintext, ciphertext):
     the actual ciphertext.
 
     Args:
-        diffs: Differences between key bytes.
+        diffs: Differences between key bytes, or an (N, 16) array of
+            candidate differences tested in a single batch.
         attack_direction: Attack direction, 'input' or 'output'.
         plaintext: A plaintext, used for identifying the correct key.
         ciphertext: A ciphertext, used for identifying the correct key.
 
     Returns:
-        The AES key if successful, ``None`` otherwise.
+        A tuple ``(key, rank)`` with the AES key and its 1-based position among
+        the 256 * N key candidates if successful, ``(None, None)`` otherwise.
     """
-    # Create a matrix of all possible keys.
-    keys = np.zeros((256, 16), np.uint8)
-    for first_byte_val in range(256):
-        key = np.asarray([diffs[i] ^ first_byte_val for i in range(16)], np.uint8)
-        if attack_direction == AttackDirection.OUTPUT:
-            key = np.asarray(cwa.aes_funcs.key_schedule_rounds(key, 10, 0), np.uint8)
-        keys[first_byte_val] = key
+    # Create a matrix of all possible keys, 256 for each row of diffs.
+    diffs = np.atleast_2d(np.asarray(diffs, np.uint8))
+    keys = (diffs[:, np.newaxis, :] ^
+            np.arange(256, dtype=np.uint8)[np.newaxis, :, np.newaxis]).reshape(-1, 16)
+    if attack_direction == AttackDirection.OUTPUT:
+        keys = aes_inverse_key_schedule(keys)
     # Encrypt the plaintext using all candidates in parallel.
     ciphertexts = scared.aes.base.encrypt(plaintext, keys)
     # Recover the key.
-    key = keys[(ciphertexts == ciphertext).all(axis=1).nonzero()]
-    if key.size > 0:
-        return key
-    return None
+    matches = (ciphertexts == ciphertext).all(axis=1).nonzero()[0]
+    if matches.size > 0:
+        return keys[matches[0]], int(matches[0]) + 1
+    return None, None
+
+
+def enumerate_diffs(diff_corrcoefs, paths, max_candidates=None):
+    """Enumerates candidate differences between key bytes, most likely first.
+
+    The paths found by ``find_best_paths()`` form a spanning tree of the key
+    bytes. The differences along its 15 edges determine the differences between
+    key byte 0 and all other bytes. For every edge, the 256 possible
+    differences are ranked by the z-scores of their correlation coefficients,
+    the best one being the difference of ``find_best_diffs()``.
+
+    Candidates are enumerated in increasing order of their total z-score
+    deficit w.r.t. the best differences, using a priority queue over the rank
+    of the difference of every edge. The edges are sorted by the deficit of
+    their second best difference such that every candidate has a unique
+    predecessor with a smaller deficit: Increase the rank of the last edge with
+    a non-zero rank, increase the rank of the next edge to one, or move a rank
+    of one from the last edge to the next edge.
+
+    Every popped candidate pushes up to three successors, i.e., the queue grows
+    with the number of candidates. If ``max_candidates`` is given, the queue is
+    trimmed to the number of candidates that remain to be enumerated: Entries
+    beyond that are never popped and neither are their successors, whose
+    deficits are not smaller.
+
+    Args:
+        diff_corrcoefs: A 16x16x256 matrix of correlation coefficients of all
+            differences between key bytes.
+        paths: Paths returned by ``find_best_paths()``.
+        max_candidates: Maximum number of candidates to enumerate, unbounded
+            by default.
+
+    Yields:
+        Arrays of differences where the ith element is key[0] ^ key[i].
+    """
+    edges = [(paths[byte][-2], byte) for byte in range(1, 16)]
+    edge_diffs = []
+    edge_deficits = []
+    for a, b in edges:
+        corrcoefs = diff_corrcoefs[a, b]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            zscores = np.nan_to_num((corrcoefs - corrcoefs.mean()) / corrcoefs.std())
+        order = np.argsort(-zscores, kind="stable")
+        edge_diffs.append(order.tolist())
+        edge_deficits.append((zscores[order[0]] - zscores[order]).tolist())
+    edge_order = sorted(range(len(edges)), key=lambda e: edge_deficits[e][1])
+    edge_deficits = [edge_deficits[e] for e in edge_order]
+    # Parent, child, position in edge_order and ranked differences of every
+    # edge, sorted by the length of the path to the child, i.e., parents first.
+    tree = sorted(((*edges[e], i, edge_diffs[e]) for i, e in enumerate(edge_order)),
+                  key=lambda edge: len(paths[edge[1]]))
+
+    def diffs_of(ranks):
+        diffs = [0] * 16
+        for parent, byte, i, ranked_diffs in tree:
+            diffs[byte] = diffs[parent] ^ ranked_diffs[ranks[i]]
+        return np.array(diffs, dtype=np.uint8)
+
+    num_edges = len(edges)
+    # Entries: (deficit, ranks), where the ranks are stored as bytes to keep
+    # the entries small. Ties are broken by the ranks.
+    queue = [(0.0, bytes(num_edges))]
+    num_candidates = 0
+    while queue:
+        deficit, ranks = heapq.heappop(queue)
+        yield diffs_of(ranks)
+        num_candidates += 1
+        if max_candidates is not None:
+            remaining = max_candidates - num_candidates
+            if remaining <= 0:
+                return
+            # Trimming at twice the remaining candidates amortizes its cost.
+            if len(queue) >= 2 * remaining:
+                deficits = np.fromiter((entry[0] for entry in queue), float, len(queue))
+                cutoff = np.partition(deficits, remaining - 1)[remaining - 1]
+                queue = [entry for entry in queue if entry[0] <= cutoff]
+                heapq.heapify(queue)
+        # Index of the last edge with a non-zero rank.
+        last = len(ranks.rstrip(b"\x00")) - 1
+        if last >= 0 and ranks[last] < 255:
+            rank = ranks[last]
+            heapq.heappush(queue, (
+                deficit + edge_deficits[last][rank + 1] - edge_deficits[last][rank],
+                ranks[:last] + bytes((rank + 1,)) + ranks[last + 1:]))
+        if last + 1 < num_edges:
+            next_ = last + 1
+            heapq.heappush(queue, (deficit + edge_deficits[next_][1],
+                                   ranks[:next_] + b"\x01" + ranks[next_ + 1:]))
+            if last >= 0 and ranks[last] == 1:
+                heapq.heappush(queue, (
+                    deficit - edge_deficits[last][1] + edge_deficits[next_][1],
+                    ranks[:last] + b"\x00\x01" + ranks[next_ + 1:]))
+
+
+# Maximum number of candidate differences tested at a time, i.e., 65536 keys.
+ENUMERATION_BATCH_SIZE = 256
+# Upper limit of max_keys_log2. The priority queue of enumerate_diffs() keeps
+# up to about 140 bytes per candidate difference, i.e., 256 keys.
+MAX_KEYS_LOG2 = 36
+
+
+def enumerate_keys(diff_corrcoefs, paths, attack_direction, plaintext, ciphertext,
+                   max_keys):
+    """Recovers the AES key by testing candidate differences between key bytes.
+
+    Candidate differences from ``enumerate_diffs()`` are tested in batches of
+    increasing size using ``recover_key()`` until the key is found or
+    ``max_keys`` keys have been tested. The first candidate are the differences
+    of ``find_best_diffs()``.
+
+    Args:
+        diff_corrcoefs: A 16x16x256 matrix of correlation coefficients of all
+            differences between key bytes.
+        paths: Paths returned by ``find_best_paths()``.
+        attack_direction: Attack direction, 'input' or 'output'.
+        plaintext: A plaintext, used for identifying the correct key.
+        ciphertext: A ciphertext, used for identifying the correct key.
+        max_keys: Maximum number of keys to test.
+
+    Returns:
+        A tuple ``(key, rank)`` with the AES key and its 1-based position in
+        the enumeration if successful, ``(None, num_keys)`` with the number of
+        tested keys otherwise.
+    """
+    max_candidates = max(1, max_keys // 256)
+    candidates = enumerate_diffs(diff_corrcoefs, paths, max_candidates)
+    num_candidates = 0
+    batch_size = 1
+    while num_candidates < max_candidates:
+        batch = list(itertools.islice(
+            candidates, min(batch_size, max_candidates - num_candidates)))
+        if not batch:
+            break
+        key, rank = recover_key(np.array(batch), attack_direction, plaintext, ciphertext)
+        if key is not None:
+            return key, 256 * num_candidates + rank
+        num_candidates += len(batch)
+        batch_size = min(2 * batch_size, ENUMERATION_BATCH_SIZE)
+    return None, 256 * num_candidates
 
 
 def compare_diffs(pairwise_diffs_scores, attack_direction, correct_key):
@@ -464,7 +817,8 @@ def compare_diffs(pairwise_diffs_scores, attack_direction, correct_key):
 
 @timer()
 def perform_attack(
-    project_file, num_traces, attack_window, attack_direction, max_std, num_workers
+    project_file, num_traces, attack_window, attack_direction, max_std, num_workers,
+    backend="ray", chunk_size=None, max_keys_log2=24
 ):
     """Performs a correlation-enhanced power analysis collision attack.
 
@@ -473,7 +827,8 @@ def perform_attack(
         - Filters noisy traces (*),
         - Computes mean traces for all values of all plaintext/ciphertext bytes (*),
         - Guesses differences between each key byte, and
-        - Recovers the key using these differences.
+        - Recovers the key using these differences, enumerating less likely
+          differences if necessary.
 
     Steps marked with (*) above are implemented in a distributed manner: After
     creating ``num_workers`` number of ``TraceWorker`` instances, this function
@@ -493,33 +848,27 @@ def perform_attack(
         max_std: Allowed number of standard deviations from the mean trace for
             filtering noisy traces.
         num_workers: Number of workers to use for processing traces.
+        backend: Execution backend of the workers, one of ``WORKER_BACKENDS``.
+        chunk_size: Number of traces loaded at a time by each worker in
+            streaming mode. By default, the workers keep all of their traces in
+            memory.
+        max_keys_log2: Base-2 logarithm of the maximum number of key candidates
+            tested during key enumeration.
 
     Returns:
         Recovered key if the attack was successful, ``None`` otherwise.
     """
     # Translate potential relative path into absolute path. Needed for ray().
     project_file = str(Path(project_file).resolve())
-    # ChipWhisperer or ot_trace_library project?
-    project_type = "cw"
-    if ".db" in project_file:
-        project_type = 'ot_trace_library'
-
-    # Open the project.
-    project_cfg = ProjectConfig(type = project_type,
-                                path = project_file,
-                                wave_dtype = np.uint16,
-                                overwrite = False
-                                )
-    project = SCAProject(project_cfg)
-    project.open_project()
+    project = open_project(project_file)
 
     # Check arguments
-    num_total_traces = len(project.get_waves())
+    num_total_traces = project.num_traces()
     if num_traces > num_total_traces:
         raise ValueError(
             f"Invalid num_traces: {num_traces} (must be less than {num_total_traces})"
         )
-    last_sample = len(project.get_waves(0)) - 1
+    last_sample = project.num_samples() - 1
     if min(attack_window) < 0 or max(attack_window) > last_sample:
         raise ValueError(
             f"Invalid attack window: {attack_window} (must be in [0, {last_sample}])"
@@ -530,6 +879,18 @@ def perform_attack(
         raise ValueError(
             f"Invalid num_workers: {num_workers} (must be greater than zero)"
         )
+    if backend not in WORKER_BACKENDS:
+        raise ValueError(
+            f"Invalid backend: {backend} (must be one of {list(WORKER_BACKENDS)})"
+        )
+    if not 8 <= max_keys_log2 <= MAX_KEYS_LOG2:
+        raise ValueError(
+            f"Invalid max_keys_log2: {max_keys_log2} (must be in [8, {MAX_KEYS_LOG2}])"
+        )
+    if chunk_size is not None and chunk_size <= 0:
+        raise ValueError(
+            f"Invalid chunk_size: {chunk_size} (must be greater than zero)"
+        )
 
     # Instantiate workers
     def worker_trace_slices():
@@ -547,33 +908,42 @@ def perform_attack(
 
     # Attack window is inclusive.
     attack_window = slice(attack_window[0], attack_window[1] + 1)
-    workers = [
-        TraceWorker.remote(project_file, trace_slice, attack_window, attack_direction)
+    worker_args = [
+        (project_file, trace_slice, attack_window, attack_direction, chunk_size)
         for trace_slice in worker_trace_slices()
     ]
-    assert len(workers) == num_workers
-    # Compute mean and standard deviation.
-    mean, std_dev = compute_mean_and_std(workers)
-    # Filter noisy traces.
-    orig_num_traces = num_traces
-    num_traces = filter_noisy_traces(workers, mean, std_dev, max_std)
-    logging.info(
-        f"Will use {num_traces} traces "
-        f"({100*num_traces/orig_num_traces:.1f}% of all traces)"
-    )
-    # Mean traces for all values of all text bytes.
-    mean_text_traces = compute_mean_text_traces(workers)
+    assert len(worker_args) == num_workers
+    # The startup time includes loading the traces.
+    with codetiming.Timer(text=f"{backend} backend startup took {{seconds:.1f}}s",
+                          logger=logging.info):
+        workers = WORKER_BACKENDS[backend](worker_args)
+        assert sum(workers.run("num_traces")) == num_traces
+    with codetiming.Timer(text=f"{backend} backend run took {{seconds:.1f}}s",
+                          logger=logging.info):
+        # Compute mean and standard deviation.
+        mean, std_dev = compute_mean_and_std(workers)
+        # Filter noisy traces.
+        orig_num_traces = num_traces
+        num_traces = filter_noisy_traces(workers, mean, std_dev, max_std)
+        logging.info(
+            f"Will use {num_traces} traces "
+            f"({100*num_traces/orig_num_traces:.1f}% of all traces)"
+        )
+        # Mean traces for all values of all text bytes.
+        mean_text_traces = compute_mean_text_traces(workers)
+    workers.close()
     # Guess the differences between key bytes.
-    pairwise_diffs_scores = compute_pairwise_diffs_and_scores(mean_text_traces)
+    pairwise_diffs_scores, diff_corrcoefs = compute_pairwise_diffs_and_scores(mean_text_traces)
     diffs = find_best_diffs(pairwise_diffs_scores)
     logging.info(f"Difference values (delta_0_i): {diffs}")
-    # Recover the key.
-    key = recover_key(diffs, attack_direction, project.get_plaintexts(0),
-                      project.get_ciphertexts(0))
+    # Recover the key, enumerating less likely differences if necessary.
+    key, key_rank = enumerate_keys(diff_corrcoefs, find_best_paths(pairwise_diffs_scores),
+                                   attack_direction, project.get_plaintexts(0),
+                                   project.get_ciphertexts(0), 2**max_keys_log2)
     if key is not None:
-        logging.info(f"Recovered AES key: {bytes(key).hex()}")
+        logging.info(f"Recovered AES key: {bytes(key).hex()} (key rank: {key_rank})")
     else:
-        logging.error("Failed to recover the AES key")
+        logging.error(f"Failed to recover the AES key, tested {key_rank} keys")
     # Compare differences - both matrices are symmetric and have an all-zero main diagonal.
     correct_diffs = compare_diffs(pairwise_diffs_scores, attack_direction,
                                   project.get_keys(0))
@@ -635,6 +1005,33 @@ def parse_args():
         help="""number of workers to use for processing traces, must be greater
         than zero""",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=list(WORKER_BACKENDS),
+        default="ray",
+        help="""execution backend of the workers: ray actors, a pool of local
+        processes sharing the traces through memory-mapped files in TMPDIR,
+        or this process. Default: ray""",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        help="""stream the traces from PROJECT_FILE in chunks of CHUNK_SIZE
+        traces in every pass instead of keeping all traces in memory, bounds
+        the memory of each worker""",
+    )
+    parser.add_argument(
+        "-k",
+        "--max-keys-log2",
+        type=int,
+        default=24,
+        help=f"""base-2 logarithm of the maximum number of key candidates tested
+        if the most likely differences between key bytes don't give the key,
+        at most {MAX_KEYS_LOG2}. Time and memory double with every increment.
+        Default: 24""",
+    )
     return parser.parse_args()
 
 
@@ -658,9 +1055,6 @@ def main():
     attack."""
     args = parse_args()
     config_logger()
-    ray.init(runtime_env={"working_dir": "../",
-                          "excludes": ["*.db", "*.cwp", "*.npy", "*.bit",
-                                       "*/lfs/*", "*.pack"]})
 
     key = perform_attack(**vars(args))
     sys.exit(0 if key is not None else 1)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+# Append ot-sca root directory to path such that cpa.py can find the
+# project_library module located in the capture/ directory.
+ABS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ABS_PATH + '/..')
+import util.cpa_stats as cpa_stats  # noqa : E402
+from capture.project_library.project import ProjectConfig  # noqa : E402
+from capture.project_library.project import SCAProject  # noqa : E402
+from capture.project_library.project import get_project_type  # noqa : E402
+from util.leakage_models import aes_inverse_key_schedule  # noqa : E402
+from util.leakage_models import aes_key_schedule  # noqa : E402
+
+"""A streaming correlation power analysis (CPA) attack on AES-128.
+
+The correlations of all 16 x 256 key byte guesses are computed from
+incremental statistics, see ``cpa_stats.CpaAccumulator``. The traces are read
+in chunks and the memory does not depend on the number of traces. The rank of
+every key byte is reported at checkpoints without reprocessing the traces.
+
+Typical usage:
+>>> ./cpa.py -f PROJECT_FILE -a 1000 1200 -m sbox_output_hw -p 10000 -o cpa.npz
+"""
+
+
+def open_project(project_file):
+    """Opens a Chipwhisperer or ot_trace_library project for reading."""
+    project_cfg = ProjectConfig(type = get_project_type(project_file),
+                                path = project_file,
+                                wave_dtype = np.uint16,
+                                overwrite = False
+                                )
+    project = SCAProject(project_cfg)
+    project.open_project()
+    return project
+
+
+def get_checkpoints(num_traces, checkpoint_step, checkpoints):
+    """Returns the sorted numbers of traces after which the key ranks are
+    computed, always including num_traces."""
+    all_checkpoints = {num_traces}
+    if checkpoint_step is not None:
+        all_checkpoints.update(range(checkpoint_step, num_traces, checkpoint_step))
+    if checkpoints is not None:
+        all_checkpoints.update(c for c in checkpoints if 0 < c < num_traces)
+    return sorted(all_checkpoints)
+
+
+def perform_attack(project_file, num_traces, attack_window, leakage_model,
+                   chunk_size, checkpoint_step, checkpoints, output_file):
+    """Performs the CPA attack.
+
+    Args:
+        project_file: A Chipwhisperer or ot_trace_library project file.
+        num_traces: Number of traces to use, all traces by default.
+        attack_window: Attack window as a pair of sample indices, inclusive.
+        leakage_model: Name of the leakage model, see
+            ``cpa_stats.LEAKAGE_MODELS``.
+        chunk_size: Number of traces read at a time.
+        checkpoint_step: Compute the key ranks every checkpoint_step traces.
+        checkpoints: Additional numbers of traces to compute the key ranks at.
+        output_file: Optional .npz file for the key ranks at the checkpoints.
+
+    Returns:
+        Recovered key if the attack was successful, ``None`` otherwise.
+    """
+    model = cpa_stats.LEAKAGE_MODELS[leakage_model]()
+    project = open_project(project_file)
+    if num_traces is None:
+        num_traces = project.num_traces()
+    assert 0 < num_traces <= project.num_traces()
+    first_sample, last_sample = attack_window
+    num_samples = last_sample - first_sample + 1
+
+    # The ranks are computed for the round key of the model, the correct key
+    # is the key of the first trace.
+    correct_key = project.get_keys_array(0, 1)[0]
+    correct_round_key = aes_key_schedule(correct_key[np.newaxis])[model.round_key, 0]
+
+    accumulator = cpa_stats.CpaAccumulator(model, num_samples)
+    checkpoints = get_checkpoints(num_traces, checkpoint_step, checkpoints)
+    all_ranks = []
+    start = 0
+    with tqdm(total=num_traces, desc="Processing traces", ncols=80) as pbar:
+        for checkpoint in checkpoints:
+            for chunk_start in range(start, checkpoint, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, checkpoint)
+                if model.text == "plaintexts":
+                    texts = project.get_plaintexts_array(chunk_start, chunk_end)
+                else:
+                    texts = project.get_ciphertexts_array(chunk_start, chunk_end)
+                traces = project.get_waves_array(chunk_start, chunk_end, first_sample,
+                                                 num_samples)
+                accumulator.update(texts, traces)
+                pbar.update(chunk_end - chunk_start)
+            start = checkpoint
+            ranks, round_key_guess = cpa_stats.compute_key_ranks(
+                accumulator.compute_correlations(), correct_round_key)
+            all_ranks.append(ranks)
+            logging.info(f"{checkpoint} traces: key byte ranks {ranks.tolist()}, "
+                         f"{np.count_nonzero(ranks == 0)}/16 key bytes recovered, "
+                         f"mean rank {ranks.mean():.1f}")
+    project.close(save=False)
+
+    if model.round_key == 10:
+        key = aes_inverse_key_schedule(round_key_guess[np.newaxis])[0]
+    else:
+        key = round_key_guess
+    logging.info(f"Key guess:   {key.tobytes().hex()}")
+    logging.info(f"Correct key: {correct_key.tobytes().hex()}")
+    if output_file is not None:
+        np.savez(output_file, checkpoints=np.array(checkpoints), ranks=np.array(all_ranks),
+                 key_guess=key, correct_key=correct_key)
+    if np.array_equal(key, correct_key):
+        logging.info("SUCCESS")
+        return key
+    logging.info("FAILED")
+    return None
+
+
+def parse_args():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="""A streaming correlation power analysis (CPA) attack on
+        AES-128 reporting the key byte ranks at checkpoints."""
+    )
+    parser.add_argument(
+        "-f", "--project-file", required=True,
+        help="chipwhisperer or ot_trace_library project file"
+    )
+    parser.add_argument(
+        "-n",
+        "--num-traces",
+        type=int,
+        help="""number of traces to use, must be less than or equal to the
+        number of traces in PROJECT_FILE. Default: all traces""",
+    )
+    parser.add_argument(
+        "-a",
+        "--attack-window",
+        type=int,
+        nargs=2,
+        metavar=("FIRST_SAMPLE", "LAST_SAMPLE"),
+        required=True,
+        help="""attack window as a pair of sample indices, inclusive""",
+    )
+    parser.add_argument(
+        "-m",
+        "--leakage-model",
+        choices=list(cpa_stats.LEAKAGE_MODELS),
+        default="sbox_output_hw",
+        help="""leakage model: Hamming weight of the S-box output of the first
+        round or Hamming distance of the state register in the last round.
+        Default: sbox_output_hw""",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="""number of traces read from PROJECT_FILE at a time, bounds the
+        memory used for the traces. Default: 10000""",
+    )
+    parser.add_argument(
+        "-p",
+        "--checkpoint-step",
+        type=int,
+        help="""compute the key byte ranks every CHECKPOINT_STEP traces""",
+    )
+    parser.add_argument(
+        "-k",
+        "--checkpoints",
+        type=int,
+        nargs="+",
+        help="""additional numbers of traces after which the key byte ranks
+        are computed""",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        help=""".npz file to store the checkpoints and the key byte ranks""",
+    )
+    return parser.parse_args()
+
+
+def config_logger():
+    """Configures the root logger."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    sh = logging.StreamHandler()
+    sh.setLevel(logging.INFO)
+    formatter = logging.Formatter(
+        "%(asctime)s %(levelname)s %(filename)s:%(lineno)d -- %(message)s"
+    )
+    sh.setFormatter(formatter)
+    logger.addHandler(sh)
+    return logger
+
+
+def main():
+    """Parses command-line arguments, configures logging, and performs the
+    attack."""
+    args = parse_args()
+    config_logger()
+
+    key = perform_attack(**vars(args))
+    sys.exit(0 if key is not None else 1)
+
+
+if __name__ == "__main__":
+    main()
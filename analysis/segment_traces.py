@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+
+ABS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ABS_PATH + '/..')
+import util.helpers as helpers  # noqa : E402
+import util.segmentation as segmentation  # noqa : E402
+from capture.project_library.project import ProjectConfig  # noqa : E402
+from capture.project_library.project import SCAProject  # noqa : E402
+from capture.project_library.project import get_project_type  # noqa : E402
+
+logger = logging.getLogger()
+
+# Text and key of the segments of waves loaded from .npy files.
+NPY_TEXT_LEN_BYTES = 16
+
+
+def parse_arguments(argv):
+    """ Command line argument parsing.
+
+    Args:
+        argv: The command line arguments.
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Split long waves into one trace per iteration")
+    parser.add_argument("-i",
+                        "--project_in",
+                        dest="project_in",
+                        type=helpers.ap_check_file_exists,
+                        required=True,
+                        help="Path of the input project or of a .npy file with the waves")
+    parser.add_argument("-o",
+                        "--project_out",
+                        dest="project_out",
+                        type=helpers.ap_check_dir_exists,
+                        required=True,
+                        help="Path of the output project")
+    parser.add_argument("-p",
+                        "--period",
+                        dest="period",
+                        type=int,
+                        required=True,
+                        help="Expected number of samples of an iteration")
+    parser.add_argument("-t",
+                        "--tolerance",
+                        dest="tolerance",
+                        type=float,
+                        required=False,
+                        default=0.1,
+                        help="Tolerable deviation from the expected period relative to the "
+                             "period. Boundaries closer than period * (1 - tolerance) are "
+                             "merged")
+    parser.add_argument("-l",
+                        "--segment_length",
+                        dest="segment_length",
+                        type=int,
+                        required=False,
+                        help="Number of samples of every segment, by default "
+                             "period * (1 - tolerance)")
+    parser.add_argument("-fc",
+                        "--filter_cutoff",
+                        dest="filter_cutoff",
+                        type=float,
+                        required=False,
+                        default=0.12,
+                        help="Cutoff frequency of the high-pass filter relative to the Nyquist "
+                             "frequency")
+    parser.add_argument("-ft",
+                        "--filter_taps",
+                        dest="filter_taps",
+                        type=int,
+                        required=False,
+                        default=101,
+                        help="Number of taps of the high-pass filter, must be odd")
+    parser.add_argument("-w",
+                        "--window",
+                        dest="window",
+                        type=int,
+                        required=False,
+                        help="Number of samples of the moving average, by default period / 10")
+    parser.add_argument("-cs",
+                        "--chunk_samples",
+                        dest="chunk_samples",
+                        type=int,
+                        required=False,
+                        default=2**22,
+                        help="Number of samples of a wave filtered at a time")
+    parser.add_argument("-m",
+                        "--max_traces_mem",
+                        dest="max_traces_mem",
+                        type=int,
+                        required=False,
+                        default=1000,
+                        help="Maximum amount of segments held in memory before writing them")
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+class NpyWaves:
+    """ Waves of a .npy file, memory-mapped such that they are never loaded at once.
+    """
+    def __init__(self, path):
+        self.waves = np.load(path, mmap_mode="r")
+        if self.waves.ndim == 1:
+            self.waves = self.waves[np.newaxis]
+        self.text = np.zeros(NPY_TEXT_LEN_BYTES, dtype=np.uint8)
+
+    def num_traces(self):
+        return len(self.waves)
+
+    def dtype(self):
+        return self.waves.dtype
+
+    def get_metadata(self):
+        return {}
+
+    def get_trace(self, index):
+        return self.waves[index], self.text, self.text, self.text
+
+    def close(self, save):
+        pass
+
+
+class ProjectWaves:
+    """ Waves of a project. Memory-mapped projects return views of the waves, the other
+    projects read one wave at a time.
+    """
+    def __init__(self, path):
+        project_cfg = ProjectConfig(type = get_project_type(path, default="ot_trace_library"),
+                                    path = path,
+                                    wave_dtype = np.uint16,
+                                    overwrite = False)
+        self.project = SCAProject(project_cfg)
+        self.project.open_project()
+
+    def num_traces(self):
+        return self.project.num_traces()
+
+    def dtype(self):
+        return self.project.dtype()
+
+    def get_metadata(self):
+        return self.project.get_metadata()
+
+    def get_trace(self, index):
+        return (self.project.get_waves_array(index, index + 1)[0],
+                self.project.get_plaintexts_array(index, index + 1)[0],
+                self.project.get_ciphertexts_array(index, index + 1)[0],
+                self.project.get_keys_array(index, index + 1)[0])
+
+    def close(self, save):
+        self.project.close(save=save)
+
+
+def segment_wave(args, wave, taps, segment_length):
+    """ Finding the boundaries of the iterations of a wave.
+
+    Args:
+        args: The command line arguments.
+        wave: The wave.
+        taps: The taps of the high-pass filter.
+        segment_length: Number of samples of every segment.
+
+    Returns:
+        A tuple ``(boundaries, iterations)`` with the first sample and the iteration number of
+        every segment that is completely within the wave.
+    """
+    min_distance = int(args.period * (1 - args.tolerance))
+    window = args.window or max(1, args.period // 10)
+    boundaries = np.fromiter(segmentation.find_boundaries(wave, taps, window, min_distance,
+                                                          args.chunk_samples), dtype=int)
+    iterations = segmentation.number_iterations(boundaries, args.period)
+    max_distance = args.period * (1 + args.tolerance)
+    num_gaps = np.count_nonzero(np.diff(boundaries) > max_distance)
+    if num_gaps:
+        logger.warning(f"{num_gaps} gaps over {max_distance:.0f} samples between iterations, "
+                       f"{iterations[-1] + 1 - len(boundaries)} iterations were missed")
+    in_wave = boundaries + segment_length <= len(wave)
+    return boundaries[in_wave], iterations[in_wave]
+
+
+def main(argv=None):
+    # Configure the logger.
+    logger.setLevel(logging.INFO)
+    console = logging.StreamHandler()
+    logger.addHandler(console)
+
+    #  Parse the provided arguments.
+    args = parse_arguments(argv)
+    segment_length = args.segment_length or int(args.period * (1 - args.tolerance))
+    taps = segmentation.design_highpass(args.filter_taps, args.filter_cutoff)
+
+    logger.info(f"Opening {args.project_in}")
+    if str(args.project_in).endswith(".npy"):
+        waves_in = NpyWaves(args.project_in)
+    else:
+        waves_in = ProjectWaves(args.project_in)
+
+    # Create output database.
+    logger.info(f"Creating new DB {args.project_out}")
+    project_out_cfg = ProjectConfig(type = get_project_type(args.project_out,
+                                                            default="ot_trace_library"),
+                                    path = args.project_out,
+                                    wave_dtype = np.dtype(waves_in.dtype()),
+                                    overwrite = True,
+                                    trace_threshold = args.max_traces_mem)
+    project_out = SCAProject(project_out_cfg)
+    project_out.create_project()
+
+    # Wave, iteration and first sample of every segment.
+    segment_waves = []
+    segment_iterations = []
+    segment_offsets = []
+    for index in range(waves_in.num_traces()):
+        wave, plaintext, ciphertext, key = waves_in.get_trace(index)
+        boundaries, iterations = segment_wave(args, wave, taps, segment_length)
+        logger.info(f"Wave {index}: {len(boundaries)} segments of iterations 0 to "
+                    f"{iterations[-1] if len(iterations) else -1}")
+        # Write the segments in batches, the wave is only read at the segments.
+        for start in range(0, len(boundaries), args.max_traces_mem):
+            batch = boundaries[start:start + args.max_traces_mem]
+            waves = np.stack([wave[boundary:boundary + segment_length] for boundary in batch])
+            project_out.append_traces(waves,
+                                      np.tile(plaintext, (len(batch), 1)),
+                                      np.tile(ciphertext, (len(batch), 1)),
+                                      np.tile(key, (len(batch), 1)))
+        segment_waves.extend([index] * len(boundaries))
+        segment_iterations.extend(iterations.tolist())
+        segment_offsets.extend(boundaries.tolist())
+
+    metadata_out = dict(waves_in.get_metadata())
+    metadata_out.update({"num_traces": len(segment_offsets),
+                         "num_samples": segment_length,
+                         "segment_waves": segment_waves,
+                         "segment_iterations": segment_iterations,
+                         "segment_offsets": segment_offsets})
+    project_out.write_metadata(metadata_out)
+    logger.info(f"Wrote {len(segment_offsets)} segments of {segment_length} samples")
+    waves_in.close(save=False)
+    project_out.close(save=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,35 +6,24 @@ import argparse
 import logging
 import os
 import sys
-from dataclasses import dataclass
 from pathlib import Path
 
-import chipwhisperer as cw
 import numpy as np
-from joblib import Parallel, delayed
-from tqdm import tqdm
+import yaml
 
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(ABS_PATH + '/..')
 import util.helpers as helpers  # noqa : E402
+import util.preprocessing as preprocessing  # noqa : E402
 from capture.project_library.project import ProjectConfig  # noqa : E402
 from capture.project_library.project import SCAProject  # noqa : E402
+from capture.project_library.project import get_project_type  # noqa : E402
 from util import check_version  # noqa : E402
 from util import plot  # noqa : E402
 
 logger = logging.getLogger()
 
 
-@dataclass
-class Trace:
-    """ Configuration class for the current capture.
-    """
-    wave: list
-    plaintext: list
-    ciphertext: list
-    key: list
-
-
 def parse_arguments(argv):
     """ Command line argument parsing.
 
@@ -67,6 +56,11 @@ def parse_arguments(argv):
                         dest="align_enable",
                         action='store_true',
                         help="Aligtn the traces")
+    parser.add_argument("-e",
+                        "--elastic_align_enable",
+                        dest="elastic_align_enable",
+                        action='store_true',
+                        help="Align the traces elastically with banded DTW")
     parser.add_argument("-s",
                         "--num_sigmas",
                         dest="num_sigmas",
@@ -87,7 +81,7 @@ def parse_arguments(argv):
                         type=int,
                         required=False,
                         default=1,
-                        help="Number of cores used for the trace alignment")
+                        help="Number of processes used for preprocessing")
     parser.add_argument("-p",
                         "--print_num_traces",
                         dest="print_num_traces",
@@ -122,6 +116,20 @@ def parse_arguments(argv):
                         required=False,
                         help="Maximum shift for trace aligning. Would more "
                              "shift be needed, the trace gets discarded")
+    parser.add_argument("-r",
+                        "--dtw_radius",
+                        dest="dtw_radius",
+                        type=int,
+                        required=False,
+                        help="Radius of the DTW band for elastic aligning, i.e., "
+                             "the maximum shift of a sample")
+    parser.add_argument("-y",
+                        "--pipeline",
+                        dest="pipeline",
+                        type=helpers.ap_check_file_exists,
+                        required=False,
+                        help="Path of a YAML file defining the stages of the "
+                             "preprocessing pipeline, replaces -f and -a")
 
     args = parser.parse_args(argv)
 
@@ -142,7 +150,7 @@ def print_traces(args, project: SCAProject, filename: Path, ref_trace = None):
     if metadata["num_traces"] < args.print_num_traces:
         num_traces = metadata["num_traces"]
     logger.info(f"Printing {str(filename)}.html...")
-    plot.save_plot_to_file(project.get_waves(0, num_traces),
+    plot.save_plot_to_file(project.get_waves_array(0, num_traces),
                            set_indices = None,
                            num_traces = num_traces,
                            outfile = filename,
@@ -150,211 +158,74 @@ def print_traces(args, project: SCAProject, filename: Path, ref_trace = None):
                            ref_trace = ref_trace)
 
 
-def filter_traces(args: dict, project_in: SCAProject, project_out: SCAProject):
-    """ Filter traces.
+def get_pipeline_cfg(args) -> dict:
+    """ Get the configuration of the preprocessing pipeline.
 
-    This function filters all traces that contain values over the tolerable
-    deviation from average (num_sigmas). Only up to max_traces_mem traces are
-    held in memory.
+    The pipeline is either loaded from the YAML file provided with --pipeline
+    or built from the filtering and aligning command line arguments.
 
     Args:
         args: The command line arguments.
-        project_in: The project provided.
-        project_out: The new project containing the filtered traces.
+
+    Returns:
+        The pipeline configuration with the list of stages.
     """
+    if args.pipeline is not None:
+        if args.filter_enable or args.align_enable or args.elastic_align_enable:
+            raise RuntimeError("Filtering and aligning are configured in the "
+                               "pipeline file when using --pipeline.")
+        with open(args.pipeline) as f:
+            cfg = yaml.load(f, Loader=yaml.FullLoader)
+        return cfg
+    stages = []
     if args.filter_enable:
-        metadata_in = project_in.get_metadata()
-        logger.info(f"Start filtering {metadata_in['num_traces']} traces with "
-                    f"num_sigmas={args.num_sigmas}...")
-        trace_end = 0
-        num_filtered_traces = 0
-        max_traces_mem = args.max_traces_mem
-        if metadata_in["num_traces"] < args.max_traces_mem:
-            max_traces_mem = metadata_in["num_traces"]
-        # Iterate over the traces, keep max. max_traces_mem in memory.
-        for trace_it in range(0, metadata_in["num_traces"], max_traces_mem):
-            trace_end += max_traces_mem
-            # Fetch trace, plaintext, ciphertext, and key from DB.
-            in_traces = np.array(project_in.get_waves(trace_it, trace_end))
-            in_ptx = np.array(project_in.get_plaintexts(trace_it, trace_end))
-            in_ctx = np.array(project_in.get_ciphertexts(trace_it, trace_end))
-            in_k = np.array(project_in.get_keys(trace_it, trace_end))
-            # Calculate min and max value for current trace set.
-            mean = in_traces.mean(axis=0)
-            std = in_traces.std(axis=0)
-            max_trace = mean + args.num_sigmas * std
-            min_trace = mean - args.num_sigmas * std
-            # Filter traces.
-            traces_to_use = np.zeros(len(in_traces), dtype=bool)
-            traces_to_use = np.all((in_traces >= min_trace) &
-                                   (in_traces <= max_trace), axis=1)
-            out_traces = in_traces[traces_to_use]
-            out_ptx = in_ptx[traces_to_use]
-            out_ctx = in_ctx[traces_to_use]
-            out_k = in_k[traces_to_use]
-            # Store into output project.
-            for idx in range(len(out_traces)):
-                project_out.append_trace(wave = out_traces[idx],
-                                         plaintext = out_ptx[idx],
-                                         ciphertext = out_ctx[idx],
-                                         key = out_k[idx])
-                num_filtered_traces += 1
-            project_out.save()
-            # Free memory.
-            in_traces = None
-            in_ptx = None
-            in_ctx = None
-            in_k = None
-        project_in.close(save=False)
-        # Update metadata.
-        metadata_out = project_out.get_metadata()
-        metadata_out["num_traces"] = num_filtered_traces
-        project_out.write_metadata(metadata_out)
-        # Logging.
-        trace_diff = metadata_in["num_traces"] - num_filtered_traces
-        logger.info(f"Filtered {trace_diff} traces, new trace set contains "
-                    f"{num_filtered_traces} traces")
-        print_traces(args, project_out, "traces_filtered")
-        return project_out
-    else:
-        return project_in
-
-
-def align_traces_process(args: dict, in_traces: list, in_ptx: list,
-                         in_ctx: list, in_k: list, ref_trace: Trace,
-                         job_id: str):
-    """ Align traces function to be distributed to multiple processes.
+        stages.append({"type": "sigma_filter",
+                       "num_sigmas": args.num_sigmas})
+    if args.align_enable:
+        stages.append({"type": "align",
+                       "low_window": args.low_window,
+                       "high_window": args.high_window,
+                       "max_shift": args.max_shift,
+                       "num_traces_mean": args.num_traces_mean})
+    if args.elastic_align_enable:
+        stages.append({"type": "elastic_align",
+                       "radius": args.dtw_radius,
+                       "num_traces_mean": args.num_traces_mean})
+    return {"stages": stages}
+
+
+def preprocess_traces(args, pipeline_cfg: dict, project_in: SCAProject,
+                      project_out: SCAProject, num_traces: int):
+    """ Preprocess traces.
+
+    This function runs the stages of the pipeline on chunks of max_traces_mem
+    traces, distributed to num_cores processes. Every chunk is read once from
+    the input project and written to the output project with a single bulk
+    write. The number of traces and the throughput of every stage are logged.
 
     Args:
         args: The command line arguments.
-        in_traces: The input traces.
-        in_ptx: The input plaintexts.
-        in_ctx: The input ciphertexts.
-        in_k: The input keys.
-        ref_trace: The reference trace.
-        job_id: The identifier for the current job.
-    """
-    # Create configuration for a temporary project. Needed to convert DB to
-    # CW database as we utilize functionality from CW for the trace
-    # alignment.
-    tmp_project_path = str(Path(args.project_out).parent) + "/tmp" + job_id + ".cwp"
-    tmp_project = ProjectConfig(type = "cw", path = tmp_project_path,
-                                wave_dtype = np.uint16, overwrite = True,
-                                trace_threshold = args.max_traces_mem)
-    cw_project = SCAProject(tmp_project)
-    cw_project.create_project()
-    # Convert SCAProject into ChipWhisperer project.
-    # Insert reference mean trace into position 0 of the CW library.
-    # This trace will be removed after processing the trace set.
-    cw_project.append_trace(wave = ref_trace.wave,
-                            plaintext = ref_trace.plaintext,
-                            ciphertext = ref_trace.ciphertext,
-                            key = ref_trace.key)
-    for idx, trace in enumerate(in_traces):
-        cw_project.append_trace(wave = trace,
-                                plaintext = in_ptx[idx],
-                                ciphertext = in_ctx[idx],
-                                key = in_k[idx])
-
-    # Align traces using CW functionality.
-    resync_traces = cw.analyzer.preprocessing.ResyncSAD(cw_project.project)
-    resync_traces.ref_trace = 0
-    resync_traces.target_window = (args.low_window, args.high_window)
-    resync_traces.max_shift = args.max_shift
-    # Append traces to array.
-    traces = []
-    for i in range(resync_traces.num_traces()):
-        if resync_traces.get_trace(i) is None:
-            continue
-        # Write traces back to output project.
-        # Do not include reference trace that we generated before.
-        if (resync_traces.get_textin(i) is not ref_trace.plaintext and
-                resync_traces.get_textout(i) is not ref_trace.ciphertext and
-                resync_traces.get_known_key(i) is not ref_trace.key):
-            trace = Trace(wave = resync_traces.get_trace(i).astype(np.uint16),
-                          plaintext = resync_traces.get_textin(i),
-                          ciphertext = resync_traces.get_textout(i),
-                          key = resync_traces.get_known_key(i))
-            traces.append(trace)
-    cw_project.close(save=False)
-    in_traces = []
-    in_ptx = []
-    in_ctx = []
-    in_k = []
-    return traces
-
-
-def align_traces(args: dict, project_in: SCAProject, project_out: SCAProject):
-    """ Align traces.
-
-    This function aligns all traces using a window (defined with the
-    low_window and high_window command line argument) with the "Sum of
-    Absolute Difference (SAD)" algorithm provided in the ChipWhisperer ResyncSAD
-    function. A reference trace is used that consists of the mean of
-    num_traces_mean traces.
-    Args:
-        args: The command line arguments.
+        pipeline_cfg: The pipeline configuration.
         project_in: The project provided.
-        project_out: The new project containing the filtered traces.
+        project_out: The new project containing the preprocessed traces.
+        num_traces: The number of traces in the project provided.
+
+    Returns:
+        The number of preprocessed traces.
     """
-    if args.align_enable:
-        metadata = project_in.get_metadata()
-        logger.info(f"Start aligning {metadata['num_traces']} traces...")
-
-        # Calculate the mean of num_traces_mean traces and use as reference
-        # trace for the aligning.
-        traces_mean = project_in.get_waves(1, args.num_traces_mean)
-        traces_new = np.empty((len(traces_mean), len(traces_mean[0])), dtype=np.uint16)
-        for i_trace in range(len(traces_mean)):
-            traces_new[i_trace] = traces_mean[i_trace]
-        ref_mean_wave = traces_new.mean(axis=0).astype(np.uint16)
-        ref_ptx = np.zeros(len(project_in.get_plaintexts(0)), dtype=np.uint16)
-        ref_ctx = np.zeros(len(project_in.get_ciphertexts(0)), dtype=np.uint16)
-        ref_k = np.zeros(len(project_in.get_keys(0)), dtype=np.uint16)
-        ref_trace = Trace(wave = ref_mean_wave, plaintext = ref_ptx,
-                          ciphertext = ref_ctx, key = ref_k)
-        # Iterate over the traces, keep max. max_traces_mem in memory.
-        num_traces_aligned = 0
-        trace_end = 0
-        max_traces_mem_core = args.max_traces_mem
-        if metadata["num_traces"] < args.max_traces_mem:
-            max_traces_mem_core = int(metadata["num_traces"] / args.num_cores)
-        max_traces_mem_total = max_traces_mem_core * args.num_cores
-        for trace_it in tqdm(range(0, metadata["num_traces"], max_traces_mem_total),
-                             desc="Aligning", ncols=80,
-                             unit=str(max_traces_mem_total) + " traces"):
-            # Get current trace set.
-            trace_end = trace_it + max_traces_mem_total
-            in_traces = project_in.get_waves(trace_it, trace_end)
-            in_ptx = project_in.get_plaintexts(trace_it, trace_end)
-            in_ctx = project_in.get_ciphertexts(trace_it, trace_end)
-            in_k = project_in.get_keys(trace_it, trace_end)
-            # Distribute trace aligning to multiple processes.
-            aligned_traces_total = Parallel(n_jobs=args.num_cores)(delayed(
-                align_traces_process)(args, in_traces[i:i + max_traces_mem_core],
-                                      in_ptx[i:i + max_traces_mem_core],
-                                      in_ctx[i:i + max_traces_mem_core],
-                                      in_k[i:i + max_traces_mem_core],
-                                      ref_trace, str(trace_it + i))
-                for i in range(0, trace_end, max_traces_mem_core))
-            # Store aligned traces in output project.
-            for align_traces in aligned_traces_total:
-                for aligned_trace in align_traces:
-                    project_out.append_trace(wave = aligned_trace.wave,
-                                             plaintext = aligned_trace.plaintext,
-                                             ciphertext = aligned_trace.ciphertext,
-                                             key = aligned_trace.key)
-                    num_traces_aligned += 1
-            project_out.save()
-            # Free memory.
-            in_traces = None
-            in_ptx = None
-            in_ctx = None
-            in_k = None
-        metadata["num_traces"] = num_traces_aligned
-        project_out.write_metadata(metadata)
-        logger.info(f"Aligned {num_traces_aligned} traces")
-        print_traces(args, project_out, "traces_aligned", ref_mean_wave)
+    pipeline = preprocessing.Pipeline(pipeline_cfg["stages"])
+    stage_names = [name for name, _ in pipeline.stages]
+    logger.info(f"Start preprocessing {num_traces} traces with stages {stage_names}...")
+    num_traces_out = pipeline.run(project_in, project_out,
+                                  chunk_size = args.max_traces_mem,
+                                  num_jobs = args.num_cores,
+                                  wave_dtype = pipeline_cfg.get("wave_dtype"),
+                                  num_traces = num_traces)
+    project_out.save()
+    pipeline.report()
+    logger.info(f"Preprocessed {num_traces} traces, new trace set contains "
+                f"{num_traces_out} traces")
+    return num_traces_out
 
 
 def main(argv=None):
@@ -369,12 +240,12 @@ def main(argv=None):
     #  Parse the provided arguments.
     args = parse_arguments(argv)
 
+    pipeline_cfg = get_pipeline_cfg(args)
+
     # Open the existing project and create the new project containing the
-    # filtered traces.
-    type = "ot_trace_library"
-    if "cwp" in str(args.project_in):
-        type = "cw"
-    logger.info(f"Opening DB {args.project_out}")
+    # preprocessed traces.
+    type = get_project_type(args.project_in, default="ot_trace_library")
+    logger.info(f"Opening DB {args.project_in}")
     project_in_cfg = ProjectConfig(type = type,
                                    path = args.project_in,
                                    wave_dtype = np.uint16,
@@ -387,35 +258,29 @@ def main(argv=None):
     num_traces = metadata_in.get("num_traces")
     if num_traces is None:
         # Database does not contain num_traces in the metadata entry.
-        # Open the traces, get the number of traces, and close it.
-        waves = project_in.get_waves()
-        num_traces = len(waves)
-        waves = None
+        num_traces = project_in.num_traces()
     print_traces(args, project_in, "traces_input")
 
     # Create output database.
     logger.info(f"Creating new DB {args.project_out}")
+    wave_dtype = pipeline_cfg.get("wave_dtype") or project_in.dtype()
     project_out_cfg = ProjectConfig(type = type,
                                     path = args.project_out,
-                                    wave_dtype = np.uint16,
+                                    wave_dtype = np.dtype(wave_dtype),
                                     overwrite = True,
                                     trace_threshold = args.max_traces_mem)
     project_out = SCAProject(project_out_cfg)
     project_out.create_project()
-    project_out.write_metadata(metadata_in)
-
-    # Trace filtering step.
-    project_in = filter_traces(args, project_in, project_out)
-
-    # If we modified the output database, reopen it.
-    if args.filter_enable:
-        project_out = SCAProject(project_out_cfg)
-        project_out.create_project()
-        project_out.write_metadata(project_in.get_metadata())
 
-    # Trace aligning step. If we changed the DB in the trace filtering step,
-    # use these traces.
-    align_traces(args, project_in, project_out)
+    # Preprocess the traces in a single pass.
+    num_traces_out = preprocess_traces(args, pipeline_cfg, project_in, project_out,
+                                       num_traces)
+    metadata_out = dict(metadata_in)
+    metadata_out["num_traces"] = num_traces_out
+    if "num_samples" in metadata_out and num_traces_out > 0:
+        metadata_out["num_samples"] = project_out.num_samples()
+    project_out.write_metadata(metadata_out)
+    print_traces(args, project_out, "traces_preprocessed")
     project_in.close(save=False)
     project_out.close(save=True)
 
@@ -16,27 +16,41 @@ import matplotlib.pyplot as plt
 import numpy as np
 import typer
 import yaml
-from joblib import Parallel, delayed
 
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(ABS_PATH + '/..')
 import util.plot as plot  # noqa : E402
 from capture.project_library.project import ProjectConfig  # noqa : E402
 from capture.project_library.project import SCAProject  # noqa : E402
-from util.histograms import compute_histograms_aes_bit  # noqa : E402
-from util.histograms import compute_histograms_aes_byte  # noqa : E402
-from util.histograms import compute_histograms_general  # noqa : E402
+from util.histograms import compute_histograms  # noqa : E402
 from util.leakage_models import compute_leakage_aes_bit  # noqa : E402
 from util.leakage_models import compute_leakage_aes_byte  # noqa : E402
 from util.leakage_models import compute_leakage_general  # noqa : E402
 from util.leakage_models import find_fixed_entry  # noqa : E402
-from util.ttest import ttest_hist_xy  # noqa : E402
+from util.moments import MomentAccumulator, merge_moments  # noqa : E402
+from util.parallel import ScratchSpace  # noqa : E402
+from util.parallel import run_parallel  # noqa : E402
+from util.parallel import split_range  # noqa : E402
+from util.ttest import ttest_hist  # noqa : E402
 
 app = typer.Typer(add_completion=False)
 
 
 script_dir = Path(__file__).parent.absolute()
 
+# Version of the accumulator files written by the accumulate and merge commands. Increment when
+# changing the file format.
+ACCUMULATOR_FILE_VERSION = 1
+
+# Parameters that must match to merge accumulator files.
+ACCUMULATOR_MERGE_KEYS = ["backend", "test_type", "leakage_model", "mode", "rnd_list",
+                          "byte_list", "bit_list", "num_orders", "sample_start", "num_samples"]
+
+# Options that can be set per test in the tests list of the configuration file.
+TEST_CFG_KEYS = ["name", "test_type", "leakage_model", "round_select", "byte_select",
+                 "bit_select", "backend", "leakage_file", "output_histogram_file",
+                 "output_accumulator_file"]
+
 
 class UnformattedLog(object):
     def __init__(self):
@@ -84,6 +98,28 @@ def plot_fvsr_stats(traces, leakage):
                            "tmp/diff_var_trace.html")
 
 
+def compute_groups(test_type, leakage, rnd_list = None, byte_list = None, bit_list = None):
+    """ Assigning every trace to the fixed or random set.
+
+    The output "groups" has dimensions [num_rnds, num_data, num_traces]. For general TVLA, the
+    leakage indicates the set of every trace directly and the round and data indices are not used.
+    For AES, a trace belongs to the fixed set (0) of round v and byte w if the Hamming weight of
+    the selected state byte is 0 and to the random set (1) otherwise. For bits, the selected state
+    bit decides.
+    """
+    if test_type == "SPECIFIC_BYTE":
+        assert rnd_list is not None
+        assert byte_list is not None
+        return (leakage[rnd_list][:, byte_list] > 0).astype(np.uint8)
+
+    if test_type == "SPECIFIC_BIT":
+        assert rnd_list is not None
+        assert bit_list is not None
+        return leakage[rnd_list][:, bit_list]
+
+    return leakage[np.newaxis, np.newaxis, :]
+
+
 def compute_statistics(test_type, num_orders, histograms, x_axis,
                        rnd_list = None, byte_list = None, bit_list = None):
     """ Computing t-test statistics for a set of time samples.
@@ -107,9 +143,6 @@ def compute_statistics(test_type, num_orders, histograms, x_axis,
     num_samples = histograms.shape[3]
     ttest_trace = np.zeros((num_orders, num_rnds, num_data, num_samples))
 
-    # Replicate the x_axis such that x has the same dimensions as fixed_set/random_set below.
-    x = np.tile(x_axis, (num_samples, 1))
-
     # Compute statistics.
     for i_rnd in range(num_rnds):
         for i_data in range(num_data):
@@ -127,12 +160,160 @@ def compute_statistics(test_type, num_orders, histograms, x_axis,
                 # We return NaN and handle it when checking all results.
                 ttest_trace[:, i_rnd, i_data, :] = np.nan
                 continue
-            tmp = ttest_hist_xy(x, fixed_set, x, random_set, num_orders)
+            tmp = ttest_hist(fixed_set, random_set, num_orders, x_axis)
             ttest_trace[:, i_rnd, i_data, :] = tmp
 
     return ttest_trace
 
 
+def compute_statistics_job(test_type, num_orders, histograms, x_axis, rnd_list, byte_list,
+                           bit_list, ttest_trace, sample_start, sample_end):
+    """ Computing the t-test statistics of the samples sample_start to sample_end in place.
+    """
+    ttest_trace[:, :, :, sample_start:sample_end] = compute_statistics(
+        test_type, num_orders, histograms[:, :, :, sample_start:sample_end, :], x_axis,
+        rnd_list, byte_list, bit_list)
+
+
+def compute_statistics_parallel(test_type, num_orders, histograms, rnd_list, byte_list, bit_list,
+                                num_jobs, chunk_size = None):
+    """ Computing t-test statistics for all time samples, parallelized over the samples.
+
+    The histograms and the output are shared with the parallel jobs, every job reads and writes
+    chunk_size samples in place. By default, every job gets an equally sized block of samples.
+
+    Returns the t-test statistics with dimensions [num_orders, num_rnds, num_data, num_samples].
+    """
+    num_rnds, num_data, _, num_samples, trace_resolution = histograms.shape
+    x_axis = np.arange(trace_resolution)
+
+    scratch = ScratchSpace() if num_jobs > 1 else None
+    if scratch is not None:
+        histograms = scratch.copy(histograms)
+        ttest_trace = scratch.zeros((num_orders, num_rnds, num_data, num_samples), np.float64)
+    else:
+        ttest_trace = np.zeros((num_orders, num_rnds, num_data, num_samples))
+
+    run_parallel(compute_statistics_job,
+                 [(test_type, num_orders, histograms, x_axis, rnd_list, byte_list, bit_list,
+                   ttest_trace, start, end)
+                  for start, end in split_range(num_samples, num_jobs, chunk_size)],
+                 num_jobs)
+    return np.array(ttest_trace)
+
+
+def compute_histograms_job(trace_resolution, traces, groups, histograms, sample_start, sample_end):
+    """ Adding the traces to the histograms of the samples sample_start to sample_end in place.
+    """
+    compute_histograms(trace_resolution, traces[:, sample_start:sample_end], groups,
+                       out=histograms[:, :, :, sample_start:sample_end, :])
+
+
+def compute_histograms_parallel(trace_resolution, traces, groups, histograms, num_jobs,
+                                chunk_size = None, scratch = None):
+    """ Adding the traces to the histograms in place, parallelized over the samples.
+
+    The traces, the groups and the histograms are shared with the parallel jobs. To avoid copies,
+    arrays used in multiple calls should be allocated in the scratch space, e.g., using
+    ScratchSpace.zeros() or ScratchSpace.copy(). Copies made by this function are released when
+    the jobs are done, such that the scratch space doesn't grow with the number of calls.
+    """
+    num_samples = traces.shape[1]
+    arrays = (traces, groups, histograms)
+    if num_jobs > 1:
+        if scratch is None:
+            scratch = ScratchSpace()
+        shared_arrays = [scratch.copy(array) for array in arrays]
+    else:
+        shared_arrays = arrays
+    shared_traces, shared_groups, shared_histograms = shared_arrays
+
+    run_parallel(compute_histograms_job,
+                 [(trace_resolution, shared_traces, shared_groups, shared_histograms, start, end)
+                  for start, end in split_range(num_samples, num_jobs, chunk_size)],
+                 num_jobs)
+    if shared_histograms is not histograms:
+        histograms[...] = shared_histograms
+    for array, shared_array in zip(arrays, shared_arrays):
+        if shared_array is not array:
+            scratch.release(shared_array)
+
+
+def save_accumulator(filename, accumulator):
+    """ Saving accumulated statistics to an accumulator file.
+
+    The accumulator is a dict holding the statistics of the selected backend, i.e., "histograms"
+    or "counts", "means" and "moments", together with the parameters of the test and information
+    about the traces that were used. The file is versioned such that older files can be detected.
+    """
+    np.savez(filename, version=ACCUMULATOR_FILE_VERSION, **accumulator)
+
+
+def load_accumulator(filename):
+    """ Loading accumulated statistics from an accumulator file.
+    """
+    accumulator_file = np.load(filename, allow_pickle=True)
+    version = int(accumulator_file["version"])
+    if version != ACCUMULATOR_FILE_VERSION:
+        raise RuntimeError(f"Unsupported accumulator file version {version} in {filename}, "
+                           f"expected version {ACCUMULATOR_FILE_VERSION}.")
+    accumulator = {key: accumulator_file[key] for key in accumulator_file.files
+                   if key != "version"}
+    # Scalars, strings and the metadata dict are stored as 0-d arrays.
+    for key in ["backend", "test_type", "leakage_model", "mode", "num_orders", "sample_start",
+                "num_samples", "num_traces", "metadata"]:
+        accumulator[key] = accumulator[key].item()
+    return accumulator
+
+
+def merge_accumulators(accumulator_a, accumulator_b):
+    """ Merging the statistics of two accumulators.
+
+    The accumulators must have been generated with the same backend and test parameters. Merging
+    is associative, i.e., any number of accumulators can be merged in any order.
+    """
+    for key in ACCUMULATOR_MERGE_KEYS:
+        if not np.array_equal(accumulator_a[key], accumulator_b[key]):
+            raise RuntimeError(f"Can't merge accumulators with different {key}: "
+                               f"{accumulator_a[key]} vs. {accumulator_b[key]}")
+
+    accumulator = dict(accumulator_a)
+    if accumulator["backend"] == "moments":
+        counts, means, moments = merge_moments(
+            accumulator_a["counts"][..., np.newaxis], accumulator_a["means"],
+            accumulator_a["moments"],
+            accumulator_b["counts"][..., np.newaxis], accumulator_b["means"],
+            accumulator_b["moments"])
+        accumulator["counts"] = counts[..., 0]
+        accumulator["means"] = means
+        accumulator["moments"] = moments
+    else:
+        accumulator["histograms"] = accumulator_a["histograms"] + accumulator_b["histograms"]
+    accumulator["num_traces"] = accumulator_a["num_traces"] + accumulator_b["num_traces"]
+    accumulator["trace_ranges"] = np.concatenate((accumulator_a["trace_ranges"],
+                                                  accumulator_b["trace_ranges"]))
+    accumulator["project_files"] = np.concatenate((accumulator_a["project_files"],
+                                                   accumulator_b["project_files"]))
+    return accumulator
+
+
+def compute_accumulator_statistics(accumulator, num_jobs, chunk_size = None):
+    """ Computing t-test statistics from accumulated statistics.
+
+    Returns the t-test statistics with dimensions [num_orders, num_rnds, num_data, num_samples].
+    """
+    if accumulator["backend"] == "moments":
+        num_rnds, num_data, _, num_samples = accumulator["means"].shape
+        moments = MomentAccumulator(num_rnds, num_data, num_samples, accumulator["num_orders"])
+        moments.add_moments(accumulator["counts"], accumulator["means"], accumulator["moments"])
+        return moments.ttest()
+
+    return compute_statistics_parallel(accumulator["test_type"], accumulator["num_orders"],
+                                       accumulator["histograms"], accumulator["rnd_list"],
+                                       accumulator["byte_list"], accumulator["bit_list"], num_jobs,
+                                       chunk_size)
+
+
 def tvla_plotting_fnc(axs, num_orders, i_rnd, i_byte, ttest_trace,
                       single_trace, threshold, num_samples, sample_start,
                       metadata):
@@ -196,32 +377,50 @@ def tvla_plotting_fnc(axs, num_orders, i_rnd, i_byte, ttest_trace,
     return axs
 
 
-@app.command()
-def run_tvla(ctx: typer.Context):
-    """Run TVLA described in "Fast Leakage Assessment"."""
-
-    cfg = ctx.obj.cfg
-
-    # Use CW project or OT trace library.
-    OTTraceLib = False
-    if cfg.get("trace_db") == "ot_trace_library":
-        OTTraceLib = True
-
-    Path("tmp").mkdir(exist_ok=True)
-    log_format = "%(asctime)s %(levelname)s: %(message)s"
-    log.basicConfig(format=log_format,
-                    datefmt="%Y-%m-%d %I:%M:%S",
-                    handlers=[
-                        log.FileHandler("tmp/log.txt"),
-                        log.StreamHandler()
-                    ],
-                    level=log.INFO,
-                    force=True,)
+def get_test_cfgs(cfg):
+    """ Getting the configurations of all tests to compute from the traces.
 
-    if (cfg["mode"] != "kmac" and cfg["mode"] != "aes" and cfg["mode"] != "sha3" and
-            cfg["mode"] != "otbn"):
-        log.info("Unsupported mode:" + cfg["mode"] + ", falling back to \"aes\"")
+    The optional "tests" list of the configuration holds one entry per test. The options in
+    TEST_CFG_KEYS can be set per test, all other options are shared by the tests. Without a list,
+    a single test is configured by the top-level options and its results are written to tmp.
 
+    With a list, the results of every test are written to tmp/<name>. Output histogram and
+    accumulator files that are only set at the top level get the name of the test appended.
+    """
+    if not cfg.get("tests"):
+        test_cfg = dict(cfg)
+        test_cfg["name"] = None
+        test_cfg["out_dir"] = "tmp"
+        return [test_cfg]
+
+    test_cfgs = []
+    for i_test, test in enumerate(cfg["tests"]):
+        unsupported = set(test) - set(TEST_CFG_KEYS)
+        if unsupported:
+            raise RuntimeError(f"Unsupported per-test options: {sorted(unsupported)}")
+        test_cfg = {**cfg, **test}
+        name = test.get("name") or f"{i_test}_{test_cfg['test_type'].lower()}"
+        if len(cfg["tests"]) > 1:
+            for key in ["output_histogram_file", "output_accumulator_file"]:
+                if key not in test and cfg.get(key) is not None:
+                    path = Path(cfg[key])
+                    test_cfg[key] = str(path.with_name(f"{path.stem}_{name}{path.suffix}"))
+        test_cfg["name"] = name
+        test_cfg["out_dir"] = "tmp/" + name
+        test_cfgs.append(test_cfg)
+
+    names = [test_cfg["name"] for test_cfg in test_cfgs]
+    assert len(set(names)) == len(names), "The names of the tests must be unique."
+    return test_cfgs
+
+
+def setup_test(cfg):
+    """ Setting up a test from a configuration returned by get_test_cfgs().
+
+    Returns a namespace holding the test type, the selected rounds and bytes/bits, the leakage
+    model, the statistics backend as well as the accumulated statistics and t-test results of the
+    test.
+    """
     # Currently, specific TVLA exists only for AES.
     # Other modes can be tested only using general TVLA.
     if cfg["mode"] in {"kmac", "otbn", "sha3"}:
@@ -282,7 +481,7 @@ def run_tvla(ctx: typer.Context):
         bit_list = [0]
 
     if specific_test_bit:
-        if not cfg["bit_select"]:
+        if not cfg.get("bit_select"):
             bit_list = list(range(aes_block_size_bits))
         else:
             bit_list = cfg["bit_select"]
@@ -302,88 +501,563 @@ def run_tvla(ctx: typer.Context):
     else:
         num_data = 1
 
-    if cfg["mode"] == "otbn":
-        if "key_len_bytes" not in cfg:
-            raise RuntimeError('key_len_bytes must be set for otbn mode!')
-        else:
-            key_len_bytes = cfg["key_len_bytes"]
-
-    num_steps = int(cfg["number_of_steps"])
-    assert num_steps >= 1
+    # The leakage model of the specific tests.
+    leakage_model = cfg.get("leakage_model") or default_leakage_model
+    if leakage_model not in {"HAMMING_WEIGHT", "HAMMING_DISTANCE"}:
+        raise RuntimeError(f"Unsupported leakage model: {leakage_model}")
+
+    # The histogram backend stores one histogram bin per possible trace value. The moments backend
+    # keeps running central moments instead and needs much less memory for many rounds and
+    # bytes/bits, but its results can't be stored to or loaded from histogram files.
+    backend = cfg.get("backend") or default_backend
+    if backend not in {"histogram", "moments"}:
+        raise RuntimeError(f"Unsupported backend: {backend}")
+    if backend == "moments":
+        assert cfg["input_histogram_file"] is None and cfg["output_histogram_file"] is None, \
+            "Histogram files are not supported by the moments backend."
+
+    return SimpleNamespace(test_type=cfg["test_type"],
+                           general_test_key=general_test_key,
+                           general_test_data=general_test_data,
+                           specific_test_byte=specific_test_byte,
+                           specific_test_bit=specific_test_bit,
+                           general_test=general_test,
+                           specific_test=specific_test,
+                           rnd_list=rnd_list,
+                           byte_list=byte_list,
+                           bit_list=bit_list,
+                           num_rnds=num_rnds,
+                           num_bytes=num_bytes,
+                           num_bits=num_bits,
+                           num_data=num_data,
+                           rnd_ext=list(range(num_rnds)),
+                           byte_ext=list(range(num_bytes)),
+                           bit_ext=list(range(num_bits)),
+                           leakage_model=leakage_model,
+                           backend=backend,
+                           histograms=None,
+                           moments=None,
+                           ttest_trace=None,
+                           ttest_step=None)
+
+
+def compute_leakage(test_type, leakage_model, keys, plaintexts):
+    """ Computing the leakage of a test for all traces.
+
+    For the general tests, the leakage indicates whether a trace belongs to the fixed set. For the
+    specific tests, the leakage models are vectorized over all traces.
+    """
+    if test_type == "SPECIFIC_BYTE":
+        return compute_leakage_aes_byte(keys, plaintexts, leakage_model)
+    if test_type == "SPECIFIC_BIT":
+        return compute_leakage_aes_bit(keys, plaintexts, leakage_model)
+    if test_type == "GENERAL_KEY":
+        # We identify the fixed key by looking at the first 20 keys in the project.
+        return compute_leakage_general(keys, find_fixed_entry(keys[0:20]))
+    assert test_type == "GENERAL_DATA"
+    # We identify the fixed data by looking at the first 20 plaintexts in the project.
+    return compute_leakage_general(plaintexts, find_fixed_entry(plaintexts[0:20]))
 
-    save_to_disk_trace = cfg["save_to_disk"]
-    save_to_disk_leakage = cfg["save_to_disk"]
-    save_to_disk_ttest = cfg["save_to_disk_ttest"] and (cfg["ttest_step_file"] is None)
 
-    # Step-wise processing isn't compatible with a couple of other arguments.
-    if num_steps > 1:
-        cfg["trace_file"] = None
-        cfg["leakage_file"] = None
-        save_to_disk_trace = False
-        save_to_disk_leakage = False
+def report_test(cfg, test, metadata, single_trace, trace_to_plot, sample_start, num_samples,
+                num_steps, num_traces_used_total, trace_start_vec, trace_end_vec,
+                save_to_disk_ttest):
+    """ Saving, checking and plotting the t-test statistics of a test.
 
-    # By default, the first two moments are computed. This can be modified to any order.
-    num_orders = 2
+    The t-test files and figures are written to the output directory of the test.
+    """
+    out_dir = cfg["out_dir"]
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    if cfg["name"] is not None:
+        log.info(f"Results of test {cfg['name']}:")
+
+    ttest_trace = test.ttest_trace
+    ttest_step = test.ttest_step
+    num_orders = ttest_trace.shape[0]
+    specific_test_byte = test.specific_test_byte
+    specific_test_bit = test.specific_test_bit
+    specific_test = test.specific_test
+    rnd_list = test.rnd_list
+    byte_list = test.byte_list
+    bit_list = test.bit_list
+    num_rnds = test.num_rnds
+    num_bytes = test.num_bytes
+    num_bits = test.num_bits
+    num_data = test.num_data
+    rnd_ext = test.rnd_ext
+    byte_ext = test.byte_ext
+    bit_ext = test.bit_ext
 
-    if cfg["input_histogram_file"] is not None:
-        # Load previously generated histograms.
-        histograms_file = np.load(cfg["input_histogram_file"])
-        histograms_in = histograms_file['histograms']
-        single_trace = histograms_file['single_trace']
-        num_samples = histograms_in.shape[3]
-        trace_resolution = histograms_in.shape[4]
-        # If previously generated histograms are loaded, the rounds and bytes of interest must
-        # match. Otherwise, indices would get mixed up.
-        assert np.all(rnd_list == histograms_file['rnd_list'])
-        if specific_test_byte:
-            assert np.all(byte_list == histograms_file['byte_list'])
+    if save_to_disk_ttest:
+        if num_steps > 1:
+            log.info("Saving T-test Step")
+            np.savez_compressed(out_dir + '/ttest-step.npy',
+                                ttest_step=ttest_step,
+                                num_traces=num_traces_used_total,
+                                metadata=metadata,
+                                sample_start=sample_start,
+                                trace_start_vec=trace_start_vec,
+                                trace_end_vec=trace_end_vec,
+                                rnd_list=rnd_list,
+                                byte_list=byte_list,
+                                bit_list=bit_list,
+                                single_trace=trace_to_plot)
+        else:
+            log.info("Saving T-test")
+            np.save(out_dir + '/ttest.npy', ttest_trace)
 
-        # Computing the t-test statistics vs. time.
-        log.info("Computing T-test Statistics")
+    # Check ttest results.
+    threshold = 4.5
+    failure = np.any(np.abs(ttest_trace) >= threshold, axis=3)
+    nan = np.isnan(np.sum(ttest_trace, axis=3))
 
-        num_jobs = multiprocessing.cpu_count()
+    if not np.any(failure):
+        log.info("No leakage above threshold identified.")
+    if np.any(failure) or np.any(nan):
+        if specific_test_byte:
+            if np.any(failure):
+                log.info("Leakage above threshold identified in the following order(s), round(s) "
+                         "and byte(s) marked with X:")
+            if np.any(nan):
+                log.info("Couldn't compute statistics for order(s), round(s) and byte(s) marked "
+                         "with O:")
+            with UnformattedLog():
+                byte_str = "Byte     |"
+                dash_str = "----------"
+                for i_byte in range(num_bytes):
+                    byte_str += str(byte_list[i_byte]).rjust(5)
+                    dash_str += "-----"
 
-        # The number of samples processed by each parallel job at a time.
-        sample_step_ttest = num_samples // num_jobs
+                for i_order in range(num_orders):
+                    log.info(f"Order {i_order + 1}:")
+                    log.info(f"{byte_str}")
+                    log.info(f"{dash_str}")
+                    for i_rnd in range(num_rnds):
+                        result_str = "Round " + str(rnd_list[i_rnd]).rjust(2) + " |"
+                        for i_byte in range(num_bytes):
+                            if failure[i_order, rnd_ext[i_rnd], byte_ext[i_byte]]:
+                                result_str += str("X").rjust(5)
+                            elif nan[i_order, rnd_ext[i_rnd], byte_ext[i_byte]]:
+                                result_str += str("O").rjust(5)
+                            else:
+                                result_str += "     "
+                        log.info(f"{result_str}")
+                    log.info("")
+        elif specific_test_bit:
+            if np.any(failure):
+                log.info("Leakage above threshold identified in the following order(s), round(s) "
+                         "and bit(s) marked with X:")
+            if np.any(nan):
+                log.info("Couldn't compute statistics for order(s), round(s) and bit(s) marked "
+                         "with O:")
+            with UnformattedLog():
+                bit_str = "Bit     |"
+                dash_str = "----------"
+                for i_bit in range(num_bits):
+                    bit_str += str(bit_list[i_bit]).rjust(5)
+                    dash_str += "-----"
 
-        x_axis = np.arange(trace_resolution)
+                for i_order in range(num_orders):
+                    log.info(f"Order {i_order + 1}:")
+                    log.info(f"{bit_str}")
+                    log.info(f"{dash_str}")
+                    for i_rnd in range(num_rnds):
+                        result_str = "Round " + str(rnd_list[i_rnd]).rjust(2) + " |"
+                        for i_bit in range(num_bits):
+                            if failure[i_order, rnd_ext[i_rnd], bit_ext[i_bit]]:
+                                result_str += str("X").rjust(5)
+                            elif nan[i_order, rnd_ext[i_rnd], bit_ext[i_bit]]:
+                                result_str += str("O").rjust(5)
+                            else:
+                                result_str += "     "
+                        log.info(f"{result_str}")
+                    log.info("")
+        else:
+            log.info("Leakage above threshold identified in the following order(s) marked with X")
+            if np.any(nan):
+                log.info("Couldn't compute statistics for order(s) marked with O:")
+            with UnformattedLog():
+                for i_order in range(num_orders):
+                    result_str = "Order " + str(i_order + 1) + ": "
+                    if failure[i_order, 0, 0]:
+                        result_str += "X"
+                    elif nan[i_order, 0, 0]:
+                        result_str += "O"
+                    else:
+                        result_str += " "
+                    log.info(f"{result_str}")
+                log.info("")
 
-        # Compute statistics.
-        # ttest_trace has dimensions [num_orders, num_rnds, num_data, num_samples].
-        ttest_trace = Parallel(n_jobs=num_jobs)(
-            delayed(compute_statistics)(cfg["test_type"], num_orders,
-                                        histograms_in[:, :, :, i:i + sample_step_ttest, :],
-                                        x_axis, rnd_list, byte_list, bit_list)
-            for i in range(0, num_samples, sample_step_ttest))
-        ttest_trace = np.concatenate((ttest_trace[:]), axis=3)
+    if cfg["plot_figures"]:
+        log.info(f"Plotting Figures to {out_dir}/figures")
+        Path(out_dir + "/figures").mkdir(exist_ok=True)
 
-    if (cfg["input_histogram_file"] is None or cfg["output_histogram_file"] is not None) \
-            and cfg["ttest_step_file"] is None:
-        # Either don't have previously generated histograms or we need to append previously
-        # generated histograms.
-        # Make sure the project file is compatible with the previously generated histograms.
-        project_type = cfg.get("trace_db")
-        if not project_type:
-            project_type = "cw"
+        # Metadata text variable for plot
+        textbox = ""
+        # Catch case where certain metadata isn't saved to project file (e.g. older measurement)
+        try:
+            sampling_rate = float(metadata['sampling_rate']) / 1e6
+            textbox = textbox + "Sample rate:\n" + str(
+                math.floor(sampling_rate)) + " MS/s\n\n"
+        except KeyError:
+            textbox = textbox
+        try:
+            textbox = textbox + "Masks off:\n" + metadata['masks_off'] + "\n\n"
+        except KeyError:
+            textbox = textbox
+        try:
+            textbox = textbox + "Samples:\n" + str(
+                metadata['num_samples']) + "\n\n"
+        except KeyError:
+            textbox = textbox
+        try:
+            textbox = textbox + "Offset:\n" + str(
+                metadata['offset_samples']) + "\n\n"
+        except KeyError:
+            textbox = textbox
+        try:
+            textbox = textbox + "Scope gain:\n" + str(
+                metadata['scope_gain']) + "\n\n"
+        except KeyError:
+            textbox = textbox
+        try:
+            textbox = textbox + "Traces:\n" + str(num_traces_used_total) + "\n\n"
+        except KeyError:
+            textbox = textbox
+        if textbox != "":
+            # remove last two linebreaks
+            textbox = textbox[:-2]
 
-        project_cfg = ProjectConfig(type = project_type,
-                                    path = cfg["project_file"],
-                                    wave_dtype = np.uint16,
-                                    overwrite = False,
-                                    trace_threshold = cfg.get("trace_threshold")
-                                    )
-        project = SCAProject(project_cfg)
-        project.open_project()
-        metadata = project.get_metadata()
+        # Plotting figures for t-test statistics vs. time.
+        log.info("Plotting T-test Statistics vs. Time.")
 
-        if cfg["input_histogram_file"] is None:
-            num_samples = len(project.get_waves(0))
-        else:
-            assert num_samples == len(project.get_waves(0))
+        if cfg["mode"] == "aes" and specific_test:
+            # By default the figures are saved under tmp/t_test_round_x_byte_y.png.
+            for i_rnd in range(num_rnds):
+                for i_data in range(num_data):
 
-        if cfg["input_histogram_file"] is None:
-            adc_bits = 12
-            trace_resolution = 2**adc_bits
+                    fig, axs = plt.subplots(num_orders + 1, 1, sharex=True)
+                    axs = tvla_plotting_fnc(axs, num_orders, i_rnd, i_data,
+                                            ttest_trace, single_trace,
+                                            threshold, num_samples,
+                                            sample_start, metadata)
+                    if specific_test_byte:
+                        title = "TVLA of " + "aes_t_test_round_" + str(
+                            rnd_list[i_rnd]) + "_byte_" + str(byte_list[i_data])
+                    elif specific_test_bit:
+                        title = "TVLA of " + "aes_t_test_round_" + str(
+                            rnd_list[i_rnd]) + "_bit_" + str(bit_list[i_data])
+                    # Catch case where datetime data isn't saved
+                    # to project file (e.g. older measurement)
+                    try:
+                        title = title + "\n" + "Captured: " + metadata[
+                            'datetime']
+                    except KeyError:
+                        title = title
+                    axs[0].set_title(title)
+
+                    # Add metadata to plot
+                    if textbox != "":
+                        left, width = .67, .5
+                        bottom, height = .25, .5
+                        right = left + width
+                        top = bottom + height
+                        plt.gcf().text(0.5 * (left + right),
+                                       0.5 * (bottom + top),
+                                       textbox,
+                                       fontsize=9,
+                                       horizontalalignment='center',
+                                       verticalalignment='center',
+                                       bbox=dict(boxstyle='round',
+                                                 facecolor='w',
+                                                 linewidth=0.6))
+                        plt.subplots_adjust(right=0.84)
+                    plt.xlabel("time [samples]")
+
+                    filename = "aes_t_test_round_" + str(rnd_list[i_rnd])
+                    if specific_test_byte:
+                        filename += "_byte_" + str(byte_list[i_data]) + ".png"
+                    elif specific_test_bit:
+                        filename += "_bit_" + str(bit_list[i_data]) + ".png"
+                    plt.savefig(out_dir + "/figures/" + filename)
+                    if num_rnds == 1 and num_data == 1:
+                        plt.show()
+                    else:
+                        plt.close()
+
+        else:
+            fig, axs = plt.subplots(num_orders + 1, 1, sharex=True)
+            axs = tvla_plotting_fnc(axs, num_orders, 0, 0, ttest_trace,
+                                    single_trace, threshold, num_samples,
+                                    sample_start, metadata)
+
+            title = "TVLA of " + (cfg["project_file"]).rsplit('/', 1)[-1]
+            # Catch case where datetime data isn't saved to project file (e.g. older measurement)
+            try:
+                title = title + "\n" + "Captured: " + metadata['datetime']
+            except KeyError:
+                title = title
+            axs[0].set_title(title)
+
+            # Add metadata to plot
+            if textbox != "":
+                left, width = .67, .5
+                bottom, height = .25, .5
+                right = left + width
+                top = bottom + height
+                plt.gcf().text(0.5 * (left + right),
+                               0.5 * (bottom + top),
+                               textbox,
+                               fontsize=9,
+                               horizontalalignment='center',
+                               verticalalignment='center',
+                               bbox=dict(boxstyle='round',
+                                         facecolor='w',
+                                         linewidth=0.6))
+                plt.subplots_adjust(right=0.84)
+
+            plt.xlabel("time [samples]")
+            plt.savefig(out_dir + '/figures/' + cfg["mode"] + '_fixed_vs_random.png')
+            plt.show()
+
+        # Plotting figures for t-test statistics vs. number of traces used.
+        # For now, do a single figure per round and per order. Every line corresponds to the t-test
+        # result of one time sample for one byte and one round.
+        if num_steps > 1:
+
+            log.info("Plotting T-test Statistics vs. Number of Traces, this may take a while.")
+            # Determine resolution.
+            xres_vec = [10e6, 1e6, 100e3, 10e3, 1e3, 100, 10, 1]
+            for xres in xres_vec:
+                if int(np.around((trace_end_vec[0] - trace_start_vec[0]) / xres)) > 0:
+                    if xres >= 1e6:
+                        xres_label = str(int(xres / 1e6)) + 'M'
+                    elif xres >= 1e3:
+                        xres_label = str(int(xres / 1e3)) + 'k'
+                    else:
+                        xres_label = str(int(xres))
+                    break
+
+            xticks = [np.around(trace_end / xres) for trace_end in trace_end_vec]
+            xticklabels = [str(int(tick)) for tick in xticks]
+
+            # Empty every second label if we got more than 10 steps.
+            if num_steps > 10:
+                for i_step in range(num_steps):
+                    xticklabels[i_step] = "" if (i_step % 2 == 0) else xticklabels[i_step]
+
+            for i_rnd in range(num_rnds):
+
+                c = np.ones(num_steps)
+                fig, axs = plt.subplots(num_orders, 1, sharex=True)
+
+                # To reduce the number of lines in the plot, we only plot those samples where
+                # leakage is expected in the first place. This might need tuning if the design
+                # is altered.
+
+                if specific_test:
+                    # Each regular round lasts for 100 samples.
+                    samples_per_rnd = 100
+                    # We have a negative trigger offset of 20 samples. The initial key and data
+                    # loading takes another 20 samples, the initial round lasts for 100 samples.
+                    # Then center the window around the middle of the round. The effective
+                    # numbers are best tuned by doing a capture with masking switched off.
+                    rnd_offset = 150 + samples_per_rnd // 2
+                    # The widnow width is 100 samples + 40 samples extended on each side.
+                    half_window = samples_per_rnd // 2 + 40
+
+                    samples = {"aes": range(max(rnd_offset + (rnd_list[i_rnd] * samples_per_rnd) -
+                                            half_window, 0),
+                                            min(rnd_offset + (rnd_list[i_rnd] * samples_per_rnd) +
+                                                half_window, num_samples))}
+                else:
+                    # Even if cfg["sample_start"] is specified and cfg["num_samples"] is not,
+                    # num_samples is set to a valid value and the code below has valid inputs.
+                    range_specified = True if \
+                        (("sample_start" in cfg and cfg["sample_start"] is not None) or
+                         ("num_samples" in cfg and cfg["num_samples"] is not None)) else False
+
+                    samples = {
+                        # Simply plot all samples within the selected range.
+                        "aes": range(0, num_samples),
+                        # Plot samples within key absorption phase, unless a range is specified.
+                        "kmac": range(0, num_samples) if range_specified else range(520, 2460),
+                        # Plot samples within actual SHA3 phase, unless a range is specified.
+                        "sha3": range(0, num_samples) if range_specified else range(1150, 3150),
+                        # Simply plot all samples within the selected range.
+                        "otbn": range(0, num_samples),
+                    }
+
+                for i_order in range(num_orders):
+                    for i_byte in range(num_bytes):
+                        for i_sample in samples[cfg["mode"]]:
+                            axs[i_order].plot(ttest_step[i_order,
+                                                         rnd_ext[i_rnd],
+                                                         byte_ext[i_byte],
+                                                         i_sample],
+                                              'k')
+                            axs[i_order].plot(c * threshold, 'r')
+                            axs[i_order].plot(-threshold * c, 'r')
+                            axs[i_order].set_xlabel(str('number of traces [' + xres_label + ']'))
+                            axs[i_order].set_xticks(range(num_steps))
+                            axs[i_order].set_xticklabels(xticklabels)
+                            axs[i_order].set_ylabel(
+                                't-test ' + str(i_order + 1) +
+                                "\nfor samples " + str(samples[cfg["mode"]][0]) +
+                                ' to ' + str(samples[cfg["mode"]][-1]))
+
+                filename = cfg["mode"] + "_t_test_steps_round_" + str(rnd_list[i_rnd]) + ".png"
+                plt.savefig(out_dir + "/figures/" + filename)
+                if num_rnds == 1:
+                    plt.show()
+                else:
+                    plt.close()
+
+
+def configure_logging():
+    """Logging to the console and to tmp/log.txt."""
+    Path("tmp").mkdir(exist_ok=True)
+    log_format = "%(asctime)s %(levelname)s: %(message)s"
+    log.basicConfig(format=log_format,
+                    datefmt="%Y-%m-%d %I:%M:%S",
+                    handlers=[
+                        log.FileHandler("tmp/log.txt"),
+                        log.StreamHandler()
+                    ],
+                    level=log.INFO,
+                    force=True,)
+
+
+@app.command()
+def run_tvla(ctx: typer.Context):
+    """Run TVLA described in "Fast Leakage Assessment"."""
+
+    cfg = ctx.obj.cfg
+
+    configure_logging()
+
+    if (cfg["mode"] != "kmac" and cfg["mode"] != "aes" and cfg["mode"] != "sha3" and
+            cfg["mode"] != "otbn"):
+        log.info("Unsupported mode:" + cfg["mode"] + ", falling back to \"aes\"")
+
+    # All tests are computed from a single pass over the traces. The traces are loaded, filtered
+    # and converted once per step, every test has its own leakage, statistics and output files.
+    test_cfgs = get_test_cfgs(cfg)
+    tests = [setup_test(test_cfg) for test_cfg in test_cfgs]
+    if (cfg["input_histogram_file"] is not None or cfg["ttest_step_file"] is not None or
+            cfg.get("input_accumulator_file") is not None):
+        assert len(tests) == 1, \
+            "Input histogram, t-test step and accumulator files support a single test only."
+
+    if cfg["mode"] == "otbn":
+        if "key_len_bytes" not in cfg:
+            raise RuntimeError('key_len_bytes must be set for otbn mode!')
+        else:
+            key_len_bytes = cfg["key_len_bytes"]
+
+    num_steps = int(cfg["number_of_steps"])
+    assert num_steps >= 1
+
+    save_to_disk_trace = cfg["save_to_disk"]
+    save_to_disk_leakage = cfg["save_to_disk"]
+    save_to_disk_ttest = cfg["save_to_disk_ttest"] and (cfg["ttest_step_file"] is None)
+
+    # Step-wise processing isn't compatible with a couple of other arguments.
+    if num_steps > 1:
+        cfg["trace_file"] = None
+        for test_cfg in test_cfgs:
+            test_cfg["leakage_file"] = None
+        save_to_disk_trace = False
+        save_to_disk_leakage = False
+
+    # By default, the first two moments are computed. This can be modified to any order.
+    num_orders = 2
+
+    # The number of parallel jobs to use for the processing-heavy tasks and the number of samples
+    # processed by a job at a time. By default, all CPUs are used and every job gets an equally
+    # sized block of samples to amortize parallelization overhead.
+    num_jobs = cfg.get("num_jobs") or multiprocessing.cpu_count()
+    chunk_size = cfg.get("chunk_size")
+
+    # Only defined for step-wise processing.
+    trace_start_vec = None
+    trace_end_vec = None
+
+    if cfg.get("input_accumulator_file") is not None:
+        # Load previously accumulated statistics. The test parameters have already been taken
+        # from the accumulator file.
+        test = tests[0]
+        accumulator = load_accumulator(cfg["input_accumulator_file"])
+        metadata = accumulator["metadata"]
+        single_trace = accumulator["single_trace"]
+        sample_start = accumulator["sample_start"]
+        num_samples = accumulator["num_samples"]
+        num_traces_used_total = accumulator["num_traces"]
+        num_orders = accumulator["num_orders"]
+        trace_to_plot = single_trace
+        log.info(f"Loaded statistics of {num_traces_used_total} traces")
+
+        log.info("Computing T-test Statistics")
+        test.ttest_trace = compute_accumulator_statistics(accumulator, num_jobs, chunk_size)
+        accumulator = None
+
+    elif cfg["input_histogram_file"] is not None:
+        # Load previously generated histograms.
+        test = tests[0]
+        histograms_file = np.load(cfg["input_histogram_file"])
+        test.histograms = histograms_file['histograms']
+        single_trace = histograms_file['single_trace']
+        trace_to_plot = single_trace
+        # The histograms don't store the metadata and the sample window.
+        metadata = {}
+        sample_start = 0
+        # Every trace is in one of the two sets of every sample.
+        num_traces_used_total = int(test.histograms[0, 0, :, 0].sum())
+        num_samples = test.histograms.shape[3]
+        trace_resolution = test.histograms.shape[4]
+        # If previously generated histograms are loaded, the rounds and bytes of interest must
+        # match. Otherwise, indices would get mixed up.
+        assert np.all(test.rnd_list == histograms_file['rnd_list'])
+        if test.specific_test_byte:
+            assert np.all(test.byte_list == histograms_file['byte_list'])
+
+        # Computing the t-test statistics vs. time.
+        log.info("Computing T-test Statistics")
+
+        # ttest_trace has dimensions [num_orders, num_rnds, num_data, num_samples].
+        test.ttest_trace = compute_statistics_parallel(test.test_type, num_orders,
+                                                       test.histograms, test.rnd_list,
+                                                       test.byte_list, test.bit_list, num_jobs,
+                                                       chunk_size)
+
+    if (cfg["input_histogram_file"] is None or cfg["output_histogram_file"] is not None) \
+            and cfg["ttest_step_file"] is None and cfg.get("input_accumulator_file") is None:
+        # Either don't have previously generated histograms or we need to append previously
+        # generated histograms.
+        # Make sure the project file is compatible with the previously generated histograms.
+        project_type = cfg.get("trace_db")
+        if not project_type:
+            project_type = "cw"
+
+        project_cfg = ProjectConfig(type = project_type,
+                                    path = cfg["project_file"],
+                                    wave_dtype = np.uint16,
+                                    overwrite = False,
+                                    trace_threshold = cfg.get("trace_threshold")
+                                    )
+        project = SCAProject(project_cfg)
+        project.open_project()
+        metadata = project.get_metadata()
+
+        num_samples_max = project.num_samples()
+        if cfg["input_histogram_file"] is None:
+            num_samples = num_samples_max
+        else:
+            assert num_samples == num_samples_max
+
+        if cfg["input_histogram_file"] is None:
+            adc_bits = 12
+            trace_resolution = 2**adc_bits
 
         # Amount of tolerable deviation from average during filtering.
         num_sigmas = 3.5
@@ -395,29 +1069,25 @@ def run_tvla(ctx: typer.Context):
         else:
             sample_start = 0
 
-        assert sample_start < len(project.get_waves(0))
+        assert sample_start < num_samples_max
 
         if ("num_samples" in cfg and cfg["num_samples"] is not None):
             num_samples = cfg["num_samples"]
         else:
-            num_samples = len(project.get_waves(0)) - sample_start
+            num_samples = num_samples_max - sample_start
 
-        if (num_samples + sample_start > len(project.get_waves(0))):
+        if (num_samples + sample_start > num_samples_max):
             log.warning(f"Selected sample window {sample_start} to " +
                         f"{sample_start+num_samples} is out of range!")
-            num_samples = len(project.get_waves(0)) - sample_start
+            num_samples = num_samples_max - sample_start
             log.warning(f"Will use samples from {sample_start} " +
                         f"to {sample_start+num_samples} instead!")
 
         # Overall number of traces, trace start and end indices.
         num_traces_max = metadata.get("num_traces")
         if num_traces_max is None:
-            # If the database (e.g. CW DB) does not contain the number of
-            # traces, open the waves, read the number of traces, and free the
-            # memory.
-            proj_waves = project.get_waves()
-            num_traces_max = len(proj_waves)
-            proj_waves = None
+            # The database (e.g. CW DB) does not contain the number of traces.
+            num_traces_max = project.num_traces()
         if cfg["trace_start"] is None:
             trace_start_tot = 0
         else:
@@ -444,21 +1114,20 @@ def run_tvla(ctx: typer.Context):
                 num_traces_vec.append(num_traces_step + num_traces_rem)
                 trace_end_vec.append(trace_start_vec[i_step] + num_traces_vec[i_step] - 1)
 
-        # The number of parallel jobs to use for the processing-heavy tasks.
-        num_jobs = multiprocessing.cpu_count()
+        # The histograms are shared with the parallel jobs and updated in place for every step.
+        scratch = ScratchSpace() if num_jobs > 1 else None
 
-        # The number of traces/samples processed by each parallel job at a time.
-        trace_step_leakage = min(10000, num_traces_step // num_jobs)
-        sample_step_hist = 1
-        # Increase work per thread to amortize parallelization overhead.
-        if len(rnd_list) == 1 and len(byte_list) == 1 and len(bit_list):
-            if general_test:
-                sample_step_hist = min(10000, num_samples // num_jobs)
-            else:
-                sample_step_hist = 5
+        # Number of traces after filtering over all steps. New traces are added to the traces of
+        # previously generated histograms.
+        if cfg["input_histogram_file"] is None:
+            num_traces_used_total = 0
 
-        # Number of traces after filtering over all steps.
-        num_traces_used_total = 0
+        # The keys and plaintexts are only loaded if a test computes its leakage from them.
+        computed_tests = [test for test_cfg, test in zip(test_cfgs, tests)
+                          if not (test.specific_test and test_cfg["leakage_file"] is not None)]
+        load_plaintexts = any(test.general_test_data or test.specific_test
+                              for test in computed_tests)
+        load_keys = any(test.general_test_key or test.specific_test for test in computed_tests)
 
         for i_step in range(num_steps):
             num_traces = num_traces_vec[i_step]
@@ -474,23 +1143,15 @@ def run_tvla(ctx: typer.Context):
                 if i_step > 0:
                     project.open_project()
 
-                proj_waves = project.get_waves(trace_start, trace_end + 1)
-                assert len(proj_waves) == num_traces
-
-                # Converting traces from floating point to integer and creating a dense copy.
-                log.info("Converting Traces")
-                if proj_waves[0].dtype == 'uint16':
-                    traces = np.empty((num_traces, num_samples), dtype=np.uint16)
-                    log.info(f"Will use samples from {sample_start} to {sample_start+num_samples}")
-                    for i_trace in range(num_traces):
-                        traces[i_trace] = proj_waves[i_trace][sample_start:
-                                                              sample_start +
-                                                              num_samples]
-                else:
-                    traces = np.empty((num_traces, num_samples), dtype=np.double)
-                    for i_trace in range(num_traces):
-                        traces[i_trace] = (proj_waves[i_trace] + 0.5) * trace_resolution
-                    traces = traces.astype('uint16')
+                log.info(f"Will use samples from {sample_start} to {sample_start+num_samples}")
+                traces = project.get_waves_array(trace_start, trace_end + 1, sample_start,
+                                                 num_samples)
+                assert len(traces) == num_traces
+
+                # Converting traces from floating point to integer.
+                if traces.dtype != 'uint16':
+                    log.info("Converting Traces")
+                    traces = ((traces + 0.5) * trace_resolution).astype('uint16')
 
                 # Define upper and lower limits.
                 max_trace = trace_resolution
@@ -520,9 +1181,11 @@ def run_tvla(ctx: typer.Context):
                     np.savez('tmp/traces.npy', traces=traces, traces_to_use=traces_to_use,
                              trace_start=trace_start, trace_end=trace_end)
 
-                if ((save_to_disk_trace is True or save_to_disk_ttest is True) and
-                        general_test and i_step == 0):
-                    np.save('tmp/single_trace.npy', single_trace)
+                if (save_to_disk_trace is True or save_to_disk_ttest is True) and i_step == 0:
+                    for test_cfg, test in zip(test_cfgs, tests):
+                        if test.general_test:
+                            Path(test_cfg["out_dir"]).mkdir(parents=True, exist_ok=True)
+                            np.save(test_cfg["out_dir"] + '/single_trace.npy', single_trace)
             else:
                 trace_file = np.load(cfg["trace_file"])
                 traces = trace_file['traces']
@@ -546,556 +1209,279 @@ def run_tvla(ctx: typer.Context):
             num_traces = np.sum(traces_to_use)
             log.info(
                 f"Will use {num_traces} traces "
-                f"({100*num_traces/num_traces_orig:.1f}%)"
-            )
-
-            num_traces_used_total += num_traces
-
-            # Store reference trace to plot in figure. Avoid using the first
-            # trace as this initial trace could sometimes be noisy.
-            trace_to_plot = traces[0]
-            if len(traces) > 1:
-                trace_to_plot = traces[1]
-
-            if cfg["leakage_file"] is None:
-                # Create local, dense copies of keys and plaintexts. This allows the leakage
-                # computation to be parallelized.
-                if cfg["mode"] == "otbn":
-                    keys = np.empty((num_traces_orig, key_len_bytes), dtype=np.uint8)
-                else:
-                    keys = np.empty((num_traces_orig, 16), dtype=np.uint8)
-                    plaintexts = np.empty((num_traces_orig, 16), dtype=np.uint8)
-
-                if specific_test:
-                    keys[:] = project.get_keys(trace_start, trace_end + 1)
-                else:
-                    # Existing KMAC trace sets use a mix of bytes strings and ChipWhisperer byte
-                    # arrays. For compatiblity, we need to convert everything to numpy arrays.
-                    # Eventually, we can drop this.
-                    if i_step == 0:
-                        if not OTTraceLib:
-                            # Convert all keys from the project file to numpy
-                            # arrays once.
-                            keys_nparrays = []
-                            plaintexts_nparrays = []
-                            for i in range(num_traces_max):
-                                if general_test_data:
-                                    plaintexts_nparrays.append(
-                                        np.frombuffer(project.project.textins[i], dtype=np.uint8))
-                                else:
-                                    keys_nparrays.append(np.frombuffer(project.project.keys[i],
-                                                                       dtype=np.uint8))
-                    # Select the correct slice of keys for each step.
-                    if OTTraceLib:
-                        if general_test_data:
-                            plaintexts[:] = project.get_plaintexts(trace_start, trace_end + 1)
-                        else:
-                            keys[:] = project.get_keys(trace_start, trace_end + 1)
-                    else:
-                        if general_test_data:
-                            plaintexts[:] = plaintexts_nparrays[trace_start:trace_end + 1]
-                        else:
-                            keys[:] = keys_nparrays[trace_start:trace_end + 1]
-
-                # Only select traces to use.
-                if general_test_key:
-                    keys = keys[traces_to_use[trace_start:trace_end + 1]]
-                if general_test_data:
-                    plaintexts = plaintexts[traces_to_use[trace_start:trace_end + 1]]
-                if specific_test:
-                    keys = keys[traces_to_use[trace_start:trace_end + 1]]
-                    if OTTraceLib:
-                        plaintexts = project.get_plaintexts(trace_start, trace_end + 1)
-                    else:
-                        plaintexts[:] = project.project.textins[trace_start:trace_end + 1]
-                        plaintexts = plaintexts[traces_to_use[trace_start:trace_end + 1]]
-
-            # We don't need the project file anymore after this point. Close it
-            # together with all trace files opened in the background.
-            project.close(save=False)
-            proj_waves = None
-
-            if specific_test:
-                # Compute or load previously computed leakage model.
-                if cfg["leakage_file"] is None:
-                    # leakage models: HAMMING_WEIGHT (default), HAMMING_DISTANCE
-                    log.info("Computing Leakage")
-                    if specific_test_byte:
-                        leakage = Parallel(n_jobs=num_jobs)(
-                            delayed(compute_leakage_aes_byte)(keys[i:i + trace_step_leakage],
-                                                              plaintexts[i:i + trace_step_leakage])
-                            for i in range(0, num_traces, trace_step_leakage))
-                    else:
-                        leakage = Parallel(n_jobs=num_jobs)(
-                            delayed(compute_leakage_aes_bit)(keys[i:i + trace_step_leakage],
-                                                             plaintexts[i:i + trace_step_leakage])
-                            for i in range(0, num_traces, trace_step_leakage))
-                    leakage = np.concatenate((leakage[:]), axis=2)
-                    if save_to_disk_leakage:
-                        log.info("Saving Leakage")
-                        np.save('tmp/leakage.npy', leakage)
-                else:
-                    leakage = np.load(cfg["leakage_file"])
-                    assert num_traces == leakage.shape[2]
-            elif general_test_key:
-                log.info("Computing Leakage")
-                # We identify the fixed key by looking at the first 20 keys in the project.
-                leakage = compute_leakage_general(keys, find_fixed_entry(keys[0:20]))
-            else:
-                assert general_test_data
-                log.info("Computing Leakage")
-                # We identify the fixed data by looking at the first 20 plaintexts in the project.
-                leakage = compute_leakage_general(plaintexts, find_fixed_entry(plaintexts[0:20]))
-
-            # Uncomment the function call below for debugging e.g. when the t-test results aren't
-            # centered around 0.
-            # plot_fvsr_stats(traces, leakage)
-
-            # Free up memory.
-            plaintexts = None
-            keys = None
-
-            log.info("Building Histograms")
-            if specific_test_byte:
-                # For every time sample we make two histograms, one for Hamming weight of the
-                # sensitive variable = 0 (fixed set) and one for Hamming weight > 0 (random set).
-                # histograms has dimensions [num_rnds, num_bytes, 2, num_samples, trace_resolution]
-                # The value stored in histograms[v][w][x][y][z] shows how many traces have value z
-                # at sample y, given that HW(state byte w in AES round v) = 0 (fixed set, x = 0) or
-                # > 0 (random set, x = 1).
-                # The computation is parallelized over the samples.
-                histograms = Parallel(n_jobs=num_jobs)(
-                    delayed(compute_histograms_aes_byte)(trace_resolution, rnd_list, byte_list,
-                                                         traces[:, i:i + sample_step_hist], leakage)
-                    for i in range(0, num_samples, sample_step_hist))
-                histograms = np.concatenate((histograms[:]), axis=3)
-            elif specific_test_bit:
-                histograms = Parallel(n_jobs=num_jobs)(
-                    delayed(compute_histograms_aes_bit)(trace_resolution, rnd_list, bit_list,
-                                                        traces[:, i:i + sample_step_hist], leakage)
-                    for i in range(0, num_samples, sample_step_hist))
-                histograms = np.concatenate((histograms[:]), axis=3)
-            else:
-                # For every time sample we make 2 histograms, one for the fixed set and one for the
-                # random set.
-                # histograms has dimensions [0, 0, 2, num_samples, trace_resolution]
-                # The value stored in histograms[v][w][x][y][z] shows how many traces have value z
-                # at time y, given that trace is in the fixed (x = 0) or random (x = 1) group. The
-                # v and w indices are not used but we keep them for code compatiblitly with
-                # non-general AES TVLA.
-                histograms = Parallel(n_jobs=num_jobs)(
-                    delayed(compute_histograms_general)(trace_resolution,
-                                                        traces[:, i:i + sample_step_hist],
-                                                        leakage)
-                    for i in range(0, num_samples, sample_step_hist))
-                histograms = np.concatenate((histograms[:]), axis=3)
-
-            # Free traces from memory as they are not needed anymore.
-            traces = None
-
-            # Add up new data to potential, previously generated histograms.
-            if cfg["input_histogram_file"] is not None or i_step > 0:
-                histograms = histograms + histograms_in
-
-            # Move current histograms to temp variable for next step.
-            if num_steps > 1 and i_step < num_steps - 1:
-                histograms_in = histograms
-
-            # Histograms can be saved for later use if output file name is passed.
-            if cfg["output_histogram_file"] is not None:
-                log.info("Saving Histograms")
-                np.savez(cfg["output_histogram_file"], histograms=histograms, rnd_list=rnd_list,
-                         byte_list=byte_list, bit_list=bit_list, single_trace = trace_to_plot)
-
-            # Computing the t-test statistics vs. time.
-            log.info("Computing T-test Statistics")
-
-            # The number of samples processed by each parallel job at a time.
-            sample_step_ttest = num_samples // num_jobs
-
-            x_axis = np.arange(trace_resolution)
-
-            # Compute statistics.
-            # ttest_trace has dimensions [num_orders, num_rnds, num_bytes, num_samples].
-            ttest_trace = Parallel(n_jobs=num_jobs)(
-                delayed(compute_statistics)(cfg["test_type"], num_orders,
-                                            histograms[:, :, :, i:i + sample_step_ttest, :],
-                                            x_axis, rnd_list, byte_list, bit_list)
-                for i in range(0, num_samples, sample_step_ttest))
-            ttest_trace = np.concatenate((ttest_trace[:]), axis=3)
-
-            # Building the t-test statistics vs. number of traces used. ttest_step has dimensions
-            # [num_orders, num_rnds, num_bytes, num_samples, num_steps], i.e., for every order,
-            # every round, every byte, every sample and every step, we track the t-test value.
-            log.info("Updating T-test Statistics vs. Number of Traces")
-            if i_step == 0:
-                ttest_step = np.empty((num_orders, num_rnds, num_data, num_samples,
-                                       num_steps))
-            ttest_step[:, :, :, :, i_step] = ttest_trace
-
-        rnd_ext = list(range(num_rnds))
-        byte_ext = list(range(num_bytes))
-        bit_ext = list(range(num_bits))
-
-    elif cfg["ttest_step_file"] is not None:
-        # Load previously generated t-test results.
-        ttest_step_file = np.load(cfg["ttest_step_file"], allow_pickle=True)
-        metadata = ttest_step_file['metadata'].item()
-        sample_start = ttest_step_file['sample_start']
-        single_trace = ttest_step_file['single_trace']
-        trace_start_vec = ttest_step_file['trace_start_vec']
-        num_traces_used_total = ttest_step_file['num_traces']
-        ttest_step = ttest_step_file['ttest_step']
-        num_orders = ttest_step.shape[0]
-        num_samples = ttest_step.shape[3]
-        num_steps = ttest_step.shape[4]
-        trace_end_vec = ttest_step_file['trace_end_vec']
-        # The rounds and bytes of interest must be available in the previously generated t-test
-        # results. In addition, we may need to translate indices to extract the right portion of
-        # of the loaded results.
-        rnd_ext = np.zeros((num_rnds), dtype=np.uint8)
-        byte_ext = np.zeros((num_bytes), dtype=np.uint8)
-        for i_rnd in range(num_rnds):
-            assert rnd_list[i_rnd] in ttest_step_file['rnd_list']
-            rnd_ext[i_rnd] = np.where(ttest_step_file['rnd_list'] == rnd_list[i_rnd])[0][0]
-        for i_byte in range(num_bytes):
-            assert byte_list[i_byte] in ttest_step_file['byte_list']
-            byte_ext[i_byte] = np.where(ttest_step_file['byte_list'] == byte_list[i_byte])[0][0]
-
-        # Plot the t-test vs. time figures for the maximum number of traces.
-        ttest_trace = ttest_step[:, :, :, :, num_steps - 1]
-
-        if general_test:
-            single_trace_file = os.path.dirname(cfg["ttest_step_file"])
-            single_trace_file += "/" if single_trace_file else ""
-            single_trace_file += "single_trace.npy"
-            single_trace = np.load(single_trace_file)
-            assert num_samples == single_trace.shape[0]
-
-    if save_to_disk_ttest:
-        if num_steps > 1:
-            log.info("Saving T-test Step")
-            np.savez_compressed('tmp/ttest-step.npy',
-                                ttest_step=ttest_step,
-                                num_traces=num_traces_used_total,
-                                metadata=metadata,
-                                sample_start=sample_start,
-                                trace_start_vec=trace_start_vec,
-                                trace_end_vec=trace_end_vec,
-                                rnd_list=rnd_list,
-                                byte_list=byte_list,
-                                bit_list=bit_list,
-                                single_trace=trace_to_plot)
-        else:
-            log.info("Saving T-test")
-            np.save('tmp/ttest.npy', ttest_trace)
-
-    # Check ttest results.
-    threshold = 4.5
-    failure = np.any(np.abs(ttest_trace) >= threshold, axis=3)
-    nan = np.isnan(np.sum(ttest_trace, axis=3))
-
-    if not np.any(failure):
-        log.info("No leakage above threshold identified.")
-    if np.any(failure) or np.any(nan):
-        if specific_test_byte:
-            if np.any(failure):
-                log.info("Leakage above threshold identified in the following order(s), round(s) "
-                         "and byte(s) marked with X:")
-            if np.any(nan):
-                log.info("Couldn't compute statistics for order(s), round(s) and byte(s) marked "
-                         "with O:")
-            with UnformattedLog():
-                byte_str = "Byte     |"
-                dash_str = "----------"
-                for i_byte in range(num_bytes):
-                    byte_str += str(byte_list[i_byte]).rjust(5)
-                    dash_str += "-----"
-
-                for i_order in range(num_orders):
-                    log.info(f"Order {i_order + 1}:")
-                    log.info(f"{byte_str}")
-                    log.info(f"{dash_str}")
-                    for i_rnd in range(num_rnds):
-                        result_str = "Round " + str(rnd_list[i_rnd]).rjust(2) + " |"
-                        for i_byte in range(num_bytes):
-                            if failure[i_order, rnd_ext[i_rnd], byte_ext[i_byte]]:
-                                result_str += str("X").rjust(5)
-                            elif nan[i_order, rnd_ext[i_rnd], byte_ext[i_byte]]:
-                                result_str += str("O").rjust(5)
-                            else:
-                                result_str += "     "
-                        log.info(f"{result_str}")
-                    log.info("")
-        elif specific_test_bit:
-            if np.any(failure):
-                log.info("Leakage above threshold identified in the following order(s), round(s) "
-                         "and bit(s) marked with X:")
-            if np.any(nan):
-                log.info("Couldn't compute statistics for order(s), round(s) and bit(s) marked "
-                         "with O:")
-            with UnformattedLog():
-                bit_str = "Bit     |"
-                dash_str = "----------"
-                for i_bit in range(num_bits):
-                    bit_str += str(bit_list[i_bit]).rjust(5)
-                    dash_str += "-----"
-
-                for i_order in range(num_orders):
-                    log.info(f"Order {i_order + 1}:")
-                    log.info(f"{bit_str}")
-                    log.info(f"{dash_str}")
-                    for i_rnd in range(num_rnds):
-                        result_str = "Round " + str(rnd_list[i_rnd]).rjust(2) + " |"
-                        for i_bit in range(num_bits):
-                            if failure[i_order, rnd_ext[i_rnd], bit_ext[i_bit]]:
-                                result_str += str("X").rjust(5)
-                            elif nan[i_order, rnd_ext[i_rnd], bit_ext[i_bit]]:
-                                result_str += str("O").rjust(5)
-                            else:
-                                result_str += "     "
-                        log.info(f"{result_str}")
-                    log.info("")
-        else:
-            log.info("Leakage above threshold identified in the following order(s) marked with X")
-            if np.any(nan):
-                log.info("Couldn't compute statistics for order(s) marked with O:")
-            with UnformattedLog():
-                for i_order in range(num_orders):
-                    result_str = "Order " + str(i_order + 1) + ": "
-                    if failure[i_order, 0, 0]:
-                        result_str += "X"
-                    elif nan[i_order, 0, 0]:
-                        result_str += "O"
-                    else:
-                        result_str += " "
-                    log.info(f"{result_str}")
-                log.info("")
+                f"({100*num_traces/num_traces_orig:.1f}%)"
+            )
 
-    if cfg["plot_figures"]:
-        log.info("Plotting Figures to tmp/figures")
-        Path("tmp/figures").mkdir(exist_ok=True)
+            num_traces_used_total += num_traces
 
-        # Metadata text variable for plot
-        textbox = ""
-        # Catch case where certain metadata isn't saved to project file (e.g. older measurement)
-        try:
-            sampling_rate = float(metadata['sampling_rate']) / 1e6
-            textbox = textbox + "Sample rate:\n" + str(
-                math.floor(sampling_rate)) + " MS/s\n\n"
-        except KeyError:
-            textbox = textbox
-        try:
-            textbox = textbox + "Masks off:\n" + metadata['masks_off'] + "\n\n"
-        except KeyError:
-            textbox = textbox
-        try:
-            textbox = textbox + "Samples:\n" + str(
-                metadata['num_samples']) + "\n\n"
-        except KeyError:
-            textbox = textbox
-        try:
-            textbox = textbox + "Offset:\n" + str(
-                metadata['offset_samples']) + "\n\n"
-        except KeyError:
-            textbox = textbox
-        try:
-            textbox = textbox + "Scope gain:\n" + str(
-                metadata['scope_gain']) + "\n\n"
-        except KeyError:
-            textbox = textbox
-        try:
-            textbox = textbox + "Traces:\n" + str(num_traces_used_total) + "\n\n"
-        except KeyError:
-            textbox = textbox
-        if textbox != "":
-            # remove last two linebreaks
-            textbox = textbox[:-2]
+            # Store reference trace to plot in figure. Avoid using the first
+            # trace as this initial trace could sometimes be noisy.
+            trace_to_plot = traces[0]
+            if len(traces) > 1:
+                trace_to_plot = traces[1]
 
-        # Plotting figures for t-test statistics vs. time.
-        log.info("Plotting T-test Statistics vs. Time.")
+            # Create local, dense copies of keys and plaintexts.
+            plaintexts = None
+            keys = None
+            if load_plaintexts:
+                plaintexts = project.get_plaintexts_array(trace_start, trace_end + 1)
+            if load_keys:
+                keys = project.get_keys_array(trace_start, trace_end + 1)
+                if cfg["mode"] == "otbn":
+                    assert keys.shape[1] == key_len_bytes
 
-        if cfg["mode"] == "aes" and specific_test:
-            # By default the figures are saved under tmp/t_test_round_x_byte_y.png.
-            for i_rnd in range(num_rnds):
-                for i_data in range(num_data):
+            # Only select traces to use.
+            if load_plaintexts:
+                plaintexts = plaintexts[traces_to_use[trace_start:trace_end + 1]]
+            if load_keys:
+                keys = keys[traces_to_use[trace_start:trace_end + 1]]
 
-                    fig, axs = plt.subplots(num_orders + 1, 1, sharex=True)
-                    axs = tvla_plotting_fnc(axs, num_orders, i_rnd, i_data,
-                                            ttest_trace, single_trace,
-                                            threshold, num_samples,
-                                            sample_start, metadata)
-                    if specific_test_byte:
-                        title = "TVLA of " + "aes_t_test_round_" + str(
-                            rnd_list[i_rnd]) + "_byte_" + str(byte_list[i_data])
-                    elif specific_test_bit:
-                        title = "TVLA of " + "aes_t_test_round_" + str(
-                            rnd_list[i_rnd]) + "_bit_" + str(bit_list[i_data])
-                    # Catch case where datetime data isn't saved
-                    # to project file (e.g. older measurement)
-                    try:
-                        title = title + "\n" + "Captured: " + metadata[
-                            'datetime']
-                    except KeyError:
-                        title = title
-                    axs[0].set_title(title)
+            # We don't need the project file anymore after this point. Close it
+            # together with all trace files opened in the background.
+            project.close(save=False)
 
-                    # Add metadata to plot
-                    if textbox != "":
-                        left, width = .67, .5
-                        bottom, height = .25, .5
-                        right = left + width
-                        top = bottom + height
-                        plt.gcf().text(0.5 * (left + right),
-                                       0.5 * (bottom + top),
-                                       textbox,
-                                       fontsize=9,
-                                       horizontalalignment='center',
-                                       verticalalignment='center',
-                                       bbox=dict(boxstyle='round',
-                                                 facecolor='w',
-                                                 linewidth=0.6))
-                        plt.subplots_adjust(right=0.84)
-                    plt.xlabel("time [samples]")
+            # Tests with the same test type and leakage model share the leakage.
+            leakages = {}
+            # The traces are shared with the parallel jobs of all tests building histograms, only
+            # the groups are copied for every test.
+            shared_traces = traces
+            if scratch is not None and any(test.backend != "moments" for test in tests):
+                shared_traces = scratch.copy(traces)
+            for test_cfg, test in zip(test_cfgs, tests):
+                if len(tests) > 1:
+                    log.info(f"Test {test_cfg['name']}:")
 
-                    filename = "aes_t_test_round_" + str(rnd_list[i_rnd])
-                    if specific_test_byte:
-                        filename += "_byte_" + str(byte_list[i_data]) + ".png"
-                    elif specific_test_bit:
-                        filename += "_bit_" + str(bit_list[i_data]) + ".png"
-                    plt.savefig("tmp/figures/" + filename)
-                    if num_rnds == 1 and num_data == 1:
-                        plt.show()
-                    else:
-                        plt.close()
+                # Compute or load previously computed leakage model.
+                if test.specific_test and test_cfg["leakage_file"] is not None:
+                    leakage = np.load(test_cfg["leakage_file"])
+                    assert num_traces == leakage.shape[2]
+                else:
+                    leakage_key = (test.test_type, test.leakage_model)
+                    if leakage_key not in leakages:
+                        log.info("Computing Leakage")
+                        leakages[leakage_key] = compute_leakage(test.test_type,
+                                                                test.leakage_model, keys,
+                                                                plaintexts)
+                    leakage = leakages[leakage_key]
+                    if test.specific_test and save_to_disk_leakage:
+                        log.info("Saving Leakage")
+                        Path(test_cfg["out_dir"]).mkdir(parents=True, exist_ok=True)
+                        np.save(test_cfg["out_dir"] + '/leakage.npy', leakage)
 
-        else:
-            fig, axs = plt.subplots(num_orders + 1, 1, sharex=True)
-            axs = tvla_plotting_fnc(axs, num_orders, 0, 0, ttest_trace,
-                                    single_trace, threshold, num_samples,
-                                    sample_start, metadata)
+                # Uncomment the function call below for debugging e.g. when the t-test results
+                # aren't centered around 0.
+                # plot_fvsr_stats(traces, leakage)
 
-            title = "TVLA of " + (cfg["project_file"]).rsplit('/', 1)[-1]
-            # Catch case where datetime data isn't saved to project file (e.g. older measurement)
-            try:
-                title = title + "\n" + "Captured: " + metadata['datetime']
-            except KeyError:
-                title = title
-            axs[0].set_title(title)
+                groups = compute_groups(test.test_type, leakage, test.rnd_list, test.byte_list,
+                                        test.bit_list)
+                leakage = None
 
-            # Add metadata to plot
-            if textbox != "":
-                left, width = .67, .5
-                bottom, height = .25, .5
-                right = left + width
-                top = bottom + height
-                plt.gcf().text(0.5 * (left + right),
-                               0.5 * (bottom + top),
-                               textbox,
-                               fontsize=9,
-                               horizontalalignment='center',
-                               verticalalignment='center',
-                               bbox=dict(boxstyle='round',
-                                         facecolor='w',
-                                         linewidth=0.6))
-                plt.subplots_adjust(right=0.84)
+                if test.backend == "moments":
+                    # Instead of histograms, keep running central moments of all sets. These are
+                    # updated with the traces of every step.
+                    log.info("Updating Moments")
+                    if i_step == 0:
+                        test.moments = MomentAccumulator(test.num_rnds, test.num_data,
+                                                         num_samples, num_orders)
+                    test.moments.update(traces, groups)
+                    groups = None
+                else:
+                    log.info("Building Histograms")
+                    # For every time sample we make two histograms per round and byte/bit, one
+                    # for the fixed set and one for the random set. histograms has dimensions
+                    # [num_rnds, num_data, 2, num_samples, trace_resolution]
+                    # The value stored in histograms[v][w][x][y][z] shows how many traces have
+                    # value z at sample y, given that the trace belongs to set x for round v and
+                    # byte/bit w.
+                    # The histograms of all rounds and bytes/bits are built in a single pass over
+                    # the traces, the computation is parallelized over the samples. The new data
+                    # is added to potential, previously generated histograms.
+                    if i_step == 0:
+                        if test.histograms is None:
+                            test.histograms = np.zeros((test.num_rnds, test.num_data, 2,
+                                                        num_samples, trace_resolution),
+                                                       dtype=np.uint32)
+                        if scratch is not None:
+                            test.histograms = scratch.copy(test.histograms)
+                    compute_histograms_parallel(trace_resolution, shared_traces, groups,
+                                                test.histograms, num_jobs, chunk_size, scratch)
+                    groups = None
+
+                    # Histograms can be saved for later use if output file name is passed.
+                    if test_cfg["output_histogram_file"] is not None:
+                        log.info("Saving Histograms")
+                        np.savez(test_cfg["output_histogram_file"], histograms=test.histograms,
+                                 rnd_list=test.rnd_list, byte_list=test.byte_list,
+                                 bit_list=test.bit_list, single_trace = trace_to_plot)
+
+                # Accumulator files are only written at the end, no need for intermediate
+                # results.
+                if test_cfg.get("output_accumulator_file") is not None:
+                    continue
+
+                # Computing the t-test statistics vs. time.
+                log.info("Computing T-test Statistics")
+                # ttest_trace has dimensions [num_orders, num_rnds, num_data, num_samples].
+                if test.backend == "moments":
+                    test.ttest_trace = test.moments.ttest()
+                else:
+                    test.ttest_trace = compute_statistics_parallel(
+                        test.test_type, num_orders, test.histograms, test.rnd_list,
+                        test.byte_list, test.bit_list, num_jobs, chunk_size)
+
+                # Building the t-test statistics vs. number of traces used. ttest_step has
+                # dimensions [num_orders, num_rnds, num_bytes, num_samples, num_steps], i.e., for
+                # every order, every round, every byte, every sample and every step, we track the
+                # t-test value.
+                log.info("Updating T-test Statistics vs. Number of Traces")
+                if i_step == 0:
+                    test.ttest_step = np.empty((num_orders, test.num_rnds, test.num_data,
+                                                num_samples, num_steps))
+                test.ttest_step[:, :, :, :, i_step] = test.ttest_trace
 
-            plt.xlabel("time [samples]")
-            plt.savefig('tmp/figures/' + cfg["mode"] + '_fixed_vs_random.png')
-            plt.show()
+            # Free up memory.
+            plaintexts = None
+            keys = None
+            leakages = None
 
-        # Plotting figures for t-test statistics vs. number of traces used.
-        # For now, do a single figure per round and per order. Every line corresponds to the t-test
-        # result of one time sample for one byte and one round.
-        if num_steps > 1:
+            # Free traces from memory as they are not needed anymore.
+            if shared_traces is not traces:
+                scratch.release(shared_traces)
+            shared_traces = None
+            traces = None
 
-            log.info("Plotting T-test Statistics vs. Number of Traces, this may take a while.")
-            # Determine resolution.
-            xres_vec = [10e6, 1e6, 100e3, 10e3, 1e3, 100, 10, 1]
-            for xres in xres_vec:
-                if int(np.around((trace_end_vec[0] - trace_start_vec[0]) / xres)) > 0:
-                    if xres >= 1e6:
-                        xres_label = str(int(xres / 1e6)) + 'M'
-                    elif xres >= 1e3:
-                        xres_label = str(int(xres / 1e3)) + 'k'
-                    else:
-                        xres_label = str(int(xres))
-                    break
+        for test_cfg, test in zip(test_cfgs, tests):
+            if test_cfg.get("output_accumulator_file") is None:
+                continue
+            log.info("Saving Accumulator")
+            accumulator = {
+                "backend": test.backend,
+                "test_type": test.test_type,
+                "leakage_model": test.leakage_model,
+                "mode": cfg["mode"],
+                "rnd_list": test.rnd_list,
+                "byte_list": test.byte_list,
+                "bit_list": test.bit_list,
+                "num_orders": num_orders,
+                "sample_start": sample_start,
+                "num_samples": num_samples,
+                "num_traces": num_traces_used_total,
+                "trace_ranges": np.array([[trace_start_tot, trace_end_tot]]),
+                "project_files": np.array([str(cfg["project_file"])]),
+                "single_trace": single_trace,
+                "metadata": dict(metadata),
+            }
+            if test.backend == "moments":
+                accumulator["counts"] = test.moments.counts
+                accumulator["means"] = test.moments.means
+                accumulator["moments"] = test.moments.moments
+            else:
+                accumulator["histograms"] = test.histograms
+            save_accumulator(test_cfg["output_accumulator_file"], accumulator)
+            # The statistics are computed by the report command.
 
-            xticks = [np.around(trace_end / xres) for trace_end in trace_end_vec]
-            xticklabels = [str(int(tick)) for tick in xticks]
+    elif cfg["ttest_step_file"] is not None:
+        # Load previously generated t-test results.
+        test = tests[0]
+        ttest_step_file = np.load(cfg["ttest_step_file"], allow_pickle=True)
+        metadata = ttest_step_file['metadata'].item()
+        sample_start = ttest_step_file['sample_start']
+        single_trace = ttest_step_file['single_trace']
+        trace_to_plot = single_trace
+        trace_start_vec = ttest_step_file['trace_start_vec']
+        num_traces_used_total = ttest_step_file['num_traces']
+        test.ttest_step = ttest_step_file['ttest_step']
+        num_samples = test.ttest_step.shape[3]
+        num_steps = test.ttest_step.shape[4]
+        trace_end_vec = ttest_step_file['trace_end_vec']
+        # The rounds and bytes of interest must be available in the previously generated t-test
+        # results. In addition, we may need to translate indices to extract the right portion of
+        # of the loaded results.
+        test.rnd_ext = np.zeros((test.num_rnds), dtype=np.uint8)
+        test.byte_ext = np.zeros((test.num_bytes), dtype=np.uint8)
+        for i_rnd in range(test.num_rnds):
+            assert test.rnd_list[i_rnd] in ttest_step_file['rnd_list']
+            test.rnd_ext[i_rnd] = np.where(ttest_step_file['rnd_list'] ==
+                                           test.rnd_list[i_rnd])[0][0]
+        for i_byte in range(test.num_bytes):
+            assert test.byte_list[i_byte] in ttest_step_file['byte_list']
+            test.byte_ext[i_byte] = np.where(ttest_step_file['byte_list'] ==
+                                             test.byte_list[i_byte])[0][0]
 
-            # Empty every second label if we got more than 10 steps.
-            if num_steps > 10:
-                for i_step in range(num_steps):
-                    xticklabels[i_step] = "" if (i_step % 2 == 0) else xticklabels[i_step]
+        # Plot the t-test vs. time figures for the maximum number of traces.
+        test.ttest_trace = test.ttest_step[:, :, :, :, num_steps - 1]
 
-            for i_rnd in range(num_rnds):
+        if test.general_test:
+            single_trace_file = os.path.dirname(cfg["ttest_step_file"])
+            single_trace_file += "/" if single_trace_file else ""
+            single_trace_file += "single_trace.npy"
+            single_trace = np.load(single_trace_file)
+            assert num_samples == single_trace.shape[0]
 
-                c = np.ones(num_steps)
-                fig, axs = plt.subplots(num_orders, 1, sharex=True)
+    for test_cfg, test in zip(test_cfgs, tests):
+        # The statistics of accumulator files are computed by the report command.
+        if test_cfg.get("output_accumulator_file") is None:
+            report_test(test_cfg, test, metadata, single_trace, trace_to_plot, sample_start,
+                        num_samples, num_steps, num_traces_used_total, trace_start_vec,
+                        trace_end_vec, save_to_disk_ttest)
 
-                # To reduce the number of lines in the plot, we only plot those samples where
-                # leakage is expected in the first place. This might need tuning if the design
-                # is altered.
 
-                if specific_test:
-                    # Each regular round lasts for 100 samples.
-                    samples_per_rnd = 100
-                    # We have a negative trigger offset of 20 samples. The initial key and data
-                    # loading takes another 20 samples, the initial round lasts for 100 samples.
-                    # Then center the window around the middle of the round. The effective
-                    # numbers are best tuned by doing a capture with masking switched off.
-                    rnd_offset = 150 + samples_per_rnd // 2
-                    # The widnow width is 100 samples + 40 samples extended on each side.
-                    half_window = samples_per_rnd // 2 + 40
+@app.command()
+def accumulate(ctx: typer.Context,
+               accumulator_file: str = typer.Argument(..., help="Output accumulator file.")):
+    """Accumulate the statistics of a range of traces into a mergeable accumulator file.
 
-                    samples = {"aes": range(max(rnd_offset + (rnd_list[i_rnd] * samples_per_rnd) -
-                                            half_window, 0),
-                                            min(rnd_offset + (rnd_list[i_rnd] * samples_per_rnd) +
-                                                half_window, num_samples))}
-                else:
-                    # Even if cfg["sample_start"] is specified and cfg["num_samples"] is not,
-                    # num_samples is set to a valid value and the code below has valid inputs.
-                    range_specified = True if \
-                        (("sample_start" in cfg and cfg["sample_start"] is not None) or
-                         ("num_samples" in cfg and cfg["num_samples"] is not None)) else False
+    The accumulator files of different trace ranges or projects can be combined with the merge
+    command and evaluated with the report command.
+    """
 
-                    samples = {
-                        # Simply plot all samples within the selected range.
-                        "aes": range(0, num_samples),
-                        # Plot samples within key absorption phase, unless a range is specified.
-                        "kmac": range(0, num_samples) if range_specified else range(520, 2460),
-                        # Plot samples within actual SHA3 phase, unless a range is specified.
-                        "sha3": range(0, num_samples) if range_specified else range(1150, 3150),
-                        # Simply plot all samples within the selected range.
-                        "otbn": range(0, num_samples),
-                    }
+    cfg = ctx.obj.cfg
+    assert cfg["input_histogram_file"] is None and cfg["ttest_step_file"] is None, \
+        "Input histogram and t-test step files are not supported when accumulating statistics."
+    cfg["output_accumulator_file"] = accumulator_file
+    cfg["number_of_steps"] = 1
+    cfg["output_histogram_file"] = None
+    cfg["save_to_disk_ttest"] = False
+    run_tvla(ctx)
 
-                for i_order in range(num_orders):
-                    for i_byte in range(num_bytes):
-                        for i_sample in samples[cfg["mode"]]:
-                            axs[i_order].plot(ttest_step[i_order,
-                                                         rnd_ext[i_rnd],
-                                                         byte_ext[i_byte],
-                                                         i_sample],
-                                              'k')
-                            axs[i_order].plot(c * threshold, 'r')
-                            axs[i_order].plot(-threshold * c, 'r')
-                            axs[i_order].set_xlabel(str('number of traces [' + xres_label + ']'))
-                            axs[i_order].set_xticks(range(num_steps))
-                            axs[i_order].set_xticklabels(xticklabels)
-                            axs[i_order].set_ylabel(
-                                't-test ' + str(i_order + 1) +
-                                "\nfor samples " + str(samples[cfg["mode"]][0]) +
-                                ' to ' + str(samples[cfg["mode"]][-1]))
 
-                filename = cfg["mode"] + "_t_test_steps_round_" + str(rnd_list[i_rnd]) + ".png"
-                plt.savefig("tmp/figures/" + filename)
-                if num_rnds == 1:
-                    plt.show()
-                else:
-                    plt.close()
+@app.command()
+def merge(output_file: str = typer.Argument(..., help="Output accumulator file."),
+          input_files: list[str] = typer.Argument(..., help="Input accumulator files.")):
+    """Merge accumulator files generated by the accumulate or merge commands."""
+
+    configure_logging()
+    accumulator = load_accumulator(input_files[0])
+    for input_file in input_files[1:]:
+        accumulator = merge_accumulators(accumulator, load_accumulator(input_file))
+    save_accumulator(output_file, accumulator)
+    log.info(f"Merged {len(input_files)} accumulator files with {accumulator['num_traces']} "
+             f"traces into {output_file}.")
+
+
+@app.command()
+def report(ctx: typer.Context,
+           accumulator_file: str = typer.Argument(..., help="Input accumulator file.")):
+    """Compute, check and plot the t-test statistics of an accumulator file."""
+
+    cfg = ctx.obj.cfg
+    # The test parameters are taken from the accumulator file.
+    accumulator = load_accumulator(accumulator_file)
+    cfg["backend"] = accumulator["backend"]
+    cfg["test_type"] = accumulator["test_type"]
+    cfg["leakage_model"] = accumulator["leakage_model"]
+    cfg["tests"] = None
+    cfg["mode"] = accumulator["mode"]
+    cfg["round_select"] = accumulator["rnd_list"].tolist()
+    cfg["byte_select"] = accumulator["byte_list"].tolist()
+    cfg["bit_select"] = accumulator["bit_list"].tolist()
+    cfg["input_accumulator_file"] = accumulator_file
+    cfg["number_of_steps"] = 1
+    cfg["input_histogram_file"] = None
+    cfg["output_histogram_file"] = None
+    cfg["ttest_step_file"] = None
+    accumulator = None
+    run_tvla(ctx)
 
 
 # Default values of the options.
@@ -1115,9 +1501,13 @@ default_number_of_steps = 1
 default_ttest_step_file = None
 default_plot_figures = False
 default_test_type = "GENERAL_KEY"
+default_leakage_model = "HAMMING_WEIGHT"
 default_mode = "aes"
 default_filter_traces = True
 default_update_cfg_file = False
+default_backend = "histogram"
+default_num_jobs = None
+default_chunk_size = None
 
 
 # Help messages of the options
@@ -1168,6 +1558,8 @@ help_plot_figures = inspect.cleandoc("""Plot figures and save them to disk. Defa
 help_test_type = inspect.cleandoc("""Select test type: can be either "SPECIFIC_BYTE", "GENERA_KEY",
     or "GENERAL_DATA".
     Default: """ + str(default_test_type))
+help_leakage_model = inspect.cleandoc("""Select the leakage model of the specific tests: can be
+    either "HAMMING_WEIGHT" or "HAMMING_DISTANCE". Default: """ + str(default_leakage_model))
 help_mode = inspect.cleandoc("""Select mode: can be either "aes", "kmac", "sha3" or "otbn".
     Default: """ + str(default_mode))
 help_filter_traces = inspect.cleandoc("""Excludes the outlier traces from the analysis. A trace is
@@ -1175,6 +1567,18 @@ help_filter_traces = inspect.cleandoc("""Excludes the outlier traces from the an
     Default: """ + str(default_filter_traces))
 help_update_cfg_file = inspect.cleandoc("""Update existing configuration file or create if there
     isn't any configuration file. Default: """ + str(default_update_cfg_file))
+help_backend = inspect.cleandoc("""Select the statistics backend: can be either "histogram" or
+    "moments". The moments backend keeps running central moments instead of histograms which
+    needs much less memory, e.g., for SPECIFIC_BIT tests over all rounds and bits. It doesn't
+    support histogram files. Default: """ + str(default_backend))
+
+help_num_jobs = inspect.cleandoc("""Number of parallel jobs for building the histograms and
+    computing the t-test statistics. The jobs share the traces, histograms and results via
+    memory-mapped scratch files in the temporary directory, e.g., set TMPDIR=/dev/shm to keep them
+    in memory. If not provided, all CPUs are used. Default: """ + str(default_num_jobs))
+help_chunk_size = inspect.cleandoc("""Number of samples processed by a parallel job at a time. If
+    not provided, every job gets an equally sized block of samples.
+    Default: """ + str(default_chunk_size))
 
 
 @app.callback()
@@ -1195,8 +1599,12 @@ def main(ctx: typer.Context,
          ttest_step_file: str = typer.Option(None, help=help_ttest_step_file),
          plot_figures: bool = typer.Option(None, help=help_plot_figures),
          test_type: str = typer.Option(None, help=help_test_type),
+         leakage_model: str = typer.Option(None, help=help_leakage_model),
          mode: str = typer.Option(None, help=help_mode),
          filter_traces: bool = typer.Option(None, help=help_filter_traces),
+         backend: str = typer.Option(None, help=help_backend),
+         num_jobs: int = typer.Option(None, help=help_num_jobs),
+         chunk_size: int = typer.Option(None, help=help_chunk_size),
          update_cfg_file: bool = typer.Option(None, help=help_update_cfg_file)):
     """A histogram-based TVLA described in "Fast Leakage Assessment" by O. Reparaz, B. Gierlichs and
     I. Verbauwhede (https://eprint.iacr.org/2017/624.pdf)."""
@@ -1207,7 +1615,8 @@ def main(ctx: typer.Context,
     for v in ['project_file', 'trace_file', 'trace_start', 'trace_end', 'leakage_file',
               'save_to_disk', 'save_to_disk_ttest', 'round_select', 'byte_select',
               'input_histogram_file', 'output_histogram_file', 'number_of_steps',
-              'ttest_step_file', 'plot_figures', 'test_type', 'mode', 'filter_traces']:
+              'ttest_step_file', 'plot_figures', 'test_type', 'leakage_model', 'mode',
+              'filter_traces', 'backend', 'num_jobs', 'chunk_size']:
         run_cmd = f'''cfg[v] = default_{v}'''
         exec(run_cmd)
 
@@ -1221,7 +1630,8 @@ def main(ctx: typer.Context,
     for v in ['project_file', 'trace_file', 'trace_start', 'trace_end', 'leakage_file',
               'save_to_disk', 'save_to_disk_ttest',
               'input_histogram_file', 'output_histogram_file', 'number_of_steps',
-              'ttest_step_file', 'plot_figures', 'test_type', 'mode', 'filter_traces']:
+              'ttest_step_file', 'plot_figures', 'test_type', 'leakage_model', 'mode',
+              'filter_traces', 'backend', 'num_jobs', 'chunk_size']:
         run_cmd = f'''if {v} is not None: cfg[v] = {v}'''
         exec(run_cmd)
     # The list arguments need to be handled a bit differently.
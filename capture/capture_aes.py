@@ -30,6 +30,7 @@ from target.targets import Target, TargetConfig
 from util import check_version
 from util import data_generator as dg
 from util import plot
+from util.tvla_monitor import TvlaMonitor, create_tvla_monitor
 
 """AES SCA capture script.
 
@@ -148,7 +149,8 @@ def setup(cfg: dict, project: Path):
                                 path = project,
                                 wave_dtype = np.uint16,
                                 overwrite = True,
-                                trace_threshold = cfg["capture"].get("trace_threshold")
+                                trace_threshold = cfg["capture"].get("trace_threshold"),
+                                fast_write = cfg["capture"].get("fast_write", False)
                                 )
     project = SCAProject(project_cfg)
     project.create_project()
@@ -274,7 +276,8 @@ def check_ciphertext(ot_aes, expected_last_ciphertext, ciphertext_len):
 
 
 def capture(scope: Scope, ot_aes: OTAES, capture_cfg: CaptureConfig,
-            project: SCAProject, target: Target):
+            project: SCAProject, target: Target,
+            monitor: Optional[TvlaMonitor] = None):
     """ Capture power consumption during AES encryption.
 
     Supports six different capture types:
@@ -291,6 +294,7 @@ def capture(scope: Scope, ot_aes: OTAES, capture_cfg: CaptureConfig,
         capture_cfg: The configuration of the capture.
         project: The SCA project.
         target: The OpenTitan target.
+        monitor: Optional live TVLA, which can stop the capture early.
     """
     # Initial plaintext.
     text_fixed = capture_cfg.text_fixed
@@ -376,6 +380,7 @@ def capture(scope: Scope, ot_aes: OTAES, capture_cfg: CaptureConfig,
             # Generate reference crypto material for all modes other than aes_fvsr_key
             # non-batch mode.
             # Store traces
+            monitor_data = []
             for i in range(capture_cfg.num_segments):
                 if capture_cfg.batch_mode or capture_cfg.capture_mode == "aes_random":
                     text, key, ciphertext = generate_ref_crypto(
@@ -398,6 +403,8 @@ def capture(scope: Scope, ot_aes: OTAES, capture_cfg: CaptureConfig,
                                      plaintext = bytearray(text),
                                      ciphertext = bytearray(ciphertext),
                                      key = bytearray(key))
+                # The fixed and random sets differ in the key or the plaintext.
+                monitor_data.append(key if capture_cfg.capture_mode == "aes_fvsr_key" else text)
 
                 if capture_cfg.capture_mode == "aes_random":
                     # Use ciphertext as next text, first text is the initial
@@ -415,6 +422,11 @@ def capture(scope: Scope, ot_aes: OTAES, capture_cfg: CaptureConfig,
             remaining_num_traces -= capture_cfg.num_segments
             pbar.update(capture_cfg.num_segments)
 
+            # Update the live TVLA and stop as soon as the result is clear.
+            if monitor is not None and monitor.update(waves, monitor_data):
+                capture_cfg.num_traces -= remaining_num_traces
+                break
+
 
 def print_plot(project: SCAProject, config: dict, file: Path) -> None:
     """ Print plot of traces.
@@ -489,8 +501,11 @@ def main(argv=None):
         trigger_source = 0
     ot_trig.select_trigger(trigger_source)
 
+    # Optional live TVLA during the capture.
+    monitor = create_tvla_monitor(cfg["capture"], capture_cfg.capture_mode)
+
     # Capture traces.
-    capture(scope, ot_aes, capture_cfg, project, target)
+    capture(scope, ot_aes, capture_cfg, project, target, monitor)
 
     # Print plot.
     print_plot(project, cfg, args.project)
@@ -521,6 +536,8 @@ def main(argv=None):
     metadata["notes"] = args.notes
     # Store the Git hash.
     metadata["git_hash"] = helpers.get_git_hash()
+    if monitor is not None:
+        metadata["tvla_monitor"] = monitor.summary()
     # Write metadata into project database.
     project.write_metadata(metadata)
 
@@ -34,6 +34,7 @@ from target.targets import Target, TargetConfig
 from util import check_version
 from util import data_generator as dg
 from util import plot
+from util.tvla_monitor import TvlaMonitor, create_tvla_monitor
 
 """KMAC SCA capture script.
 
@@ -152,7 +153,8 @@ def setup(cfg: dict, project: Path):
                                 path = project,
                                 wave_dtype = np.uint16,
                                 overwrite = True,
-                                trace_threshold = cfg["capture"].get("trace_threshold")
+                                trace_threshold = cfg["capture"].get("trace_threshold"),
+                                fast_write = cfg["capture"].get("fast_write", False)
                                 )
     project = SCAProject(project_cfg)
     project.create_project()
@@ -305,7 +307,8 @@ def check_ciphertext(ot_kmac, expected_last_ciphertext, ciphertext_len):
 
 
 def capture(scope: Scope, ot_kmac: OTKMAC, capture_cfg: CaptureConfig,
-            project: SCAProject, target: Target):
+            project: SCAProject, target: Target,
+            monitor: Optional[TvlaMonitor] = None):
     """ Capture power consumption during KMAC Tag computation.
 
     Supports four different capture types:
@@ -319,6 +322,7 @@ def capture(scope: Scope, ot_kmac: OTKMAC, capture_cfg: CaptureConfig,
         capture_cfg: The configuration of the capture.
         project: The SCA project.
         target: The OpenTitan target.
+        monitor: Optional live TVLA, which can stop the capture early.
     """
     # Initial plaintext.
     text_fixed = capture_cfg.text_fixed
@@ -375,6 +379,7 @@ def capture(scope: Scope, ot_kmac: OTKMAC, capture_cfg: CaptureConfig,
             assert waves.shape[0] == capture_cfg.num_segments
 
             expected_ciphertext = None
+            monitor_data = []
             # Generate reference crypto material and store trace.
             for i in range(capture_cfg.num_segments):
                 if capture_cfg.batch_mode or capture_cfg.capture_mode == "kmac_random":
@@ -395,6 +400,8 @@ def capture(scope: Scope, ot_kmac: OTKMAC, capture_cfg: CaptureConfig,
                                      plaintext = bytearray(text),
                                      ciphertext = bytearray(ciphertext),
                                      key = bytearray(key))
+                # The fixed and random sets differ in the key.
+                monitor_data.append(key)
 
                 if capture_cfg.capture_mode == "kmac_random":
                     plaintext = bytearray(16)
@@ -421,6 +428,11 @@ def capture(scope: Scope, ot_kmac: OTKMAC, capture_cfg: CaptureConfig,
             remaining_num_traces -= capture_cfg.num_segments
             pbar.update(capture_cfg.num_segments)
 
+            # Update the live TVLA and stop as soon as the result is clear.
+            if monitor is not None and monitor.update(waves, monitor_data):
+                capture_cfg.num_traces -= remaining_num_traces
+                break
+
 
 def print_plot(project: SCAProject, config: dict, file: Path) -> None:
     """ Print plot of traces.
@@ -493,8 +505,11 @@ def main(argv=None):
         trigger_source = 0
     ot_trig.select_trigger(trigger_source)
 
+    # Optional live TVLA during the capture.
+    monitor = create_tvla_monitor(cfg["capture"], capture_cfg.capture_mode)
+
     # Capture traces.
-    capture(scope, ot_kmac, capture_cfg, project, target)
+    capture(scope, ot_kmac, capture_cfg, project, target, monitor)
 
     # Print plot.
     print_plot(project, cfg, args.project)
@@ -525,6 +540,8 @@ def main(argv=None):
     metadata["notes"] = args.notes
     # Store the Git hash.
     metadata["git_hash"] = helpers.get_git_hash()
+    if monitor is not None:
+        metadata["tvla_monitor"] = monitor.summary()
     # Write metadata into project database.
     project.write_metadata(metadata)
 
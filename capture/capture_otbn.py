@@ -178,7 +178,8 @@ def setup(cfg: dict, project: Path):
         path=project,
         wave_dtype=np.uint16,
         overwrite=True,
-        trace_threshold=cfg["capture"].get("trace_threshold"))
+        trace_threshold=cfg["capture"].get("trace_threshold"),
+        fast_write=cfg["capture"].get("fast_write", False))
     project = SCAProject(project_cfg)
     project.create_project()
 
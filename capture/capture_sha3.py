@@ -33,6 +33,7 @@ from target.targets import Target, TargetConfig
 from util import check_version
 from util import data_generator as dg
 from util import plot
+from util.tvla_monitor import TvlaMonitor, create_tvla_monitor
 
 logger = logging.getLogger()
 
@@ -137,7 +138,8 @@ def setup(cfg: dict, project: Path):
                                 path = project,
                                 wave_dtype = np.uint16,
                                 overwrite = True,
-                                trace_threshold = cfg["capture"].get("trace_threshold")
+                                trace_threshold = cfg["capture"].get("trace_threshold"),
+                                fast_write = cfg["capture"].get("fast_write", False)
                                 )
     project = SCAProject(project_cfg)
     project.create_project()
@@ -324,7 +326,8 @@ def init_target(cfg: dict, capture_cfg: CaptureConfig, target: Target, text_fixe
 
 
 def capture(scope: Scope, cfg: dict, capture_cfg: CaptureConfig,
-            project: SCAProject, target: Target):
+            project: SCAProject, target: Target,
+            monitor: Optional[TvlaMonitor] = None):
     """ Capture power consumption during SHA3 digest computation.
 
     Supports four different capture types:
@@ -338,6 +341,7 @@ def capture(scope: Scope, cfg: dict, capture_cfg: CaptureConfig,
         capture_cfg: The configuration of the capture.
         project: The SCA project.
         target: The OpenTitan target.
+        monitor: Optional live TVLA, which can stop the capture early.
     Returns:
         device_id: The ID of the target device.
     """
@@ -434,6 +438,12 @@ def capture(scope: Scope, cfg: dict, capture_cfg: CaptureConfig,
                 # Update the loop variable and the progress bar.
                 remaining_num_traces -= capture_cfg.num_segments
                 pbar.update(capture_cfg.num_segments)
+
+                # Update the live TVLA and stop as soon as the result is clear. The fixed and
+                # random sets differ in the plaintext.
+                if monitor is not None and monitor.update(waves, text_array):
+                    capture_cfg.num_traces -= remaining_num_traces
+                    break
             else:
                 # No response, reset device and start over.
                 logger.info("No response received, resetting device!")
@@ -501,8 +511,11 @@ def main(argv=None):
                                 port = cfg["target"].get("port"))
     logger.info(f"Setting up capture {capture_cfg.capture_mode} batch={capture_cfg.batch_mode}...")
 
+    # Optional live TVLA during the capture.
+    monitor = create_tvla_monitor(cfg["capture"], capture_cfg.capture_mode)
+
     # Capture traces.
-    device_id = capture(scope, cfg, capture_cfg, project, target)
+    device_id = capture(scope, cfg, capture_cfg, project, target, monitor)
 
     # Print plot.
     print_plot(project, cfg, args.project)
@@ -533,6 +546,8 @@ def main(argv=None):
     metadata["notes"] = args.notes
     # Store the Git hash.
     metadata["git_hash"] = helpers.get_git_hash()
+    if monitor is not None:
+        metadata["tvla_monitor"] = monitor.summary()
     # Write metadata into project database.
     project.write_metadata(metadata)
 
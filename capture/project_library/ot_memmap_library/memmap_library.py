@@ -0,0 +1,335 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from capture.project_library.ot_trace_library.trace_library import to_slice
+
+# Version of the on-disk format stored in the header.
+MEMMAP_LIBRARY_VERSION = 1
+
+HEADER_FILE = "header.json"
+METADATA_FILE = "metadata.pickle"
+
+# Number of traces per chunk when iterating over the waves.
+ITER_CHUNK_SIZE = 10000
+
+# Columns stored next to the waves, all with a fixed width per project.
+BYTES_COLUMNS = ("plaintext", "ciphertext", "key")
+POSITION_COLUMNS = ("x_pos", "y_pos")
+POSITION_DTYPE = np.int32
+
+
+def to_rows(values, dtype, width: Optional[int] = None) -> np.ndarray:
+    """ Convert a list of bytes-like objects or arrays into a (n, width) array of type dtype.
+
+    Missing values (None) are only allowed if all values of the column are missing, in which case
+    the column has width 0.
+    """
+    if all(value is None for value in values):
+        rows = np.empty((len(values), 0), dtype=dtype)
+    else:
+        data = b"".join(memoryview(np.ascontiguousarray(value, dtype=dtype)
+                                   if isinstance(value, np.ndarray) else bytes(value))
+                        for value in values)
+        rows = np.frombuffer(data, dtype=dtype).reshape(len(values), -1)
+    assert width is None or rows.shape[1] == width, \
+        f"Expected entries with {width} values, got {rows.shape[1]}."
+    return rows
+
+
+class MemmapLibrary:
+    """ Class for writing/reading traces to a memory-mapped columnar store.
+
+    The project is a directory containing one raw, fixed-width file per column: the waves, the
+    plaintexts, the ciphertexts, the keys and the x/y positions of the probe. A small JSON header
+    stores the number of traces and the layout of the columns, the capture metadata is pickled
+    into a separate file.
+
+    Like TraceLibrary, traces are first written into memory and appended to the files after
+    reaching a trace memory threshold. The header is updated after the data is written, so an
+    interrupted capture keeps all previously flushed traces. For reading, the files are
+    memory-mapped and ranges of traces and windows of samples are returned as read-only views
+    without copying.
+    """
+    def __init__(self, path, trace_threshold, wave_datatype = np.uint16,
+                 overwrite = False):
+        # If .mmap extension is not provided, add it to the directory.
+        path = str(path)
+        if not path.endswith(".mmap"):
+            path = path + ".mmap"
+        self.path = Path(path)
+        # If overwrite flag is set, delete existing project.
+        if overwrite and self.path.exists():
+            shutil.rmtree(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if (self.path / HEADER_FILE).exists():
+            self.header = json.loads((self.path / HEADER_FILE).read_text())
+            assert self.header["version"] == MEMMAP_LIBRARY_VERSION, \
+                f"Unsupported memmap library version {self.header['version']}."
+            assert np.dtype(self.header["wave_dtype"]) == np.dtype(wave_datatype), \
+                f"Project stores waves of type {self.header['wave_dtype']}."
+            # Drop data of traces written after the last header update.
+            for column in self.columns():
+                column_file = self.column_file(column)
+                expected_size = self.header["num_traces"] * self.row_size(column)
+                if column_file.stat().st_size > expected_size:
+                    os.truncate(column_file, expected_size)
+        else:
+            # The widths of the columns are set by the first flush.
+            self.header = {"version": MEMMAP_LIBRARY_VERSION,
+                           "num_traces": 0,
+                           "wave_dtype": np.dtype(wave_datatype).str,
+                           "widths": None}
+            self.write_header()
+        self.trace_mem = []
+        self.trace_mem_thr = trace_threshold
+        self.wave_datatype = np.dtype(wave_datatype)
+        self.memmaps = {}
+
+    def columns(self):
+        """ Names of the stored columns, empty before the first flush."""
+        return [] if self.header["widths"] is None else list(self.header["widths"])
+
+    def column_dtype(self, column):
+        if column == "wave":
+            return np.dtype(self.header["wave_dtype"])
+        elif column in POSITION_COLUMNS:
+            return np.dtype(POSITION_DTYPE)
+        return np.dtype(np.uint8)
+
+    def column_file(self, column):
+        return self.path / (column + ".bin")
+
+    def row_size(self, column):
+        """ Number of bytes per trace in the file of the column."""
+        return self.header["widths"][column] * self.column_dtype(column).itemsize
+
+    def write_header(self):
+        """ Atomically replace the header file."""
+        tmp_file = self.path / (HEADER_FILE + ".tmp")
+        tmp_file.write_text(json.dumps(self.header))
+        os.replace(tmp_file, self.path / HEADER_FILE)
+
+    def close(self, save: bool):
+        """ Close project.
+        Args:
+            save: Save data to the project.
+        """
+        if save:
+            self.flush_to_disk()
+        self.memmaps = {}
+
+    def flush_to_disk(self):
+        """ Appends the traces from memory to the column files.
+        """
+        if not self.trace_mem:
+            return
+        widths = self.header["widths"]
+        rows = {"wave": to_rows([trace.wave for trace in self.trace_mem], self.wave_datatype,
+                                None if widths is None else widths["wave"])}
+        for column in BYTES_COLUMNS:
+            rows[column] = to_rows([getattr(trace, column) for trace in self.trace_mem],
+                                   np.uint8, None if widths is None else widths[column])
+        for column in POSITION_COLUMNS:
+            rows[column] = np.array([[getattr(trace, column) or 0] for trace in self.trace_mem],
+                                    dtype=POSITION_DTYPE)
+        self.append_rows(rows)
+        self.trace_mem = []
+
+    def append_rows(self, rows):
+        """ Appends the rows of all columns to the column files and updates the header.
+
+        Args:
+            rows: Dictionary with an (n, width) array per column.
+        """
+        widths = self.header["widths"]
+        if widths is None:
+            self.header["widths"] = {column: data.shape[1] for column, data in rows.items()}
+        for column, data in rows.items():
+            with open(self.column_file(column), "ab") as column_file:
+                data.tofile(column_file)
+        self.header["num_traces"] += len(rows["wave"])
+        self.write_header()
+        # Existing memory maps don't cover the new traces.
+        self.memmaps = {}
+
+    def append_arrays(self, waves, plaintexts, ciphertexts, keys):
+        """ Appends traces given as arrays with one row per trace to the column files.
+
+        Buffered traces are flushed first to keep the order of the traces. The
+        arrays are written as they are without creating Trace objects.
+        """
+        self.flush_to_disk()
+        num_traces = len(waves)
+        if num_traces == 0:
+            return
+        widths = self.header["widths"]
+        rows = {"wave": np.asarray(waves, dtype=self.wave_datatype).reshape(num_traces, -1)}
+        for column, values in zip(BYTES_COLUMNS, [plaintexts, ciphertexts, keys]):
+            rows[column] = np.asarray(values, dtype=np.uint8).reshape(num_traces, -1)
+        for column in POSITION_COLUMNS:
+            rows[column] = np.zeros((num_traces, 1), dtype=POSITION_DTYPE)
+        if widths is not None:
+            for column, data in rows.items():
+                assert data.shape[1] == widths[column], \
+                    f"Expected entries with {widths[column]} values, got {data.shape[1]}."
+        self.append_rows(rows)
+
+    def write_to_buffer(self, trace):
+        """ Write traces into memory or into storage.
+
+        The trace is first written into memory. When the length of the buffer
+        reaches the memory threshold, the traces are appended to the files.
+
+        Args:
+            trace: The trace to write. The wave is either an array or its raw
+                   bytes in the wave datatype.
+        """
+        self.trace_mem.append(trace)
+        if len(self.trace_mem) >= self.trace_mem_thr:
+            self.flush_to_disk()
+
+    def num_traces(self) -> int:
+        """ Number of traces stored on disk and in memory."""
+        return self.header["num_traces"] + len(self.trace_mem)
+
+    def num_samples(self) -> int:
+        """ Number of samples per wave, 0 if there are no traces."""
+        self.flush_to_disk()
+        if self.header["widths"] is None:
+            return 0
+        return self.header["widths"]["wave"]
+
+    def dtype(self) -> np.dtype:
+        """ Datatype of the samples of the waves."""
+        return self.wave_datatype
+
+    def get_column_array(self, column, start: Optional[int] = None,
+                         end: Optional[int] = None):
+        """ Get a column of the traces start to end as a read-only view of the memory map.
+
+        Returns:
+            A (num_traces, width) array.
+        """
+        self.flush_to_disk()
+        if column not in self.memmaps:
+            num_traces = self.header["num_traces"]
+            width = 0 if num_traces == 0 else self.header["widths"][column]
+            if num_traces * width == 0:
+                # Empty files can't be memory-mapped.
+                self.memmaps[column] = np.empty((num_traces, width),
+                                                dtype=self.column_dtype(column))
+            else:
+                self.memmaps[column] = np.memmap(self.column_file(column),
+                                                 dtype=self.column_dtype(column), mode="r",
+                                                 shape=(num_traces, width))
+        return self.memmaps[column][start:end]
+
+    def get_column(self, column, start: Optional[int] = None,
+                   end: Optional[int] = None):
+        """ Get a column of the traces start to end.
+
+        If only start is provided, the entry of the single trace is returned.
+        """
+        single = (start is not None) and (end is None)
+        values = self.get_column_array(column, *to_slice(start, end))
+        return values[0] if single else values
+
+    def get_waves(self, start: Optional[int] = None, end: Optional[int] = None):
+        """ Get the waves start to end, or the wave start if end is not provided.
+        """
+        return self.get_column("wave", start, end)
+
+    def get_plaintexts(self, start: Optional[int] = None,
+                       end: Optional[int] = None):
+        """ Get the plaintexts start to end in the uint8 array format.
+        """
+        return self.get_column("plaintext", start, end)
+
+    def get_ciphertexts(self, start: Optional[int] = None,
+                        end: Optional[int] = None):
+        """ Get the ciphertexts start to end in the uint8 array format.
+        """
+        return self.get_column("ciphertext", start, end)
+
+    def get_keys(self, start: Optional[int] = None,
+                 end: Optional[int] = None):
+        """ Get the keys start to end in the uint8 array format.
+        """
+        return self.get_column("key", start, end)
+
+    def get_waves_array(self, start: Optional[int] = None, end: Optional[int] = None,
+                        sample_start: int = 0, num_samples: Optional[int] = None):
+        """ Get the samples sample_start to sample_start + num_samples of the waves start to end.
+
+        Returns:
+            A read-only (num_traces, num_samples) view of the memory-mapped waves.
+        """
+        sample_end = None if num_samples is None else sample_start + num_samples
+        return self.get_column_array("wave", start, end)[:, sample_start:sample_end]
+
+    def iter_waves_arrays(self, start: Optional[int] = None, end: Optional[int] = None,
+                          sample_start: int = 0, num_samples: Optional[int] = None,
+                          chunk_size: int = ITER_CHUNK_SIZE):
+        """ Iterate over the waves start to end in chunks of up to chunk_size waves.
+
+        Yields:
+            Read-only (num_traces, num_samples) views of the memory-mapped waves.
+        """
+        waves = self.get_waves_array(start, end, sample_start, num_samples)
+        for i in range(0, len(waves), chunk_size):
+            yield waves[i:i + chunk_size]
+
+    def get_plaintexts_array(self, start: Optional[int] = None,
+                             end: Optional[int] = None):
+        """ Get the plaintexts start to end as a 2-D uint8 array.
+        """
+        return self.get_column_array("plaintext", start, end)
+
+    def get_ciphertexts_array(self, start: Optional[int] = None,
+                              end: Optional[int] = None):
+        """ Get the ciphertexts start to end as a 2-D uint8 array.
+        """
+        return self.get_column_array("ciphertext", start, end)
+
+    def get_keys_array(self, start: Optional[int] = None,
+                       end: Optional[int] = None):
+        """ Get the keys start to end as a 2-D uint8 array.
+        """
+        return self.get_column_array("key", start, end)
+
+    def get_positions_array(self, start: Optional[int] = None,
+                            end: Optional[int] = None):
+        """ Get the x and y positions of the probe for the traces start to end.
+
+        Returns:
+            A (num_traces, 2) array.
+        """
+        return np.hstack([self.get_column_array(column, start, end)
+                          for column in POSITION_COLUMNS])
+
+    def write_metadata(self, metadata):
+        """ Write metadata into the project, replacing the existing metadata.
+
+        Args:
+           metadata: The metadata to store.
+        """
+        with open(self.path / METADATA_FILE, "wb") as metadata_file:
+            pickle.dump(metadata, metadata_file)
+
+    def get_metadata(self):
+        """ Get metadata from the project.
+
+        Returns:
+            The metadata of the project.
+        """
+        with open(self.path / METADATA_FILE, "rb") as metadata_file:
+            return pickle.load(metadata_file)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+"""Benchmark for writing and reading traces of an ot_trace_library database.
+
+Reports the write throughput when creating the database, with or without the fast write mode.
+Compares reading all columns of all traces at once, which is what the library used to do for
+every read, with the column-projected and streaming reads.
+
+Typical usage:
+>>> ./benchmark_trace_library.py -d /tmp/benchmark.db --create -n 200000 -s 5000
+"""
+
+import argparse
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import sqlalchemy as db
+
+ABS_PATH = Path(__file__).resolve().parent
+sys.path.append(str(ABS_PATH / "../../.."))
+from capture.project_library.ot_trace_library.trace_library import (  # noqa: E402
+    Trace, TraceLibrary)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ot_trace_library read throughput.")
+    parser.add_argument("-d", "--db", required=True, help="Database file.")
+    parser.add_argument("--create", action="store_true",
+                        help="Create the database with random traces first.")
+    parser.add_argument("-n", "--num-traces", type=int, default=200000,
+                        help="Number of traces to create.")
+    parser.add_argument("-s", "--num-samples", type=int, default=5000,
+                        help="Number of samples per trace to create.")
+    parser.add_argument("--fast-write", action="store_true",
+                        help="Use the fast write mode when creating the database.")
+    parser.add_argument("-c", "--chunk-size", type=int, default=1000,
+                        help="Number of traces per chunk for streaming reads.")
+    parser.add_argument("-w", "--window", type=int, nargs=2, default=None,
+                        metavar=("SAMPLE_START", "NUM_SAMPLES"),
+                        help="Only read this sample window in the projected reads.")
+    parser.add_argument("--skip-full-rows", action="store_true",
+                        help="Skip the reads of all columns, which need memory for the entire "
+                             "database.")
+    return parser.parse_args()
+
+
+def create_db(path, num_traces, num_samples, fast_write):
+    """Create a database with random traces and report the write throughput."""
+    rng = np.random.default_rng(0)
+    library = TraceLibrary(path, trace_threshold=10000, wave_datatype=np.uint16, overwrite=True,
+                           fast_write=fast_write)
+    batch = 10000
+    duration = 0
+    for i in range(0, num_traces, batch):
+        n = min(batch, num_traces - i)
+        # Only the time spent in the library is measured.
+        waves = rng.integers(0, 4096, (n, num_samples), dtype=np.uint16)
+        texts = rng.integers(0, 256, (n, 3, 16), dtype=np.uint8)
+        start = time.perf_counter()
+        for j in range(n):
+            library.write_to_buffer(Trace(wave=waves[j].tobytes(),
+                                          plaintext=texts[j, 0],
+                                          ciphertext=texts[j, 1],
+                                          key=texts[j, 2]))
+        duration += time.perf_counter() - start
+    start = time.perf_counter()
+    library.close(save=True)
+    duration += time.perf_counter() - start
+    print(f"Wrote {num_traces} traces in {duration:.2f} s: {num_traces / duration:.0f} traces/s, "
+          f"{num_traces * num_samples * 2 / duration / 2**20:.1f} MB/s")
+
+
+def max_rss_mb():
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(name, num_bytes, fnc):
+    start = time.perf_counter()
+    result = fnc()
+    duration = time.perf_counter() - start
+    print(f"{name:<40} {duration:8.2f} s {num_bytes / duration / 2**20:10.1f} MB/s "
+          f"{max_rss_mb():10.0f} MB peak RSS")
+    return result
+
+
+def main():
+    args = parse_args()
+    if args.create:
+        create_db(args.db, args.num_traces, args.num_samples, args.fast_write)
+
+    library = TraceLibrary(args.db, trace_threshold=10000, wave_datatype=np.uint16)
+    num_traces = library.session.execute(
+        db.select(db.func.count()).select_from(library.traces_table)).scalar()
+    wave_bytes = len(library.get_waves_bytearray(0)[0])
+    sample_start, num_samples = 0, None
+    if args.window is not None:
+        sample_start, num_samples = args.window
+    window_bytes = wave_bytes - 2 * sample_start if num_samples is None else 2 * num_samples
+    print(f"{args.db}: {num_traces} traces, {wave_bytes} bytes per wave, "
+          f"{Path(args.db).stat().st_size / 2**30:.2f} GB")
+
+    # The peak RSS is monotonic, run the reads with the lowest memory consumption first.
+    def stream_waves():
+        total = 0
+        for waves in library.iter_waves_arrays(sample_start=sample_start,
+                                               num_samples=num_samples,
+                                               chunk_size=args.chunk_size):
+            total += len(waves)
+        return total
+
+    assert run("waves, streaming chunks", num_traces * window_bytes, stream_waves) == num_traces
+    run("keys, projected", num_traces * 16, library.get_keys_array)
+    run("waves, projected into one array", num_traces * window_bytes,
+        lambda: library.get_waves_array(sample_start=sample_start, num_samples=num_samples))
+
+    if not args.skip_full_rows:
+        # All columns of all traces, materialized with fetchall().
+        def full_rows():
+            query = db.select(library.traces_table)
+            return [Trace(**trace._mapping)
+                    for trace in library.session.execute(query).fetchall()]
+        run("keys, all columns", num_traces * 16,
+            lambda: [np.frombuffer(trace.key, np.uint8) for trace in full_rows()])
+        run("waves, all columns", num_traces * wave_bytes,
+            lambda: np.array([np.frombuffer(trace.wave, np.uint16) for trace in full_rows()]))
+
+    library.close(save=False)
+
+
+if __name__ == "__main__":
+    main()
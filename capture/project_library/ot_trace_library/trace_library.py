@@ -11,6 +11,46 @@ import sqlalchemy as db
 import sqlalchemy_utils as db_utils
 from sqlalchemy.orm import sessionmaker
 
+# Number of rows fetched from the database at a time when reading traces.
+FETCH_CHUNK_SIZE = 1000
+
+# Prepared statement used to insert traces with executemany().
+INSERT_TRACE_SQL = ("INSERT INTO traces (wave, plaintext, ciphertext, key, x_pos, y_pos) "
+                    "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def set_fast_write_pragmas(dbapi_connection, connection_record):
+    """ Configure an SQLite connection for high write throughput.
+
+    Large pages reduce the number of overflow pages per wave and only take effect for new
+    databases. With synchronous=NORMAL, SQLite syncs less often. An application crash is still
+    safe but a power loss at the wrong time can corrupt the database.
+
+    The rollback journal is kept on purpose: traces are only appended, so the journal hardly
+    contains any data, while a write-ahead log writes every wave twice and reduced the write
+    throughput by about 30 % in our measurements.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA page_size=65536")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def to_blob(value):
+    """ Convert bytes-like objects, e.g., numpy arrays, into an SQLite BLOB parameter.
+    """
+    return None if value is None else memoryview(value)
+
+
+def to_slice(start: Optional[int] = None, end: Optional[int] = None):
+    """ Convert the start and end arguments of the get_* functions to slice bounds.
+
+    If only start is provided, the get_* functions return a single trace.
+    """
+    if (start is not None) and (end is None):
+        end = start + 1
+    return start, end
+
 
 @dataclass
 class Metadata:
@@ -43,10 +83,12 @@ class TraceLibrary:
 
     Either a new database is created or traces are appended to the existing
     one. Traces are first written into memory and the flushed into the
-    database after reaching a trace memory threshold.
+    database after reaching a trace memory threshold. With fast_write, the
+    database uses large pages and relaxed syncing to speed up flushing
+    during capture.
     """
     def __init__(self, db_name, trace_threshold, wave_datatype = np.uint16,
-                 overwrite = False):
+                 overwrite = False, fast_write = False):
         # If .db extension is not provided, add it to the file.
         if not db_name.endswith(".db"):
             db_name = db_name + ".db"
@@ -55,8 +97,15 @@ class TraceLibrary:
             Path(db_name).unlink(missing_ok=True)
         # Create or open database.
         self.engine = db.create_engine("sqlite:///" + db_name)
+        if fast_write:
+            db.event.listen(self.engine, "connect", set_fast_write_pragmas)
         if not db_utils.database_exists(self.engine.url):
             db_utils.create_database(self.engine.url)
+            if fast_write:
+                # The page size of an existing database only changes with a
+                # VACUUM, which is cheap for the new, empty database.
+                with self.engine.connect() as connection:
+                    connection.exec_driver_sql("VACUUM")
         self.session = sessionmaker(self.engine)()
         self.metadata = db.MetaData()
         self.traces_table = db.Table(
@@ -92,18 +141,36 @@ class TraceLibrary:
 
     def flush_to_disk(self):
         """ Writes traces from memory into database.
+
+        All buffered traces are inserted with a single prepared executemany()
+        call in one transaction.
         """
         if self.trace_mem:
-            query = db.insert(self.traces_table)
-            traces = []
-            for trace in self.trace_mem:
-                tr = asdict(trace)
-                del tr["trace_id"]
-                traces.append(tr)
-            self.session.execute(query, traces)
+            rows = [(to_blob(trace.wave), to_blob(trace.plaintext),
+                     to_blob(trace.ciphertext), to_blob(trace.key),
+                     trace.x_pos, trace.y_pos) for trace in self.trace_mem]
+            self.session.connection().exec_driver_sql(INSERT_TRACE_SQL, rows)
             self.session.commit()
             self.trace_mem = []
 
+    def append_arrays(self, waves, plaintexts, ciphertexts, keys):
+        """ Writes traces given as arrays with one row per trace into the database.
+
+        Buffered traces are flushed first to keep the order of the traces. All
+        traces are inserted with a single executemany() call in one
+        transaction without creating Trace objects.
+        """
+        self.flush_to_disk()
+        waves = np.ascontiguousarray(waves, dtype=self.wave_datatype)
+        plaintexts = np.ascontiguousarray(plaintexts, dtype=np.uint8)
+        ciphertexts = np.ascontiguousarray(ciphertexts, dtype=np.uint8)
+        keys = np.ascontiguousarray(keys, dtype=np.uint8)
+        rows = [(to_blob(waves[i]), to_blob(plaintexts[i]), to_blob(ciphertexts[i]),
+                 to_blob(keys[i]), None, None) for i in range(len(waves))]
+        if rows:
+            self.session.connection().exec_driver_sql(INSERT_TRACE_SQL, rows)
+            self.session.commit()
+
     def write_to_buffer(self, trace):
         """ Write traces into memory or into storage.
 
@@ -118,6 +185,85 @@ class TraceLibrary:
         if len(self.trace_mem) >= self.trace_mem_thr:
             self.flush_to_disk()
 
+    def num_traces(self) -> int:
+        """ Number of traces in the database and in memory.
+
+        Traces are only appended, so the number of traces in the database
+        equals the largest trace ID, which SQLite looks up in the primary key
+        index without scanning the table.
+        """
+        last_id = self.session.execute(
+            db.select(db.func.max(self.traces_table.c.trace_id))).scalar()
+        return (last_id or 0) + len(self.trace_mem)
+
+    def num_samples(self) -> int:
+        """ Number of samples per wave, 0 if there are no traces.
+
+        Only the length of the first wave is queried, SQLite doesn't read the
+        content of a BLOB to determine its length.
+        """
+        item_size = np.dtype(self.wave_datatype).itemsize
+        num_bytes = self.session.execute(
+            db.select(db.func.length(self.traces_table.c.wave)).where(
+                self.traces_table.c.trace_id == 1)).scalar()
+        if num_bytes is None:
+            if not self.trace_mem:
+                return 0
+            num_bytes = len(self.trace_mem[0].wave)
+        return num_bytes // item_size
+
+    def dtype(self) -> np.dtype:
+        """ Datatype of the samples of the waves."""
+        return np.dtype(self.wave_datatype)
+
+    def select_trace_range(self, columns, start: Optional[int] = None,
+                           end: Optional[int] = None):
+        """ Build a query selecting the given columns for the traces start to end.
+
+        Only the selected columns are read from the database. start and end are interpreted like
+        a slice, i.e., the traces start, ..., end - 1 are selected and both bounds are optional.
+        """
+        query = db.select(*columns).select_from(self.traces_table)
+        # SQL ID starts at 1.
+        if start is not None:
+            query = query.where(self.traces_table.c.trace_id > start)
+        if end is not None:
+            query = query.where(self.traces_table.c.trace_id <= end)
+        return query
+
+    def iter_rows(self, columns, start: Optional[int] = None,
+                  end: Optional[int] = None, chunk_size: int = FETCH_CHUNK_SIZE):
+        """ Iterate over the given columns of the traces start to end.
+
+        Rows are fetched from the cursor with fetchmany() such that at most chunk_size rows are
+        held in memory, independent of the size of the selected range.
+
+        Yields:
+            Lists of up to chunk_size rows.
+        """
+        self.flush_to_disk()
+        query = self.select_trace_range(columns, start, end).order_by(
+            self.traces_table.c.trace_id)
+        result = self.session.execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+
+    def iter_traces(self, start: Optional[int] = None, end: Optional[int] = None,
+                    chunk_size: int = FETCH_CHUNK_SIZE):
+        """ Iterate over the traces start to end in chunks of up to chunk_size traces.
+
+        Yields:
+            Lists of Trace objects.
+        """
+        for rows in self.iter_rows(self.traces_table.columns, start, end, chunk_size):
+            yield [Trace(**row._mapping) for row in rows]
+
     def get_traces(self, start: Optional[int] = None,
                    end: Optional[int] = None):
         """ Get traces from database and stored into RAM.
@@ -131,23 +277,21 @@ class TraceLibrary:
         Returns:
             The traces from the database.
         """
-        self.flush_to_disk()
-        if (start is not None) and (end is not None):
-            # SQL ID starts at 1.
-            start = start + 1
-            query = db.select(self.traces_table).where(
-                (self.traces_table.c.trace_id >= start) &
-                (self.traces_table.c.trace_id <= end))
-        elif (start is not None):
-            # SQL ID starts at 1.
-            start = start + 1
-            query = db.select(self.traces_table).where(
-                self.traces_table.c.trace_id == start)
-        else:
-            query = db.select(self.traces_table)
+        start, end = to_slice(start, end)
+        return [trace for traces in self.iter_traces(start, end) for trace in traces]
+
+    def get_column(self, column, start: Optional[int] = None,
+                   end: Optional[int] = None):
+        """ Get a single column of the traces from start to end.
 
-        return [Trace(**trace._mapping)
-                for trace in self.session.execute(query).fetchall()]
+        In contrast to get_traces(), the other columns and in particular the wave blobs are not
+        read from the database.
+
+        Returns:
+            The list of values.
+        """
+        start, end = to_slice(start, end)
+        return [row[0] for rows in self.iter_rows([column], start, end) for row in rows]
 
     def get_waves_bytearray(self, start: Optional[int] = None,
                             end: Optional[int] = None):
@@ -156,7 +300,7 @@ class TraceLibrary:
         Returns:
             The bytearray waves from the database.
         """
-        return [trace.wave for trace in self.get_traces(start, end)]
+        return self.get_column(self.traces_table.c.wave, start, end)
 
     def get_waves(self, start: Optional[int] = None, end: Optional[int] = None):
         """ Get all waves from the database in the trace array format.
@@ -171,6 +315,17 @@ class TraceLibrary:
         else:
             return waves
 
+    def get_bytes_column(self, column, start: Optional[int] = None,
+                         end: Optional[int] = None):
+        """ Get a byte column of the traces from start to end in the int8 array format.
+        """
+        values = [(None if value is None else np.frombuffer(value, np.uint8))
+                  for value in self.get_column(column, start, end)]
+        if len(values) == 1:
+            return values[0]
+        else:
+            return values
+
     def get_plaintexts(self, start: Optional[int] = None,
                        end: Optional[int] = None):
         """ Get all plaintexts between start and end from the database in the
@@ -179,13 +334,7 @@ class TraceLibrary:
         Returns:
             The int plaintexts from the database.
         """
-        plaintexts = [(None if trace.plaintext is None else
-                      np.frombuffer(trace.plaintext, np.uint8)) for trace in
-                      self.get_traces(start, end)]
-        if len(plaintexts) == 1:
-            return plaintexts[0]
-        else:
-            return plaintexts
+        return self.get_bytes_column(self.traces_table.c.plaintext, start, end)
 
     def get_ciphertexts(self, start: Optional[int] = None,
                         end: Optional[int] = None):
@@ -194,13 +343,7 @@ class TraceLibrary:
         Returns:
             The int ciphertexts from the database.
         """
-        ciphertexts = [(None if trace.ciphertext is None else
-                       np.frombuffer(trace.ciphertext, np.uint8)) for trace in
-                       self.get_traces(start, end)]
-        if len(ciphertexts) == 1:
-            return ciphertexts[0]
-        else:
-            return ciphertexts
+        return self.get_bytes_column(self.traces_table.c.ciphertext, start, end)
 
     def get_keys(self, start: Optional[int] = None,
                  end: Optional[int] = None):
@@ -210,13 +353,99 @@ class TraceLibrary:
         Returns:
             The int keys from the database.
         """
-        keys = [(None if trace.key is None else
-                np.frombuffer(trace.key, np.uint8)) for trace in
-                self.get_traces(start, end)]
-        if len(keys) == 1:
-            return keys[0]
-        else:
-            return keys
+        return self.get_bytes_column(self.traces_table.c.key, start, end)
+
+    def iter_bytes_arrays(self, column, start: Optional[int] = None,
+                          end: Optional[int] = None, dtype = np.uint8,
+                          chunk_size: int = FETCH_CHUNK_SIZE):
+        """ Iterate over a column of the traces start to end in chunks of 2-D arrays.
+
+        Yields:
+            (num_traces, len) arrays of type dtype with up to chunk_size traces.
+        """
+        for rows in self.iter_rows([column], start, end, chunk_size):
+            data = np.frombuffer(bytearray().join(row[0] for row in rows), dtype=dtype)
+            yield data.reshape(len(rows), -1)
+
+    def get_bytes_array(self, column, start: Optional[int] = None,
+                        end: Optional[int] = None, dtype = np.uint8):
+        """ Get a column of the traces start to end as a 2-D array.
+
+        Only the selected column is fetched and the rows are copied chunk by chunk into the
+        output array without creating intermediate objects per trace.
+
+        Returns:
+            A (num_traces, len) array of type dtype.
+        """
+        self.flush_to_disk()
+        num_traces = self.session.execute(
+            self.select_trace_range([db.func.count()], start, end)).scalar()
+        array = None
+        i_trace = 0
+        for chunk in self.iter_bytes_arrays(column, start, end, dtype):
+            if array is None:
+                array = np.empty((num_traces, chunk.shape[1]), dtype=dtype)
+            array[i_trace:i_trace + len(chunk)] = chunk
+            i_trace += len(chunk)
+        if array is None:
+            return np.empty((0, 0), dtype=dtype)
+        return array
+
+    def wave_column(self, sample_start: int = 0, num_samples: Optional[int] = None):
+        """ Get the wave column restricted to the samples sample_start to
+        sample_start + num_samples.
+        """
+        wave = self.traces_table.c.wave
+        if sample_start != 0 or num_samples is not None:
+            # For BLOBs, SQLite's substr() operates on bytes and starts at 1.
+            item_size = np.dtype(self.wave_datatype).itemsize
+            if num_samples is None:
+                wave = db.func.substr(wave, sample_start * item_size + 1)
+            else:
+                wave = db.func.substr(wave, sample_start * item_size + 1,
+                                      num_samples * item_size)
+        return wave
+
+    def get_waves_array(self, start: Optional[int] = None, end: Optional[int] = None,
+                        sample_start: int = 0, num_samples: Optional[int] = None):
+        """ Get the waves start to end from the database as a 2-D array.
+
+        Only the samples sample_start to sample_start + num_samples are read from the database.
+
+        Returns:
+            A (num_traces, num_samples) array of type wave_datatype.
+        """
+        return self.get_bytes_array(self.wave_column(sample_start, num_samples), start, end,
+                                    self.wave_datatype)
+
+    def iter_waves_arrays(self, start: Optional[int] = None, end: Optional[int] = None,
+                          sample_start: int = 0, num_samples: Optional[int] = None,
+                          chunk_size: int = FETCH_CHUNK_SIZE):
+        """ Iterate over the waves start to end in chunks of up to chunk_size waves.
+
+        Yields:
+            (num_traces, num_samples) arrays of type wave_datatype.
+        """
+        yield from self.iter_bytes_arrays(self.wave_column(sample_start, num_samples), start,
+                                          end, self.wave_datatype, chunk_size)
+
+    def get_plaintexts_array(self, start: Optional[int] = None,
+                             end: Optional[int] = None):
+        """ Get the plaintexts start to end from the database as a 2-D uint8 array.
+        """
+        return self.get_bytes_array(self.traces_table.c.plaintext, start, end)
+
+    def get_ciphertexts_array(self, start: Optional[int] = None,
+                              end: Optional[int] = None):
+        """ Get the ciphertexts start to end from the database as a 2-D uint8 array.
+        """
+        return self.get_bytes_array(self.traces_table.c.ciphertext, start, end)
+
+    def get_keys_array(self, start: Optional[int] = None,
+                       end: Optional[int] = None):
+        """ Get the keys start to end from the database as a 2-D uint8 array.
+        """
+        return self.get_bytes_array(self.traces_table.c.key, start, end)
 
     def write_metadata(self, metadata):
         """ Write metadata into database.
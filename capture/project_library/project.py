@@ -12,9 +12,24 @@ import chipwhisperer as cw
 import numpy as np
 
 sys.path.append("../")
+from capture.project_library.ot_memmap_library.memmap_library import \
+    MemmapLibrary  # noqa: E402
 from capture.project_library.ot_trace_library.trace_library import (  # noqa: E402
     Trace, TraceLibrary)
 
+# Project types backed by the trace libraries in this directory, which share the same interface.
+LIBRARY_TYPES = ("ot_trace_library", "ot_memmap_library")
+
+
+def to_byte_array(entries) -> np.ndarray:
+    """ Convert a list of byte strings, byte arrays or numpy arrays to a (n, len) uint8 array.
+    """
+    entries = np.asarray(entries)
+    if entries.dtype != object and entries.ndim == 2:
+        return entries.astype(np.uint8, copy=False)
+    data = b"".join(np.asarray(entry, dtype=np.uint8).tobytes() for entry in entries)
+    return np.frombuffer(data, dtype=np.uint8).reshape(len(entries), -1)
+
 
 @dataclass
 class ProjectConfig:
@@ -26,6 +41,23 @@ class ProjectConfig:
     wave_dtype: np.dtype
     overwrite: bool
     trace_threshold: Optional[int] = 1
+    # Use large pages and relaxed syncing for ot_trace_library projects.
+    fast_write: Optional[bool] = False
+
+
+def get_project_type(path, default: str = "cw") -> str:
+    """ Guess the project type from the file name of the project.
+
+    Returns default if the file name has none of the known extensions.
+    """
+    path = str(path)
+    if path.rstrip("/").endswith(".mmap"):
+        return "ot_memmap_library"
+    elif ".db" in path:
+        return "ot_trace_library"
+    elif ".cwp" in path:
+        return "cw"
+    return default
 
 
 class SCAProject:
@@ -47,12 +79,20 @@ class SCAProject:
                                              overwrite=self.project_cfg.overwrite)
         elif self.project_cfg.type == "ot_trace_library":
             self.project = TraceLibrary(
+                str(self.project_cfg.path),
+                trace_threshold=self.project_cfg.trace_threshold,
+                wave_datatype=self.project_cfg.wave_dtype,
+                overwrite=self.project_cfg.overwrite,
+                fast_write=self.project_cfg.fast_write)
+        elif self.project_cfg.type == "ot_memmap_library":
+            self.project = MemmapLibrary(
                 str(self.project_cfg.path),
                 trace_threshold=self.project_cfg.trace_threshold,
                 wave_datatype=self.project_cfg.wave_dtype,
                 overwrite=self.project_cfg.overwrite)
         else:
-            raise RuntimeError("Only trace_db='cw' or trace_db='ot_trace_library' supported.")
+            raise RuntimeError("Only trace_db='cw', trace_db='ot_trace_library' or "
+                               "trace_db='ot_memmap_library' supported.")
 
     def open_project(self) -> None:
         """ Open project.
@@ -61,6 +101,13 @@ class SCAProject:
             self.project = cw.open_project(self.project_cfg.path)
         elif self.project_cfg.type == "ot_trace_library":
             self.project = TraceLibrary(
+                str(self.project_cfg.path),
+                trace_threshold=self.project_cfg.trace_threshold,
+                wave_datatype=self.project_cfg.wave_dtype,
+                overwrite=self.project_cfg.overwrite,
+                fast_write=self.project_cfg.fast_write)
+        elif self.project_cfg.type == "ot_memmap_library":
+            self.project = MemmapLibrary(
                 str(self.project_cfg.path),
                 trace_threshold=self.project_cfg.trace_threshold,
                 wave_datatype=self.project_cfg.wave_dtype,
@@ -71,7 +118,7 @@ class SCAProject:
         """
         if self.project_cfg.type == "cw":
             self.project.close(save = save)
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             self.project.close(save = save)
 
         self.project = None
@@ -81,7 +128,7 @@ class SCAProject:
         """
         if self.project_cfg.type == "cw":
             self.project.save()
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             self.project.flush_to_disk()
 
     def append_trace(self, wave, plaintext, ciphertext, key) -> None:
@@ -96,6 +143,57 @@ class SCAProject:
                           ciphertext=ciphertext,
                           key=key)
             self.project.write_to_buffer(trace)
+        elif self.project_cfg.type == "ot_memmap_library":
+            # The memmap library stores the arrays directly.
+            self.project.write_to_buffer(Trace(wave=wave, plaintext=plaintext,
+                                               ciphertext=ciphertext, key=key))
+
+    def append_traces(self, waves, plaintexts, ciphertexts, keys) -> None:
+        """ Append a batch of traces given as arrays with one row per trace.
+
+        The trace libraries write the batch in bulk, bypassing the trace buffer.
+        """
+        if self.project_cfg.type == "cw":
+            for i in range(len(waves)):
+                self.append_trace(waves[i], plaintexts[i], ciphertexts[i], keys[i])
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            self.project.append_arrays(waves, plaintexts, ciphertexts, keys)
+
+    def num_traces(self) -> int:
+        """ Get the number of traces in the project without reading the traces.
+        """
+        if self.project_cfg.type == "cw":
+            return self.project.traces.tm.num_traces()
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.num_traces()
+
+    def num_samples(self) -> int:
+        """ Get the number of samples per trace without reading the traces.
+        """
+        if self.project_cfg.type == "cw":
+            # The number of points is stored in the headers of the trace segments.
+            num_points = self.project.traces.tm.num_points()
+            if num_points == 0 and self.num_traces() > 0:
+                # Segments that were not saved yet have no header.
+                num_points = len(self.project.waves[0])
+            return num_points
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.num_samples()
+
+    def dtype(self) -> np.dtype:
+        """ Get the datatype of the traces in the project.
+        """
+        if self.project_cfg.type == "cw":
+            for segment in self.project.traces.tm.traceSegments:
+                if segment.mappedRange is None or segment.numTraces() == 0:
+                    continue
+                if not segment.isLoaded() and segment.traces is None:
+                    # Only maps the traces into memory.
+                    segment.loadAllTraces(None, None)
+                return segment.traces.dtype
+            return np.dtype(self.project_cfg.wave_dtype)
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.dtype()
 
     def get_waves(self, start: Optional[int] = None, end: Optional[int] = None):
         """ Get waves from project.
@@ -107,7 +205,7 @@ class SCAProject:
                 return self.project.waves[start]
             else:
                 return self.project.waves
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             return self.project.get_waves(start, end)
 
     def get_keys(self, start: Optional[int] = None, end: Optional[int] = None):
@@ -120,7 +218,7 @@ class SCAProject:
                 return self.project.keys[start]
             else:
                 return self.project.keys
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             return self.project.get_keys(start, end)
 
     def get_plaintexts(self, start: Optional[int] = None, end: Optional[int] = None):
@@ -133,7 +231,7 @@ class SCAProject:
                 return self.project.textins[start]
             else:
                 return self.project.textins
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             return self.project.get_plaintexts(start, end)
 
     def get_ciphertexts(self, start: Optional[int] = None, end: Optional[int] = None):
@@ -146,15 +244,93 @@ class SCAProject:
                 return self.project.textouts[start]
             else:
                 return self.project.textouts
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             return self.project.get_ciphertexts(start, end)
 
+    def get_waves_array(self, start: Optional[int] = None, end: Optional[int] = None,
+                        sample_start: int = 0,
+                        num_samples: Optional[int] = None) -> np.ndarray:
+        """ Get waves[start:end, sample_start:sample_start + num_samples] from project.
+
+        In contrast to get_waves(), a (num_traces, num_samples) array is returned and only the
+        selected samples are read from the trace storage. If num_samples is None, all samples
+        starting at sample_start are returned. For ot_memmap_library projects, the array is a
+        read-only view of the memory-mapped waves, all other types return a dense copy.
+        """
+        if self.project_cfg.type == "cw":
+            return self._get_cw_array("traces", start, end, sample_start, num_samples)
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.get_waves_array(start, end, sample_start, num_samples)
+
+    def get_keys_array(self, start: Optional[int] = None,
+                       end: Optional[int] = None) -> np.ndarray:
+        """ Get keys[start:end] from project as a (num_traces, key_len) uint8 array.
+        """
+        if self.project_cfg.type == "cw":
+            return self._get_cw_array("keylist", start, end)
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.get_keys_array(start, end)
+
+    def get_plaintexts_array(self, start: Optional[int] = None,
+                             end: Optional[int] = None) -> np.ndarray:
+        """ Get plaintexts[start:end] from project as a (num_traces, len) uint8 array.
+        """
+        if self.project_cfg.type == "cw":
+            return self._get_cw_array("textins", start, end)
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.get_plaintexts_array(start, end)
+
+    def get_ciphertexts_array(self, start: Optional[int] = None,
+                              end: Optional[int] = None) -> np.ndarray:
+        """ Get ciphertexts[start:end] from project as a (num_traces, len) uint8 array.
+        """
+        if self.project_cfg.type == "cw":
+            return self._get_cw_array("textouts", start, end)
+        elif self.project_cfg.type in LIBRARY_TYPES:
+            return self.project.get_ciphertexts_array(start, end)
+
+    def _get_cw_array(self, attribute, start, end, sample_start=0, num_samples=None):
+        """ Copy a range of traces or data from the CW trace segments into a dense array.
+
+        The ChipWhisperer API returns traces one by one. Instead, the requested slices are copied
+        directly from the memory-mapped arrays of the trace segments.
+        """
+        tm = self.project.traces.tm
+        start = 0 if start is None else start
+        end = tm.num_traces() if end is None else min(end, tm.num_traces())
+        sample_end = None if num_samples is None else sample_start + num_samples
+        chunks = []
+        for segment in tm.traceSegments:
+            if segment.mappedRange is None:
+                continue
+            first, last = segment.mappedRange
+            seg_start = max(start, first) - first
+            seg_end = min(end, last + 1) - first
+            if seg_start >= seg_end:
+                continue
+            if not segment.isLoaded() and segment.traces is None:
+                segment.loadAllTraces(None, None)
+            if attribute == "traces":
+                chunks.append(segment.traces[seg_start:seg_end, sample_start:sample_end])
+            elif attribute == "keylist" and segment.keylist is None:
+                # Segments without a key list only store the fixed key.
+                chunks.append(np.tile(to_byte_array([segment.knownkey]), (seg_end - seg_start, 1)))
+            else:
+                chunks.append(to_byte_array(getattr(segment, attribute)[seg_start:seg_end]))
+        if not chunks:
+            if attribute == "traces":
+                num_points = len(range(tm.num_points())[sample_start:sample_end])
+                return np.empty((0, num_points), dtype=self.project_cfg.wave_dtype)
+            return np.empty((0, 0), dtype=np.uint8)
+        # Always copy, the segment arrays are memory-mapped files.
+        return np.concatenate(chunks)
+
     def write_metadata(self, metadata: dict) -> None:
         """ Write metadata to project.
         """
         if self.project_cfg.type == "cw":
             self.project.settingsDict.update(metadata)
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             self.project.write_metadata(metadata)
 
     def get_metadata(self) -> dict:
@@ -162,7 +338,7 @@ class SCAProject:
         """
         if self.project_cfg.type == "cw":
             return self.project.settingsDict
-        elif self.project_cfg.type == "ot_trace_library":
+        elif self.project_cfg.type in LIBRARY_TYPES:
             return self.project.get_metadata()
 
     def optimize_capture(self, num_segments_storage):
@@ -0,0 +1,98 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.ceca_stats import (compute_pairwise_diffs_and_scores, compute_stats,
+                             count_and_sum_text_traces, merge_stats,
+                             walsh_hadamard_transform)
+
+
+def count_and_sum_text_traces_reference(texts, traces):
+    """Count and sum the traces with one boolean mask per text byte and value."""
+    cnts = np.zeros((16, 256, 1))
+    sums = np.zeros((16, 256, traces.shape[1]))
+    for byte_pos in range(16):
+        for byte_val in range(256):
+            mask = texts[:, byte_pos] == byte_val
+            cnts[byte_pos, byte_val] = mask.sum()
+            sums[byte_pos, byte_val] = traces[mask].sum(axis=0)
+    return cnts, sums
+
+
+def test_count_and_sum_text_traces():
+    rng = np.random.default_rng(0)
+    texts = rng.integers(0, 256, (1000, 16), dtype=np.uint8)
+    # Leave some byte values unused.
+    texts[:, 3] &= 0x0f
+    traces = rng.integers(0, 4096, (1000, 20), dtype=np.uint16)
+    expected_cnts, expected_sums = count_and_sum_text_traces_reference(texts, traces)
+
+    cnts, sums = count_and_sum_text_traces(texts, traces)
+    assert cnts.shape == (16, 256, 1)
+    assert sums.shape == (16, 256, 20)
+    assert np.array_equal(cnts, expected_cnts)
+    assert np.array_equal(sums, expected_sums)
+
+    # Chunks within a call and across calls must give the same result.
+    cnts, sums = count_and_sum_text_traces(texts[:300], traces[:300], chunk_size=64)
+    count_and_sum_text_traces(texts[300:], traces[300:], cnts, sums, chunk_size=128)
+    assert np.array_equal(cnts, expected_cnts)
+    assert np.array_equal(sums, expected_sums)
+
+
+def test_merge_stats():
+    rng = np.random.default_rng(0)
+    traces = rng.integers(0, 4096, (1000, 20), dtype=np.uint16)
+
+    # Merge chunks of different sizes, including an empty one.
+    stats = (0, None, None)
+    for start, stop in [(0, 10), (10, 10), (10, 400), (400, 1000)]:
+        stats = merge_stats(stats, compute_stats(traces[start:stop]))
+    cnt, sum_, sum_dev_prods = stats
+    assert cnt == 1000
+    assert np.array_equal(sum_, traces.sum(axis=0))
+    assert np.allclose(sum_dev_prods / cnt, traces.var(axis=0))
+
+
+def pairwise_diffs_and_scores_reference(mean_traces):
+    """Correlate the mean traces of every pair of text bytes with np.corrcoef()."""
+    pairwise_diffs_scores = np.zeros((16, 16, 2))
+    alphas = np.arange(256)
+    betas = alphas ^ np.arange(256)[:, np.newaxis]
+    for a in range(16):
+        for b in range(a + 1, 16):
+            corrcoefs = np.corrcoef(mean_traces[a], mean_traces[b])
+            diff_corrcoefs = corrcoefs[alphas, 256 + betas].sum(axis=1)
+            best_diff = diff_corrcoefs.argmax()
+            pairwise_diffs_scores[(a, b), (b, a)] = (
+                best_diff,
+                diff_corrcoefs[best_diff] / diff_corrcoefs.mean(),
+            )
+    return pairwise_diffs_scores
+
+
+def test_walsh_hadamard_transform():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(3, 8, 5))
+    # Sylvester construction of the Hadamard matrix.
+    hadamard = np.array([[1.0]])
+    while len(hadamard) < 8:
+        hadamard = np.block([[hadamard, hadamard], [hadamard, -hadamard]])
+    assert np.allclose(walsh_hadamard_transform(values), np.matmul(hadamard, values))
+
+
+def test_compute_pairwise_diffs_and_scores():
+    rng = np.random.default_rng(0)
+    key = rng.integers(0, 256, 16)
+    # The mean traces of all text bytes leak the same signal for text ^ key.
+    signal = rng.normal(size=(256, 300))
+    mean_traces = 0.3 * signal[np.arange(256) ^ key[:, np.newaxis]]
+    mean_traces += rng.normal(size=mean_traces.shape)
+    expected = pairwise_diffs_and_scores_reference(mean_traces)
+
+    pairwise_diffs_scores = compute_pairwise_diffs_and_scores(mean_traces)
+    assert np.array_equal(pairwise_diffs_scores[:, :, 0], expected[:, :, 0])
+    assert np.allclose(pairwise_diffs_scores[:, :, 1], expected[:, :, 1])
+    assert np.array_equal(pairwise_diffs_scores[:, :, 0], key ^ key[:, np.newaxis])
@@ -0,0 +1,176 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import itertools
+
+import numpy as np
+import pytest
+
+from util.leakage_models import aes_key_schedule, compute_aes_states
+
+from .project_test import create_test_project
+
+# The attack encrypts with scared, which is an optional dependency.
+pytest.importorskip("scared")
+from analysis import ceca  # noqa : E402
+
+
+def create_worker_args(project_file, worker_traces, chunk_size=None):
+    """Create the arguments of workers processing consecutive slices of traces."""
+    bounds = list(itertools.accumulate([0] + worker_traces))
+    return [(project_file, slice(start, stop), slice(2, 18), ceca.AttackDirection.INPUT,
+             chunk_size) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def run_workers(backend, worker_args):
+    """Run the distributed steps of the attack and return their results."""
+    workers = ceca.WORKER_BACKENDS[backend](worker_args)
+    mean, std = ceca.compute_mean_and_std(workers)
+    num_traces = ceca.filter_noisy_traces(workers, mean, std, 1.7)
+    mean_text_traces = ceca.compute_mean_text_traces(workers)
+    workers.close()
+    return mean, std, num_traces, mean_text_traces
+
+
+@pytest.mark.parametrize("chunk_size", [None, 4])
+def test_worker_backends(tmp_path, chunk_size):
+    project_file = str(tmp_path / "project.db")
+    create_test_project(project_file, "ot_trace_library", 61, 20)
+    worker_args = create_worker_args(project_file, [21, 20, 20], chunk_size)
+    mean, std, num_traces, mean_text_traces = run_workers("local", worker_args)
+    # Some but not all traces are filtered.
+    assert 0 < num_traces < 61
+    mean_p, std_p, num_traces_p, mean_text_traces_p = run_workers("process", worker_args)
+    assert np.allclose(mean_p, mean)
+    assert np.allclose(std_p, std)
+    assert num_traces_p == num_traces
+    assert np.allclose(mean_text_traces_p, mean_text_traces, equal_nan=True)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 20, 100])
+def test_streaming_worker(tmp_path, chunk_size):
+    project_file = str(tmp_path / "project.db")
+    create_test_project(project_file, "ot_trace_library", 61, 20)
+    worker_args = create_worker_args(project_file, [13, 48])[1]
+    worker = ceca.TraceWorker(*worker_args)
+    streaming_worker = ceca.TraceWorker(*worker_args[:-1], chunk_size)
+    assert streaming_worker.traces is None
+    cnt, sum_, sum_dev_prods = worker.compute_stats()
+    streaming_cnt, streaming_sum, streaming_sum_dev_prods = streaming_worker.compute_stats()
+    assert streaming_cnt == cnt == 48
+    assert np.allclose(streaming_sum, sum_)
+    assert np.allclose(streaming_sum_dev_prods, sum_dev_prods)
+    mean = sum_ / cnt
+    std = np.sqrt(sum_dev_prods / cnt)
+    num_traces = worker.filter_noisy_traces(mean - 1.7 * std, mean + 1.7 * std)
+    assert 0 < num_traces < 48
+    assert streaming_worker.filter_noisy_traces(mean - 1.7 * std, mean + 1.7 * std) == num_traces
+    assert np.array_equal(streaming_worker.traces_to_use, worker.traces_to_use)
+    cnts, sums = worker.count_and_sum_text_traces()
+    streaming_cnts, streaming_sums = streaming_worker.count_and_sum_text_traces()
+    assert np.array_equal(streaming_cnts, cnts)
+    assert np.allclose(streaming_sums, sums)
+
+
+def create_diff_corrcoefs(rng, key):
+    """Create correlation coefficients of differences where the differences of key are best."""
+    diff_corrcoefs = rng.uniform(0, 0.5, (16, 16, 256))
+    diff_corrcoefs = (diff_corrcoefs + diff_corrcoefs.transpose(1, 0, 2)) / 2
+    for a in range(16):
+        for b in range(16):
+            diff_corrcoefs[a, b, key[a] ^ key[b]] = rng.uniform(0.8, 0.9)
+    return diff_corrcoefs
+
+
+def compute_deficits(diff_corrcoefs, paths, candidates):
+    """Compute the z-score deficits of candidates w.r.t. the best differences."""
+    deficits = np.zeros(len(candidates))
+    for byte in range(1, 16):
+        corrcoefs = diff_corrcoefs[paths[byte][-2], byte]
+        zscores = (corrcoefs - corrcoefs.mean()) / corrcoefs.std()
+        edge_diffs = candidates[:, paths[byte][-2]] ^ candidates[:, byte]
+        deficits += zscores.max() - zscores[edge_diffs]
+    return deficits
+
+
+def test_enumerate_diffs():
+    rng = np.random.default_rng(0)
+    key = rng.integers(0, 256, 16, dtype=np.uint8)
+    diff_corrcoefs = create_diff_corrcoefs(rng, key)
+    pairwise_diffs_scores = ceca.ceca_stats.find_pairwise_diffs_and_scores(diff_corrcoefs)
+    paths = ceca.find_best_paths(pairwise_diffs_scores)
+    candidates = np.array(list(itertools.islice(ceca.enumerate_diffs(diff_corrcoefs, paths),
+                                                5000)))
+    assert np.array_equal(candidates[0], ceca.find_best_diffs(pairwise_diffs_scores))
+    assert np.array_equal(candidates[0], key[0] ^ key)
+    assert np.all(candidates[:, 0] == 0)
+    assert len(np.unique(candidates, axis=0)) == len(candidates)
+    deficits = compute_deficits(diff_corrcoefs, paths, candidates)
+    assert deficits[0] == 0
+    assert np.all(np.diff(deficits) >= -1e-9)
+    # Trimming the queue doesn't change the enumerated candidates.
+    for max_candidates in [1, 100, 5000]:
+        assert np.array_equal(list(ceca.enumerate_diffs(diff_corrcoefs, paths, max_candidates)),
+                              candidates[:max_candidates])
+
+
+@pytest.mark.parametrize("attack_direction", list(ceca.AttackDirection))
+def test_enumerate_keys(attack_direction):
+    rng = np.random.default_rng(1)
+    key = rng.integers(0, 256, 16, dtype=np.uint8)
+    plaintext = rng.integers(0, 256, 16, dtype=np.uint8)
+    ciphertext = compute_aes_states(key, plaintext)[11, 0]
+    if attack_direction == ceca.AttackDirection.OUTPUT:
+        attacked_key = aes_key_schedule(key[np.newaxis])[10, 0]
+    else:
+        attacked_key = key
+    diff_corrcoefs = create_diff_corrcoefs(rng, attacked_key)
+    paths = ceca.find_best_paths(ceca.ceca_stats.find_pairwise_diffs_and_scores(diff_corrcoefs))
+    found_key, rank = ceca.enumerate_keys(diff_corrcoefs, paths, attack_direction, plaintext,
+                                          ciphertext, 2**8)
+    assert np.array_equal(found_key, key)
+    assert rank == attacked_key[0] + 1
+    # Make a wrong difference best on the edge of key byte 5, keeping the maximum and the mean
+    # and thus the confidence scores and the paths. With the smallest deficit, the second
+    # candidate gives the key.
+    a = paths[5][-2]
+    corrcoefs = diff_corrcoefs[a, 5]
+    true_diff = attacked_key[a] ^ attacked_key[5]
+    wrong_diff, other_diff = true_diff ^ 1, true_diff ^ 2
+    corrcoefs[other_diff] += corrcoefs[wrong_diff] - corrcoefs[true_diff] + 1e-3
+    corrcoefs[wrong_diff] = corrcoefs[true_diff]
+    corrcoefs[true_diff] -= 1e-3
+    diff_corrcoefs[5, a] = corrcoefs
+    assert ceca.find_best_paths(
+        ceca.ceca_stats.find_pairwise_diffs_and_scores(diff_corrcoefs)) == paths
+    assert ceca.enumerate_keys(diff_corrcoefs, paths, attack_direction, plaintext, ciphertext,
+                               2**8) == (None, 2**8)
+    found_key, rank = ceca.enumerate_keys(diff_corrcoefs, paths, attack_direction, plaintext,
+                                          ciphertext, 2**16)
+    assert np.array_equal(found_key, key)
+    assert rank == 256 + attacked_key[0] + 1
+
+
+@pytest.mark.parametrize("attack_direction", list(ceca.AttackDirection))
+def test_recover_key(attack_direction):
+    rng = np.random.default_rng(2)
+    key = rng.integers(0, 256, 16, dtype=np.uint8)
+    plaintext = rng.integers(0, 256, 16, dtype=np.uint8)
+    ciphertext = compute_aes_states(key, plaintext)[11, 0]
+    if attack_direction == ceca.AttackDirection.OUTPUT:
+        attacked_key = aes_key_schedule(key[np.newaxis])[10, 0]
+    else:
+        attacked_key = key
+    diffs = attacked_key[0] ^ attacked_key
+    found_key, rank = ceca.recover_key(diffs, attack_direction, plaintext, ciphertext)
+    assert np.array_equal(found_key, key)
+    assert rank == attacked_key[0] + 1
+    # Candidates tested in a batch, the correct one is the second.
+    batch = np.stack([diffs ^ 3, diffs, diffs ^ 5])
+    batch[:, 0] = 0
+    found_key, rank = ceca.recover_key(batch, attack_direction, plaintext, ciphertext)
+    assert np.array_equal(found_key, key)
+    assert rank == 256 + attacked_key[0] + 1
+    assert ceca.recover_key(batch[[0, 2]], attack_direction, plaintext, ciphertext) == (None,
+                                                                                        None)
@@ -0,0 +1,68 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.cpa_stats import (CpaAccumulator, compute_key_ranks,
+                            last_round_hd_model, sbox_output_hw_model)
+from util.leakage_models import (AES_SBOX, AES_SHIFT_ROWS, HW_LUT,
+                                 aes_key_schedule, compute_aes_states)
+
+
+def correlations_reference(model, texts, traces):
+    """Correlate the traces with the leakage of every guess computed one guess at a time."""
+    weights = model.weights(texts)
+    corr = np.zeros((16, 256, traces.shape[1]))
+    for byte in range(16):
+        for guess in range(256):
+            leakage = (model.coefs[:, guess, texts[:, byte]].T * weights[:, byte]).sum(axis=1)
+            for sample in range(traces.shape[1]):
+                corr[byte, guess, sample] = np.corrcoef(leakage, traces[:, sample])[0, 1]
+    return corr
+
+
+def test_leakage_models():
+    rng = np.random.default_rng(0)
+    key = rng.integers(0, 256, 16, dtype=np.uint8)
+    plaintexts = rng.integers(0, 256, (50, 16), dtype=np.uint8)
+    states = compute_aes_states(np.tile(key, (50, 1)), plaintexts)
+    last_round_key = aes_key_schedule(key[np.newaxis])[10, 0]
+    # Hamming weight of SubBytes of the first round and Hamming distance of the state register
+    # in the last round, where byte j is shifted to AES_SHIFT_ROWS[j].
+    for model, round_key, texts, expected in [
+            (sbox_output_hw_model(), key, plaintexts, HW_LUT[AES_SBOX[states[1]]]),
+            (last_round_hd_model(), last_round_key, states[11],
+             HW_LUT[states[11] ^ states[10]][:, AES_SHIFT_ROWS])]:
+        weights = model.weights(texts)
+        for byte in range(16):
+            leakage = (model.coefs[:, round_key[byte], texts[:, byte]].T *
+                       weights[:, byte]).sum(axis=1)
+            assert np.array_equal(leakage, expected[:, byte])
+
+
+def test_cpa_accumulator():
+    rng = np.random.default_rng(1)
+    texts = rng.integers(0, 256, (300, 16), dtype=np.uint8)
+    traces = rng.normal(0, 1, (300, 4))
+    for model in [sbox_output_hw_model(), last_round_hd_model()]:
+        accumulator = CpaAccumulator(model, 4)
+        for start in range(0, 300, 70):
+            accumulator.update(texts[start:start + 70], traces[start:start + 70])
+        assert accumulator.num_traces == 300
+        assert np.allclose(accumulator.compute_correlations(),
+                           correlations_reference(model, texts, traces))
+
+
+def test_compute_key_ranks():
+    rng = np.random.default_rng(2)
+    key = rng.integers(0, 256, 16, dtype=np.uint8)
+    plaintexts = rng.integers(0, 256, (2000, 16), dtype=np.uint8)
+    states = compute_aes_states(np.tile(key, (2000, 1)), plaintexts)
+    traces = rng.normal(0, 2, (2000, 24))
+    traces[:, 4:20] += HW_LUT[AES_SBOX[states[1]]]
+    accumulator = CpaAccumulator(sbox_output_hw_model(), 24)
+    accumulator.update(plaintexts, traces)
+    ranks, guesses = compute_key_ranks(accumulator.compute_correlations(), key)
+    assert np.all(ranks == 0)
+    assert np.array_equal(guesses, key)
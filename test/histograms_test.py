@@ -0,0 +1,51 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.histograms import compute_histograms
+
+
+def histograms_reference(trace_resolution, traces, groups):
+    """Build the histograms with one np.histogram2d() call per round, data item and sample."""
+    num_rnds, num_data, _ = groups.shape
+    num_samples = traces.shape[1]
+    histograms = np.zeros((num_rnds, num_data, 2, num_samples, trace_resolution),
+                          dtype=np.uint32)
+    for i_rnd in range(num_rnds):
+        for i_data in range(num_data):
+            for i_sample in range(num_samples):
+                histograms[i_rnd, i_data, :, i_sample, :] = np.histogram2d(
+                    groups[i_rnd, i_data], traces[:, i_sample],
+                    bins=[range(3), range(trace_resolution + 1)])[0]
+    return histograms
+
+
+def test_compute_histograms_matches_histogram2d():
+    rng = np.random.default_rng(0)
+    trace_resolution = 64
+    traces = rng.integers(0, trace_resolution, (500, 20), dtype=np.uint16)
+    # Values on the right edge are counted in the last bin, values outside are dropped.
+    traces[0, 0] = trace_resolution
+    traces[1, 1] = trace_resolution + 10
+    groups = rng.integers(0, 2, (2, 3, 500), dtype=np.uint8)
+    expected = histograms_reference(trace_resolution, traces, groups)
+    # Use a small chunk size to test the accumulation over multiple chunks.
+    received = compute_histograms(trace_resolution, traces, groups, chunk_size=64)
+    assert np.array_equal(expected, received)
+
+
+def test_compute_histograms_float_traces():
+    rng = np.random.default_rng(1)
+    trace_resolution = 10
+    groups = rng.integers(0, 2, (1, 2, 50), dtype=np.uint8)
+    traces = rng.uniform(0, trace_resolution, (50, 3))
+    assert np.array_equal(compute_histograms(trace_resolution, traces, groups),
+                          histograms_reference(trace_resolution, traces, groups))
+    # The right edge is counted in the last bin, values above it and below zero are dropped.
+    traces[0, 0] = trace_resolution
+    traces[1, 1] = trace_resolution + 0.5
+    traces[2, 2] = -0.5
+    assert np.array_equal(compute_histograms(trace_resolution, traces, groups, chunk_size=16),
+                          histograms_reference(trace_resolution, traces, groups))
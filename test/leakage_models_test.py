@@ -0,0 +1,82 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+from chipwhisperer.analyzer import aes_funcs
+
+from util.leakage_models import (aes_inverse_key_schedule, aes_key_schedule,
+                                 byte2bits, compute_aes_states,
+                                 compute_leakage_aes_bit,
+                                 compute_leakage_aes_byte,
+                                 compute_leakage_general, find_fixed_entry)
+
+
+def aes_states_reference(key, plaintext):
+    """Compute the state after each AES round with one chipwhisperer call per operation."""
+    states = [list(plaintext)]
+    state = [p ^ k for p, k in zip(plaintext, key)]
+    states.append(state)
+    for j in range(1, 11):
+        state = aes_funcs.shiftrows(aes_funcs.subbytes(list(state)))
+        if j < 10:
+            state = aes_funcs.mixcolumns(state)
+        state = [s ^ k for s, k in zip(state, aes_funcs.key_schedule_rounds(list(key), 0, j))]
+        states.append(state)
+    return np.array(states, dtype=np.uint8)
+
+
+def test_compute_aes_states_fips197():
+    # Example vector from FIPS-197, Appendix C.1.
+    key = np.arange(16, dtype=np.uint8)
+    plaintext = np.array([0x11 * i for i in range(16)], dtype=np.uint8)
+    ciphertext = bytes.fromhex("69c4e0d86a7b0430d8cdb78070b4c55a")
+    states = compute_aes_states(key[np.newaxis], plaintext[np.newaxis])
+    assert bytes(states[11, 0]) == ciphertext
+
+
+def test_aes_inverse_key_schedule():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 256, (20, 16), dtype=np.uint8)
+    last_round_keys = aes_key_schedule(keys)[10]
+    assert np.array_equal(last_round_keys[0],
+                          aes_funcs.key_schedule_rounds(list(keys[0]), 0, 10))
+    assert np.array_equal(aes_inverse_key_schedule(last_round_keys), keys)
+
+
+def test_compute_leakage_aes_matches_reference():
+    rng = np.random.default_rng(0)
+    num_traces = 20
+    plaintexts = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    random_keys = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    fixed_keys = np.tile(random_keys[0], (num_traces, 1))
+    for keys in [fixed_keys, random_keys]:
+        states = np.stack([aes_states_reference(keys[i], plaintexts[i])
+                           for i in range(num_traces)], axis=2)
+        for leakage_model in ['HAMMING_WEIGHT', 'HAMMING_DISTANCE']:
+            values = states[1:]
+            if leakage_model == 'HAMMING_DISTANCE':
+                values = values ^ states[:-1]
+            expected_byte = np.vectorize(lambda x: bin(x).count("1"))(values).astype(np.uint8)
+            expected_bit = np.array([[np.concatenate([byte2bits(b) for b in values[j, :, i]])
+                                      for i in range(num_traces)] for j in range(11)])
+            assert np.array_equal(compute_leakage_aes_byte(keys, plaintexts, leakage_model),
+                                  expected_byte)
+            assert np.array_equal(compute_leakage_aes_bit(keys, plaintexts, leakage_model),
+                                  expected_bit.transpose(0, 2, 1))
+
+
+def test_find_fixed_entry_and_compute_leakage_general():
+    rng = np.random.default_rng(0)
+    # Odd entry lengths, e.g., for OTBN keys, are supported as well.
+    for entry_len in [5, 16, 32]:
+        dataset = rng.integers(0, 256, (100, entry_len), dtype=np.uint8)
+        fixed_entry = dataset[3].copy()
+        dataset[[3, 10, 50]] = fixed_entry
+        # The first entry that repeats is the fixed entry.
+        assert np.array_equal(find_fixed_entry(dataset[0:20]), fixed_entry)
+        dataset[1] = dataset[90]
+        assert np.array_equal(find_fixed_entry(dataset), dataset[90])
+        expected = [int(np.array_equal(entry, fixed_entry)) for entry in dataset]
+        assert np.array_equal(compute_leakage_general(dataset, fixed_entry), expected)
+        assert np.array_equal(compute_leakage_general(list(dataset), fixed_entry), expected)
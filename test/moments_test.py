@@ -0,0 +1,40 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.histograms import compute_histograms
+from util.moments import MomentAccumulator
+from util.ttest import ttest_hist_xy
+
+
+def test_moments_match_histograms():
+    rng = np.random.default_rng(0)
+    num_traces = 5000
+    num_samples = 10
+    num_orders = 3
+    trace_resolution = 4096
+    traces = rng.normal(2000, 20, (num_traces, num_samples))
+    groups = rng.integers(0, 2, (1, 2, num_traces), dtype=np.uint8)
+    # Add first- and second-order leakage.
+    traces[:, 3] += groups[0, 0] * 5
+    traces[:, 6] += (2 * groups[0, 1].astype(float) - 1) * rng.normal(0, 10, num_traces)
+    traces = traces.astype(np.uint16)
+
+    histograms = compute_histograms(trace_resolution, traces, groups)
+    x = np.tile(np.arange(trace_resolution), (num_samples, 1))
+
+    # Add the traces in multiple batches and merge two accumulators to test the merge logic.
+    moments = MomentAccumulator(1, 2, num_samples, num_orders)
+    moments_other = MomentAccumulator(1, 2, num_samples, num_orders)
+    for start in range(0, 3000, 1000):
+        moments.update(traces[start:start + 1000], groups[:, :, start:start + 1000])
+    moments_other.update(traces[3000:], groups[:, :, 3000:], chunk_size=300)
+    moments.merge(moments_other)
+    received = moments.ttest()
+
+    for i_data in range(2):
+        expected = ttest_hist_xy(x, histograms[0, i_data, 0], x, histograms[0, i_data, 1],
+                                 num_orders)
+        assert np.allclose(expected, received[:, 0, i_data], rtol=1e-6, atol=1e-6)
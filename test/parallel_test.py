@@ -0,0 +1,39 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.histograms import compute_histograms
+from util.parallel import ScratchSpace, run_parallel, split_range
+
+
+def add_histograms_job(traces, groups, histograms, start, end):
+    compute_histograms(16, traces[:, start:end], groups,
+                       out=histograms[:, :, :, start:end, :])
+
+
+def test_split_range():
+    assert split_range(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert split_range(10, 3, 6) == [(0, 6), (6, 10)]
+    assert split_range(2, 4) == [(0, 1), (1, 2)]
+    assert split_range(0, 4) == []
+
+
+def test_jobs_write_shared_arrays_in_place():
+    rng = np.random.default_rng(0)
+    traces = rng.integers(0, 16, (300, 25), dtype=np.uint16)
+    groups = rng.integers(0, 2, (1, 2, 300), dtype=np.uint8)
+    expected = 2 * compute_histograms(16, traces, groups)
+
+    scratch = ScratchSpace()
+    histograms = scratch.zeros(expected.shape, np.uint32)
+    shared_traces = scratch.copy(traces)
+    shared_groups = scratch.copy(groups)
+    # Add the same traces twice, the second time with chunks not aligned to the first ones.
+    for chunk_size in [7, 10]:
+        run_parallel(add_histograms_job,
+                     [(shared_traces, shared_groups, histograms, start, end)
+                      for start, end in split_range(traces.shape[1], 2, chunk_size)],
+                     2)
+    assert np.array_equal(histograms, expected)
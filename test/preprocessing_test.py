@@ -0,0 +1,109 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import pytest
+
+from capture.project_library.project import ProjectConfig, SCAProject
+from util.preprocessing import Pipeline, TraceChunk, create_stage
+
+
+def random_chunk(num_traces, num_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    return TraceChunk(waves=rng.integers(0, 4096, (num_traces, num_samples), dtype=np.uint16),
+                      plaintexts=rng.integers(0, 256, (num_traces, 16), dtype=np.uint8),
+                      ciphertexts=rng.integers(0, 256, (num_traces, 16), dtype=np.uint8),
+                      keys=rng.integers(0, 256, (num_traces, 16), dtype=np.uint8))
+
+
+def test_stages():
+    chunk = random_chunk(20, 30)
+    waves = chunk.waves.astype(float)
+    _, average = create_stage({"type": "average", "factor": 4})
+    assert np.allclose(average(chunk).waves, waves[:, :28].reshape(20, 7, 4).mean(axis=2))
+    _, integrate = create_stage({"type": "integrate", "window": 3})
+    assert np.array_equal(integrate(chunk).waves, waves[:, :-2] + waves[:, 1:-1] + waves[:, 2:])
+    _, window = create_stage({"type": "window", "start": 5, "end": 25})
+    _, decimate = create_stage({"type": "decimate", "factor": 3, "offset": 1})
+    assert np.array_equal(decimate(window(chunk)).waves, chunk.waves[:, 6:25:3])
+    with pytest.raises(RuntimeError):
+        create_stage({"type": "unknown"})
+
+
+def test_sigma_filter():
+    chunk = random_chunk(20, 30)
+    chunk.waves[3, 7] = 60000
+    chunk.waves[11, 19] = 60000
+    _, sigma_filter = create_stage({"type": "sigma_filter", "num_sigmas": 3})
+    sigma_filter.fit(chunk.select(slice(0, 8)))
+    sigma_filter.fit(chunk.select(slice(8, 20)))
+    sigma_filter.prepare(chunk)
+    filtered = sigma_filter(chunk)
+    traces_to_use = np.ones(20, dtype=bool)
+    traces_to_use[[3, 11]] = False
+    assert np.array_equal(filtered.waves, chunk.waves[traces_to_use])
+    assert np.array_equal(filtered.keys, chunk.keys[traces_to_use])
+    assert np.array_equal(filtered.plaintexts, chunk.plaintexts[traces_to_use])
+
+
+@pytest.mark.parametrize("num_jobs", [1, 2])
+def test_pipeline_run(tmp_path, num_jobs):
+    chunk = random_chunk(95, 40)
+    project_in = SCAProject(ProjectConfig(type="ot_memmap_library",
+                                          path=str(tmp_path / "in.mmap"),
+                                          wave_dtype=np.uint16, overwrite=True))
+    project_in.create_project()
+    project_in.append_traces(chunk.waves, chunk.plaintexts, chunk.ciphertexts, chunk.keys)
+    project_out = SCAProject(ProjectConfig(type="ot_memmap_library",
+                                           path=str(tmp_path / "out.mmap"),
+                                           wave_dtype=np.float32, overwrite=True))
+    project_out.create_project()
+
+    stage_cfgs = [{"type": "window", "start": 4, "end": 36},
+                  {"type": "highpass", "cutoff": 0.1},
+                  {"type": "abs"},
+                  {"name": "average_2", "type": "average", "factor": 2}]
+    pipeline = Pipeline(stage_cfgs)
+    assert pipeline.run(project_in, project_out, 20, num_jobs, np.float32) == 95
+    # The stages work on every trace independently, the chunks must not make a difference.
+    expected, _ = Pipeline(stage_cfgs).process(chunk, prepare=True)
+    assert np.allclose(project_out.get_waves_array(), expected.waves.astype(np.float32))
+    assert np.array_equal(project_out.get_keys_array(), chunk.keys)
+    assert np.array_equal(project_out.get_ciphertexts_array(), chunk.ciphertexts)
+    assert list(pipeline.stats) == ["read", "window", "highpass", "abs", "average_2", "write"]
+    assert all(stats.traces_in == 95 for stats in pipeline.stats.values())
+    project_in.close(save=False)
+    project_out.close(save=False)
+
+
+@pytest.mark.parametrize("chunk_size,num_jobs", [(7, 1), (30, 2), (200, 1)])
+def test_pipeline_sigma_filter(tmp_path, chunk_size, num_jobs):
+    chunk = random_chunk(150, 20)
+    rng = np.random.default_rng(1)
+    outliers = rng.choice(150, 10, replace=False)
+    chunk.waves[outliers, rng.integers(2, 20, 10)] = 12000
+    project_in = SCAProject(ProjectConfig(type="ot_memmap_library",
+                                          path=str(tmp_path / "in.mmap"),
+                                          wave_dtype=np.uint16, overwrite=True))
+    project_in.create_project()
+    project_in.append_traces(chunk.waves, chunk.plaintexts, chunk.ciphertexts, chunk.keys)
+    project_out = SCAProject(ProjectConfig(type="ot_memmap_library",
+                                           path=str(tmp_path / "out.mmap"),
+                                           wave_dtype=np.uint16, overwrite=True))
+    project_out.create_project()
+
+    pipeline = Pipeline([{"type": "window", "start": 2},
+                         {"type": "sigma_filter", "num_sigmas": 2.5}])
+    num_traces_out = pipeline.run(project_in, project_out, chunk_size, num_jobs)
+    # The traces are filtered with the statistics of all traces, independent of the chunks.
+    waves = chunk.waves[:, 2:].astype(float)
+    mean, std = waves.mean(axis=0), waves.std(axis=0)
+    traces_to_use = np.all(np.abs(waves - mean) <= 2.5 * std, axis=1)
+    assert not traces_to_use[outliers].any()
+    assert num_traces_out == traces_to_use.sum()
+    assert np.array_equal(project_out.get_waves_array(), chunk.waves[traces_to_use, 2:])
+    assert np.array_equal(project_out.get_keys_array(), chunk.keys[traces_to_use])
+    assert pipeline.stats["sigma_filter (fit)"].traces_in == 150
+    project_in.close(save=False)
+    project_out.close(save=False)
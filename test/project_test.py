@@ -0,0 +1,135 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import pytest
+
+from capture.project_library.project import ProjectConfig, SCAProject
+
+
+def create_test_project(path, project_type, num_traces, num_samples, fast_write=False):
+    """Create a project with random traces and return the traces, keys and texts."""
+    rng = np.random.default_rng(0)
+    waves = rng.integers(0, 4096, (num_traces, num_samples), dtype=np.uint16)
+    keys = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    plaintexts = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    ciphertexts = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    project = SCAProject(ProjectConfig(type = project_type, path = path,
+                                       wave_dtype = np.uint16, overwrite = True,
+                                       trace_threshold = 10, fast_write = fast_write))
+    project.create_project()
+    if project_type == "cw":
+        # Spread the traces over multiple trace segments.
+        project.project.traces.seg_len = 20
+    for i in range(num_traces):
+        project.append_trace(waves[i], plaintexts[i], ciphertexts[i], keys[i])
+    project.save()
+    project.close(save=True)
+    return waves, keys, plaintexts, ciphertexts
+
+
+@pytest.mark.parametrize("project_type,suffix,fast_write", [("cw", ".cwp", False),
+                                                            ("ot_trace_library", ".db", False),
+                                                            ("ot_trace_library", ".db", True),
+                                                            ("ot_memmap_library", ".mmap", False)])
+def test_get_arrays(tmp_path, project_type, suffix, fast_write):
+    path = str(tmp_path / ("project" + suffix))
+    waves, keys, plaintexts, ciphertexts = create_test_project(path, project_type, 50, 30,
+                                                               fast_write)
+    project = SCAProject(ProjectConfig(type = project_type, path = path,
+                                       wave_dtype = np.uint16, overwrite = False))
+    project.open_project()
+    assert project.num_traces() == 50
+    assert project.num_samples() == 30
+    assert project.dtype() == np.uint16
+    for start, end, sample_start, num_samples in [(None, None, 0, None), (5, 45, 3, 10),
+                                                  (18, 23, 7, None), (49, 60, 0, 1)]:
+        window = slice(sample_start, None if num_samples is None else sample_start + num_samples)
+        traces = slice(start, end)
+        received = project.get_waves_array(start, end, sample_start, num_samples)
+        assert received.dtype == np.uint16
+        # Memory-mapped projects return views of the waves.
+        assert received.flags.c_contiguous or project_type == "ot_memmap_library"
+        assert np.array_equal(received, waves[traces, window])
+        assert np.array_equal(project.get_keys_array(start, end), keys[traces])
+        assert np.array_equal(project.get_plaintexts_array(start, end), plaintexts[traces])
+        assert np.array_equal(project.get_ciphertexts_array(start, end), ciphertexts[traces])
+    project.close(save=False)
+
+
+@pytest.mark.parametrize("project_type,suffix", [("ot_trace_library", ".db"),
+                                                 ("ot_memmap_library", ".mmap")])
+def test_iter_waves_arrays(tmp_path, project_type, suffix):
+    path = str(tmp_path / ("project" + suffix))
+    waves, _, _, _ = create_test_project(path, project_type, 50, 30)
+    project = SCAProject(ProjectConfig(type = project_type, path = path,
+                                       wave_dtype = np.uint16, overwrite = False))
+    project.open_project()
+    for start, end, sample_start, num_samples in [(None, None, 0, None), (3, 47, 4, 11)]:
+        # The chunk size does not divide the number of traces.
+        chunks = list(project.project.iter_waves_arrays(start, end, sample_start, num_samples,
+                                                        chunk_size=7))
+        assert all(len(chunk) <= 7 for chunk in chunks)
+        assert np.array_equal(np.concatenate(chunks),
+                              project.get_waves_array(start, end, sample_start, num_samples))
+        window = slice(sample_start, None if num_samples is None else sample_start + num_samples)
+        assert np.array_equal(np.concatenate(chunks), waves[start:end, window])
+    project.close(save=False)
+
+
+def test_memmap_append_and_views(tmp_path):
+    path = str(tmp_path / "project.mmap")
+    waves, keys, plaintexts, ciphertexts = create_test_project(path, "ot_memmap_library", 25, 30)
+    # Reopen the project and append more traces, half of them only in memory.
+    project = SCAProject(ProjectConfig(type = "ot_memmap_library", path = path,
+                                       wave_dtype = np.uint16, overwrite = False,
+                                       trace_threshold = 10))
+    project.open_project()
+    for i in range(15):
+        project.append_trace(waves[i], plaintexts[i], ciphertexts[i], keys[i])
+    all_waves = np.concatenate([waves, waves[:15]])
+    assert project.num_traces() == 40
+    received = project.get_waves_array(20, 30, 5, 10)
+    assert isinstance(received.base, np.memmap) and not received.flags.writeable
+    assert np.array_equal(received, all_waves[20:30, 5:15])
+    assert np.array_equal(project.get_waves(39), all_waves[39])
+    assert np.array_equal(project.get_keys_array(), np.concatenate([keys, keys[:15]]))
+    project.write_metadata({"num_traces": 40})
+    project.close(save=True)
+
+    project.open_project()
+    assert project.get_metadata() == {"num_traces": 40}
+    assert np.array_equal(project.get_waves_array(), all_waves)
+    project.close(save=False)
+
+
+@pytest.mark.parametrize("project_type,suffix", [("cw", ".cwp"),
+                                                 ("ot_trace_library", ".db"),
+                                                 ("ot_memmap_library", ".mmap")])
+def test_append_traces(tmp_path, project_type, suffix):
+    path = str(tmp_path / ("project" + suffix))
+    rng = np.random.default_rng(0)
+    waves = rng.integers(0, 4096, (25, 30), dtype=np.uint16)
+    keys, plaintexts, ciphertexts = rng.integers(0, 256, (3, 25, 16), dtype=np.uint8)
+    project = SCAProject(ProjectConfig(type = project_type, path = path,
+                                       wave_dtype = np.uint16, overwrite = True,
+                                       trace_threshold = 10))
+    project.create_project()
+    # Buffered traces are written before the batches.
+    for i in range(5):
+        project.append_trace(waves[i], plaintexts[i], ciphertexts[i], keys[i])
+    project.append_traces(waves[5:20], plaintexts[5:20], ciphertexts[5:20], keys[5:20])
+    project.append_traces(waves[20:], plaintexts[20:], ciphertexts[20:], keys[20:])
+    project.save()
+    project.close(save=True)
+
+    project = SCAProject(ProjectConfig(type = project_type, path = path,
+                                       wave_dtype = np.uint16, overwrite = False))
+    project.open_project()
+    assert project.num_traces() == 25
+    assert np.array_equal(project.get_waves_array(), waves)
+    assert np.array_equal(project.get_keys_array(), keys)
+    assert np.array_equal(project.get_plaintexts_array(), plaintexts)
+    assert np.array_equal(project.get_ciphertexts_array(), ciphertexts)
+    project.close(save=False)
@@ -0,0 +1,61 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from capture.project_library.project import ProjectConfig, SCAProject
+from util.segmentation import (design_highpass, find_boundaries,
+                               number_iterations)
+
+from .cmd import Args
+from .repo import RepoCmd
+
+
+def create_wave(rng, period, num_iterations, missing=()):
+    """Create a wave with a noisy burst per iteration, separated by quiet gaps."""
+    starts = np.cumsum(rng.integers(period - 20, period + 21, num_iterations)) - period + 500
+    wave = 2000 + rng.normal(0, 5, starts[-1] + period + 500)
+    for iteration, start in enumerate(starts):
+        if iteration not in missing:
+            wave[start + 100:start + period - 100] += rng.normal(0, 200, period - 200)
+    return wave.astype(np.uint16), starts
+
+
+def test_find_boundaries():
+    rng = np.random.default_rng(0)
+    wave, starts = create_wave(rng, 3000, 40, missing=[17])
+    taps = design_highpass(51, 0.2)
+    boundaries = [np.fromiter(find_boundaries(wave, taps, 100, 2500, chunk_samples), dtype=int)
+                  for chunk_samples in [4000, 37011, len(wave)]]
+    assert np.array_equal(boundaries[0], boundaries[1])
+    assert np.array_equal(boundaries[0], boundaries[2])
+    boundaries = boundaries[0]
+    # The boundaries are in the gaps before the iterations, the gaps around the missing burst are
+    # merged and the iteration number is incremented by two.
+    assert np.array_equal(number_iterations(boundaries, 3000), np.delete(np.arange(41), 18))
+    detected = np.delete(np.arange(1, 40), [16, 17])
+    assert np.all(np.abs(np.delete(boundaries[1:-1], 16) - starts[detected]) < 100)
+
+
+def test_segment_traces(tmp_path):
+    rng = np.random.default_rng(1)
+    waves = [create_wave(rng, 3000, 20)[0][:60000] for _ in range(2)]
+    np.save(tmp_path / "waves.npy", np.stack(waves))
+    project_path = tmp_path / "segments.mmap"
+    RepoCmd(Args(['analysis/segment_traces.py', '-i', str(tmp_path / "waves.npy"),
+                  '-o', str(project_path), '-p', '3000', '-l', '2800', '-fc', '0.2',
+                  '-ft', '51', '-cs', '10000', '-m', '7'])).run()
+    project = SCAProject(ProjectConfig(type="ot_memmap_library", path=str(project_path),
+                                       wave_dtype=np.uint16, overwrite=False))
+    project.open_project()
+    metadata = project.get_metadata()
+    segment_waves = np.array(metadata["segment_waves"])
+    segment_offsets = np.array(metadata["segment_offsets"])
+    assert project.num_traces() == metadata["num_traces"] == len(segment_offsets)
+    assert project.num_samples() == 2800
+    assert np.count_nonzero(segment_waves == 0) >= 18
+    for index, (wave, offset) in enumerate(zip(segment_waves, segment_offsets)):
+        assert np.array_equal(project.get_waves_array(index, index + 1)[0],
+                              waves[wave][offset:offset + 2800])
+    project.close(save=False)
@@ -0,0 +1,93 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.trace_alignment import align_traces_dtw, align_traces_sad
+
+
+def resync_sad_reference(traces, ref_trace, low_window, high_window, max_shift):
+    """Align one trace at a time like the ChipWhisperer ResyncSAD preprocessing."""
+    def find_sad(trace):
+        sad = np.zeros(2 * max_shift)
+        for shift in range(-max_shift, max_shift):
+            start = low_window + shift
+            sad[shift + max_shift] = np.abs(
+                trace[start:start + high_window - low_window] -
+                ref_trace[low_window:high_window]).sum()
+        return sad
+
+    ref_trace = ref_trace.astype(float)
+    ref_sad = find_sad(ref_trace)
+    aligned_traces = []
+    for trace in traces.astype(float):
+        sad = find_sad(trace)
+        if sad.min() > ref_sad.mean():
+            continue
+        diff = np.argmin(sad) - np.argmin(ref_sad)
+        if diff < 0:
+            trace = np.append(np.zeros(-diff), trace[:diff])
+        elif diff > 0:
+            trace = np.append(trace[diff:], np.zeros(diff))
+        aligned_traces.append(trace)
+    return np.array(aligned_traces)
+
+
+def test_align_traces_sad():
+    rng = np.random.default_rng(0)
+    signal = 2000 + 500 * np.sin(np.arange(300) / 5)
+    shifts = rng.integers(-10, 11, 50)
+    traces = np.array([signal[60 + shift:260 + shift] for shift in shifts])
+    traces += rng.normal(0, 20, traces.shape)
+    # Traces without the signal are discarded.
+    traces[::10] = rng.normal(2000, 500, (5, 200))
+    traces = traces.astype(np.uint16)
+    ref_trace = signal[60:260].astype(np.uint16)
+
+    aligned_traces, traces_to_use = align_traces_sad(traces, ref_trace, 50, 150, 15)
+    assert not traces_to_use[::10].any()
+    assert traces_to_use.sum() == 45
+    assert aligned_traces.dtype == np.uint16
+    assert np.array_equal(aligned_traces,
+                          resync_sad_reference(traces, ref_trace, 50, 150, 15))
+    # The signal is aligned except for the zero padding at the ends.
+    assert np.all(np.abs(aligned_traces[:, 20:180] - ref_trace[20:180].astype(float)) < 100)
+
+
+def dtw_reference(trace, ref_trace, radius):
+    """Warp one trace with the full DTW cost matrix restricted to the band."""
+    num_samples = len(ref_trace)
+    costs = np.full((num_samples + 1, num_samples + 1), np.inf)
+    costs[0, 0] = 0
+    for i in range(1, num_samples + 1):
+        for j in range(max(1, i - radius), min(num_samples, i + radius) + 1):
+            costs[i, j] = abs(ref_trace[i - 1] - trace[j - 1]) + min(
+                costs[i - 1, j - 1], costs[i - 1, j], costs[i, j - 1])
+    sums = np.zeros(num_samples)
+    cnts = np.zeros(num_samples)
+    i, j = num_samples, num_samples
+    while i > 0 and j > 0:
+        sums[i - 1] += trace[j - 1]
+        cnts[i - 1] += 1
+        i, j = [(i - 1, j - 1), (i - 1, j), (i, j - 1)][
+            np.argmin([costs[i - 1, j - 1], costs[i - 1, j], costs[i, j - 1]])]
+    return sums / cnts
+
+
+def test_align_traces_dtw():
+    rng = np.random.default_rng(0)
+    ref_trace = rng.normal(0, 1, 120)
+    traces = rng.normal(0, 1, (7, 120))
+    for radius in [0, 1, 6, 119]:
+        aligned_traces = align_traces_dtw(traces, ref_trace, radius, batch_size=3)
+        assert np.allclose(aligned_traces,
+                           [dtw_reference(trace, ref_trace, radius) for trace in traces])
+    assert np.allclose(align_traces_dtw(traces, ref_trace, 0), traces)
+
+    # Traces with a varying delay are warped back onto the reference trace.
+    signal = np.sin(np.arange(400) / 4)
+    delays = np.cumsum(rng.integers(0, 2, (20, 400)), axis=1) // 20
+    traces = signal[np.clip(np.arange(400) - delays, 0, None)]
+    aligned_traces = align_traces_dtw(traces, signal, 25)
+    assert np.abs(aligned_traces - signal)[:, 10:-10].max() < 0.2
@@ -0,0 +1,35 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.histograms import compute_histograms
+from util.ttest import ttest_hist, ttest_hist_xy
+
+
+def test_ttest_hist_matches_ttest_hist_xy():
+    rng = np.random.default_rng(0)
+    num_traces = 5000
+    num_samples = 40
+    trace_resolution = 4096
+    # Samples with very different means and noise levels.
+    traces = rng.normal(rng.uniform(100, 4000, num_samples), rng.uniform(0.5, 40, num_samples),
+                        (num_traces, num_samples))
+    groups = rng.integers(0, 2, (1, 1, num_traces), dtype=np.uint8)
+    # Add first- and second-order leakage.
+    traces[:, 3] += groups[0, 0] * 5
+    traces[:, 6] += (2 * groups[0, 0].astype(float) - 1) * rng.normal(0, 10, num_traces)
+    # Constant and almost constant samples.
+    traces[:, 7] = 1234
+    traces[:, 8] = np.where(rng.random(num_traces) < 1e-3, 4001, 4000)
+    traces = np.clip(traces, 0, trace_resolution - 1).astype(np.uint16)
+
+    histograms = compute_histograms(trace_resolution, traces, groups)
+    x = np.tile(np.arange(trace_resolution), (num_samples, 1))
+    for num_orders in range(1, 5):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = ttest_hist_xy(x, histograms[0, 0, 0], x, histograms[0, 0, 1], num_orders)
+        received = ttest_hist(histograms[0, 0, 0], histograms[0, 0, 1], num_orders)
+        assert received.shape == (num_orders, num_samples)
+        assert np.allclose(expected, received, rtol=1e-8, atol=1e-8, equal_nan=True)
@@ -0,0 +1,60 @@
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+from util.tvla_monitor import TvlaMonitor
+
+
+def run_capture(monitor, leakage, num_batches=100, num_segments=10):
+    """Feed fixed-vs-random batches into the monitor until it stops the capture."""
+    rng = np.random.default_rng(0)
+    fixed_key = bytearray(range(16))
+    for i_batch in range(num_batches):
+        fixed = rng.integers(0, 2, num_segments).astype(bool)
+        keys = [fixed_key if f else bytearray(rng.integers(0, 256, 16, dtype=np.uint8))
+                for f in fixed]
+        waves = rng.normal(2000, 10, (num_segments, 50))
+        waves[:, 20] += leakage * fixed
+        if monitor.update(waves.astype(np.uint16), keys):
+            return (i_batch + 1) * num_segments
+    return num_batches * num_segments
+
+
+def test_monitor_stops_on_leakage():
+    monitor = TvlaMonitor(report_interval=100, num_orders=2)
+    num_traces = run_capture(monitor, leakage=20)
+    assert monitor.result == "leakage"
+    # Two consecutive reports above the threshold are needed.
+    assert num_traces == 200
+    assert len(monitor.history) == 2 and monitor.history[-1][1][0] > 4.5
+
+
+def test_monitor_stops_after_trace_budget():
+    monitor = TvlaMonitor(report_interval=100, num_orders=2, trace_budget=500)
+    num_traces = run_capture(monitor, leakage=0)
+    assert monitor.result == "no_leakage"
+    assert num_traces == 500
+    assert monitor.summary()["num_traces"] == 500
+
+
+def test_monitor_reports_on_intervals_after_trace_budget():
+    monitor = TvlaMonitor(report_interval=100, num_orders=2, trace_budget=150)
+    num_traces = run_capture(monitor, leakage=20)
+    # The budget is checked once, then the monitor only reports every 100 traces. The report at
+    # the budget doesn't count towards the confirmation of the leakage.
+    assert monitor.result == "leakage"
+    assert num_traces == 200
+    assert [num_traces for num_traces, _ in monitor.history] == [100, 150, 200]
+
+
+def test_monitor_keeps_capturing_after_trace_budget():
+    monitor = TvlaMonitor(report_interval=100, num_orders=2, trace_budget=150,
+                          num_confirmations=100)
+    num_traces = run_capture(monitor, leakage=20, num_batches=50)
+    # Leakage is neither confirmed nor excluded, the capture runs to the end with one report
+    # every 100 traces.
+    assert monitor.result is None
+    assert num_traces == 500
+    assert [num_traces for num_traces, _ in monitor.history] == [100, 150, 200, 300, 400, 500]
@@ -2,10 +2,17 @@
 # Licensed under the Apache License, Version 2.0, see LICENSE for details.
 # SPDX-License-Identifier: Apache-2.0
 
+from pathlib import Path
+
 import numpy as np
+import yaml
+
+from analysis.tvla import compute_histograms_parallel
+from util.histograms import compute_histograms
+from util.parallel import ScratchSpace
 
 from .cmd import Args
-from .repo import RepoCmd, TestDataPath
+from .repo import REPO_PATH, RepoCmd, TestDataPath
 
 
 class TvlaCmd(RepoCmd):
@@ -21,6 +28,23 @@ def test_help():
     assert (len(tvla.stdout()) != 0 or len(tvla.stderr()) != 0)
 
 
+def test_compute_histograms_parallel_releases_scratch_files():
+    rng = np.random.default_rng(0)
+    scratch = ScratchSpace()
+    histograms = scratch.zeros((1, 2, 2, 25, 16), np.uint32)
+    expected = np.zeros(histograms.shape, np.uint32)
+    for _ in range(4):
+        traces = rng.integers(0, 16, (300, 25), dtype=np.uint16)
+        groups = rng.integers(0, 2, (1, 2, 300), dtype=np.uint8)
+        compute_histograms_parallel(16, traces, groups, histograms, 2, 7, scratch)
+        expected += compute_histograms(16, traces, groups)
+        # Only the histograms are kept in the scratch space, the copies of the traces and the
+        # groups of every step are deleted.
+        assert [path.name for path in Path(scratch.dir.name).iterdir()] == [
+            Path(histograms.filename).name]
+    assert np.array_equal(histograms, expected)
+
+
 def ttest_significant(ttest_trace) -> bool:
     """Determine if a t-test trace contains a significant deviation from the mean."""
     threshold = 4.5
@@ -101,3 +125,59 @@ def test_aes_byte_filtering():
     traces_to_use = received_file['traces_to_use']
     assert sum(traces_to_use) <= 100, (
            f"{tvla} filtered less than 90 % of the input traces, which is unexpected.")
+
+
+def test_general_kmac_accumulate_merge_report():
+    project_path = TestDataPath('tvla_general/ci_opentitan_simple_kmac.cwp')
+    # Accumulate the two halves of the project separately.
+    for i, (trace_start, trace_end) in enumerate([(0, 24), (25, 49)]):
+        TvlaCmd(Args(['--project-file', str(project_path),
+                      '--mode', 'kmac', '--test-type', 'GENERAL_KEY',
+                      '--trace-start', str(trace_start), '--trace-end', str(trace_end),
+                      'accumulate', f'tmp/accumulator_{i}.npz'])).run()
+    TvlaCmd(Args(['merge', 'tmp/accumulator.npz',
+                  'tmp/accumulator_0.npz', 'tmp/accumulator_1.npz'])).run()
+    tvla = TvlaCmd(Args(['--save-to-disk-ttest', 'report', 'tmp/accumulator.npz'])).run()
+    received_trace = np.load('tmp/ttest.npy')
+    # Traces are filtered per step, the merged result must thus match the last of two steps.
+    TvlaCmd(Args(['--project-file', str(project_path),
+                  '--mode', 'kmac', '--save-to-disk-ttest', '--test-type', 'GENERAL_KEY',
+                  '--trace-end', '49', '--number-of-steps', '2', 'run-tvla'])).run()
+    expected_trace = np.load('tmp/ttest-step.npy.npz')['ttest_step'][..., -1]
+    delta = 0.001
+    assert ttest_compare_results(expected_trace, received_trace, delta), (
+           f"{tvla} generated ttest values that don't match the step-wise ones")
+
+
+def test_aes_multiple_tests_single_pass():
+    project_path = TestDataPath('tvla_aes_byte/ci_opentitan_simple_aes.cwp')
+    tests = [{'name': 'byte_hw', 'test_type': 'SPECIFIC_BYTE'},
+             {'name': 'byte_hd', 'test_type': 'SPECIFIC_BYTE',
+              'leakage_model': 'HAMMING_DISTANCE', 'backend': 'moments'},
+             {'name': 'bit_hw', 'test_type': 'SPECIFIC_BIT', 'bit_select': [0, 7]}]
+    with open(REPO_PATH / 'analysis/configs/tvla_cfg_template.yaml') as f:
+        cfg = yaml.load(f, Loader=yaml.FullLoader)
+    cfg.update({'project_file': str(project_path), 'mode': 'aes', 'round_select': [1],
+                'byte_select': [0, 1], 'bit_select': None, 'save_to_disk_ttest': True,
+                'filter_traces': True, 'tests': tests})
+    Path('tmp').mkdir(exist_ok=True)
+    with open('tmp/tvla_multi_cfg.yaml', 'w') as f:
+        yaml.dump(cfg, f)
+    tvla = TvlaCmd(Args(['--cfg-file', 'tmp/tvla_multi_cfg.yaml', 'run-tvla'])).run()
+    received_traces = {test['name']: np.load(f"tmp/{test['name']}/ttest.npy") for test in tests}
+    # Every test must match the result of running it on its own.
+    for test in tests:
+        args = ['--project-file', str(project_path), '--mode', 'aes', '--round-select', '1',
+                '--save-to-disk-ttest', '--test-type', test['test_type'],
+                '--leakage-model', test.get('leakage_model', 'HAMMING_WEIGHT'),
+                '--backend', test.get('backend', 'histogram')]
+        if test['test_type'] == 'SPECIFIC_BYTE':
+            args += ['--byte-select', '0', '--byte-select', '1']
+        TvlaCmd(Args(args + ['run-tvla'])).run()
+        expected_trace = np.load('tmp/ttest.npy')
+        if test['test_type'] == 'SPECIFIC_BIT':
+            # Without a bit selection, all bits are tested.
+            expected_trace = expected_trace[:, :, test['bit_select']]
+        delta = 0.001
+        assert ttest_compare_results(expected_trace, received_traces[test['name']], delta), (
+               f"{tvla} generated ttest values of {test['name']} that don't match a single run")
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import scipy.sparse
+
+# Upper bound for the number of trace values processed at a time by count_and_sum_text_traces().
+# This keeps the temporary one-hot matrix and the converted traces at a few tens of MB.
+MAX_CHUNK_VALUES = 2**22
+
+# Number of samples of the mean traces processed at a time by compute_diff_corrcoefs().
+SAMPLE_CHUNK_SIZE = 128
+
+NUM_TEXT_BYTES = 16
+NUM_BYTE_VALUES = 256
+
+
+def compute_stats(traces):
+    """ Computing the number of traces, their sums and sums of deviation products.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+
+    Returns:
+        A tuple ``(cnt, sum_, sum_dev_prods)`` that can be combined with the statistics of other
+        traces using merge_stats().
+    """
+    cnt = traces.shape[0]
+    sum_ = traces.sum(axis=0, dtype=np.float64)
+    if cnt == 0:
+        return (0, sum_, np.zeros_like(sum_))
+    sum_dev_prods = ((traces - sum_ / cnt) ** 2).sum(axis=0)
+    return (cnt, sum_, sum_dev_prods)
+
+
+def merge_stats(stats_a, stats_b):
+    """ Merging the statistics of two disjoint sets of traces.
+
+    Uses Eq. 22 in "Numerically Stable Parallel Computation of (Co-)Variance" by E. Schubert and
+    M. Gertz (https://dbs.ifi.uni-heidelberg.de/files/Team/eschubert/publications/
+    SSDBM18-covariance-authorcopy.pdf).
+
+    Args:
+        stats_a: Tuple ``(cnt, sum_, sum_dev_prods)`` of the first set, see compute_stats().
+        stats_b: Tuple ``(cnt, sum_, sum_dev_prods)`` of the second set.
+
+    Returns:
+        The tuple ``(cnt, sum_, sum_dev_prods)`` of the union of both sets.
+    """
+    cnt_a, sum_a, sum_dev_prods_a = stats_a
+    cnt_b, sum_b, sum_dev_prods_b = stats_b
+    if cnt_a == 0:
+        return stats_b
+    if cnt_b == 0:
+        return stats_a
+    sum_dev_prods = sum_dev_prods_a + sum_dev_prods_b + (
+        (cnt_b * sum_a - cnt_a * sum_b) ** 2 / (cnt_a * cnt_b * (cnt_a + cnt_b)))
+    return (cnt_a + cnt_b, sum_a + sum_b, sum_dev_prods)
+
+
+def count_and_sum_text_traces(texts, traces, cnts=None, sums=None, chunk_size=None):
+    """ Computing the number of traces and the sums of these traces for all values of each text
+    byte.
+
+    Every trace is mapped to one column of a sparse one-hot matrix with one row per text byte and
+    value. The sums of all text bytes and values are then computed with a single sparse matrix
+    product per chunk of traces instead of sorting the traces by every text byte and summing them
+    one value at a time.
+
+    The function can be called with consecutive chunks of traces, the results are added to cnts and
+    sums if provided.
+
+    Args:
+        texts: (num_traces, 16) array of plaintexts or ciphertexts.
+        traces: (num_traces, num_samples) array of traces.
+        cnts: Optional (16, 256, 1) array to add the counts to.
+        sums: Optional (16, 256, num_samples) array to add the sums to.
+        chunk_size: Number of traces processed at a time. By default, chunks are sized such that
+            they contain up to MAX_CHUNK_VALUES trace values.
+
+    Returns:
+        A tuple ``(cnts, sums)``, where
+            - ``cnts`` is a (16, 256, 1) array where ``cnts[i, j, 0]`` gives the number of traces
+              where text byte i is j, and
+            - ``sums`` is a (16, 256, num_samples) array where ``sums[i, j, :]`` gives the sum of
+              traces where text byte i is j.
+    """
+    num_traces, num_samples = traces.shape
+    assert texts.shape == (num_traces, NUM_TEXT_BYTES)
+    if cnts is None:
+        # Need to specify the last dimension for broadcasting to work during aggregation.
+        cnts = np.zeros((NUM_TEXT_BYTES, NUM_BYTE_VALUES, 1))
+    if sums is None:
+        sums = np.zeros((NUM_TEXT_BYTES, NUM_BYTE_VALUES, num_samples))
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_VALUES // max(1, num_samples))
+
+    # Row offset of every text byte in the one-hot matrix.
+    byte_offsets = np.arange(NUM_TEXT_BYTES, dtype=np.int32) * NUM_BYTE_VALUES
+    cnts_flat = cnts.reshape(NUM_TEXT_BYTES * NUM_BYTE_VALUES)
+    sums_flat = sums.reshape(NUM_TEXT_BYTES * NUM_BYTE_VALUES, num_samples)
+    for start in range(0, num_traces, chunk_size):
+        end = min(start + chunk_size, num_traces)
+        num_chunk_traces = end - start
+        # Column j of the one-hot matrix holds a one in row 256 * i + texts[j, i] for all text
+        # bytes i.
+        rows = (texts[start:end].astype(np.int32) + byte_offsets).ravel()
+        one_hot = scipy.sparse.csc_matrix(
+            (np.ones(rows.size), rows,
+             np.arange(0, rows.size + 1, NUM_TEXT_BYTES, dtype=np.int32)),
+            shape=(NUM_TEXT_BYTES * NUM_BYTE_VALUES, num_chunk_traces))
+        cnts_flat += np.bincount(rows, minlength=NUM_TEXT_BYTES * NUM_BYTE_VALUES)
+        sums_flat += one_hot @ traces[start:end]
+    return cnts, sums
+
+
+def walsh_hadamard_transform(values):
+    """ Fast Walsh-Hadamard transform along axis 1.
+
+    Computes hadamard @ values[i] for all i, where hadamard[j, k] = (-1)^popcount(j & k), with
+    log2(n) butterfly stages instead of a dense matrix product.
+
+    Args:
+        values: (m, n, num_samples) array, n must be a power of two.
+
+    Returns:
+        The transformed (m, n, num_samples) array.
+    """
+    num_values = values.shape[1]
+    assert num_values & (num_values - 1) == 0, "The length must be a power of two."
+    transformed = np.array(values, dtype=np.float64)
+    half = 1
+    while half < num_values:
+        butterflies = transformed.reshape(values.shape[0], num_values // (2 * half), 2, half, -1)
+        lower = butterflies[:, :, 0].copy()
+        butterflies[:, :, 0] += butterflies[:, :, 1]
+        lower -= butterflies[:, :, 1]
+        butterflies[:, :, 1] = lower
+        half *= 2
+    return transformed
+
+
+def compute_diff_corrcoefs(mean_traces):
+    """ Computing the correlation coefficients of all differences between text bytes.
+
+    For every pair of text bytes a and b and every difference d, the correlation coefficients
+    between the mean traces of all values alpha of byte a and the mean traces of the values
+    alpha ^ d of byte b are summed up. The mean traces are standardized once such that these
+    correlation coefficients are dot products of standardized traces.
+
+    Summing dot products over all alpha with a fixed XOR difference d is a convolution over the
+    byte values, which the Walsh-Hadamard transform turns into a product. The sums of all pairs and
+    differences are thus obtained from the transformed traces with a single batched matrix product
+    instead of computing 120 full (512, 512) correlation matrices.
+
+    Args:
+        mean_traces: A (16, 256, num_samples) array of mean text traces.
+
+    Returns:
+        A (16, 16, 256) array A, where A[i, j, d] is the sum of the correlation coefficients for
+        difference d between text bytes i and j. A[i, j] equals A[j, i], the diagonal is zero.
+    """
+    num_samples = mean_traces.shape[2]
+    # Standardize every mean trace such that the dot product of two standardized traces is their
+    # correlation coefficient.
+    centered = mean_traces - mean_traces.mean(axis=2, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        standardized = centered / (centered.std(axis=2, keepdims=True) * np.sqrt(num_samples))
+    # products[k, a, b] is the dot product of the transformed mean traces of text bytes a and b at
+    # index k. The samples are processed in chunks that fit into the CPU caches.
+    products = np.zeros((NUM_BYTE_VALUES, NUM_TEXT_BYTES, NUM_TEXT_BYTES))
+    for start in range(0, num_samples, SAMPLE_CHUNK_SIZE):
+        transformed = walsh_hadamard_transform(
+            standardized[:, :, start:start + SAMPLE_CHUNK_SIZE]).transpose(1, 0, 2)
+        products += np.matmul(transformed, transformed.transpose(0, 2, 1))
+    # Only the pairs a < b are needed, the results are symmetric.
+    bytes_a, bytes_b = np.triu_indices(NUM_TEXT_BYTES, 1)
+    diff_corrcoefs = np.zeros((NUM_TEXT_BYTES, NUM_TEXT_BYTES, NUM_BYTE_VALUES))
+    # The inverse transform is the transform divided by 256.
+    diff_corrcoefs[bytes_a, bytes_b] = walsh_hadamard_transform(
+        products[np.newaxis, :, bytes_a, bytes_b])[0].T / NUM_BYTE_VALUES
+    diff_corrcoefs[bytes_b, bytes_a] = diff_corrcoefs[bytes_a, bytes_b]
+    return diff_corrcoefs
+
+
+def find_pairwise_diffs_and_scores(diff_corrcoefs):
+    """ Finding the most likely differences between text bytes and their confidence scores.
+
+    Args:
+        diff_corrcoefs: A (16, 16, 256) array returned by compute_diff_corrcoefs().
+
+    Returns:
+        A (16, 16, 2) array A, where A[i, j, 0] is the difference with the largest correlation
+        coefficient between text bytes i and j, and A[i, j, 1] is the corresponding confidence
+        score.
+    """
+    bytes_a, bytes_b = np.triu_indices(NUM_TEXT_BYTES, 1)
+    pair_corrcoefs = diff_corrcoefs[bytes_a, bytes_b]
+    best_diffs = pair_corrcoefs.argmax(axis=1)
+    # TODO: Analyze the effect of /diff_corrcoefs.mean() below.
+    scores = (pair_corrcoefs[np.arange(len(best_diffs)), best_diffs] /
+              pair_corrcoefs.mean(axis=1))
+
+    pairwise_diffs_scores = np.zeros((NUM_TEXT_BYTES, NUM_TEXT_BYTES, 2))
+    pairwise_diffs_scores[bytes_a, bytes_b, 0] = best_diffs
+    pairwise_diffs_scores[bytes_a, bytes_b, 1] = scores
+    pairwise_diffs_scores[bytes_b, bytes_a] = pairwise_diffs_scores[bytes_a, bytes_b]
+    return pairwise_diffs_scores
+
+
+def compute_pairwise_diffs_and_scores(mean_traces):
+    """ Computing the most likely differences between text bytes and their confidence scores.
+
+    See compute_diff_corrcoefs() and find_pairwise_diffs_and_scores().
+
+    Args:
+        mean_traces: A (16, 256, num_samples) array of mean text traces.
+
+    Returns:
+        A (16, 16, 2) array A, where A[i, j, 0] is the difference with the largest correlation
+        coefficient between text bytes i and j, and A[i, j, 1] is the corresponding confidence
+        score.
+    """
+    return find_pairwise_diffs_and_scores(compute_diff_corrcoefs(mean_traces))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import scipy.sparse
+
+from util.leakage_models import AES_INV_SBOX, AES_SBOX, AES_SHIFT_ROWS, HW_LUT
+
+NUM_KEY_BYTES = 16
+NUM_BYTE_VALUES = 256
+
+
+@dataclass
+class LeakageModel:
+    """ A leakage model of the AES key bytes.
+
+    The leakage of key byte guess g of a trace is sum_k coefs[k, g, v] * weights[k], where v is
+    the text byte at the position of the key byte and the weights are computed from the texts of
+    the trace. The first weight must always be one. Models that only depend on one text byte per
+    key byte have this weight only, others add one weight per bit of another text byte. The
+    correlations can then be computed from sums of traces per text byte value and weight.
+
+    Attributes:
+        text: Texts the leakage depends on, "plaintexts" or "ciphertexts".
+        round_key: Round of the attacked round key.
+        coefs: (num_weights, 256, 256) array of coefficients per guess and text byte value.
+        compute_weights: Function computing the (num_traces, 16, num_weights) weights of the
+            traces from their (num_traces, 16) texts, None if there is only the first weight.
+    """
+    text: str
+    round_key: int
+    coefs: np.ndarray
+    compute_weights: Callable = None
+
+    @property
+    def num_weights(self):
+        return self.coefs.shape[0]
+
+    def weights(self, texts):
+        if self.compute_weights is None:
+            return np.ones(texts.shape + (1,))
+        return self.compute_weights(texts)
+
+
+def sbox_output_hw_model():
+    """ Hamming weight of the S-box output of the first round, HW(Sbox(p ^ k))."""
+    values = np.arange(NUM_BYTE_VALUES)
+    guesses = np.arange(NUM_BYTE_VALUES)[:, np.newaxis]
+    return LeakageModel(text="plaintexts", round_key=0,
+                        coefs=HW_LUT[AES_SBOX[values ^ guesses]][np.newaxis].astype(float))
+
+
+def last_round_hd_model():
+    """ Hamming distance between the state register before and after the last round.
+
+    Key byte j of the last round gives the byte InvSbox(c[j] ^ k[j]) of the state before the last
+    round, which is overwritten by the ciphertext byte c[AES_SHIFT_ROWS[j]]. The Hamming distance
+    HW(a ^ b) = HW(a) + sum_i (1 - 2 * a_i) * b_i is linear in the bits b_i of the ciphertext
+    byte, which are the weights 1 to 8.
+    """
+    values = np.arange(NUM_BYTE_VALUES)
+    guesses = np.arange(NUM_BYTE_VALUES)[:, np.newaxis]
+    states = AES_INV_SBOX[values ^ guesses]
+    bits = np.unpackbits(states[..., np.newaxis], axis=-1, bitorder='little')
+    coefs = np.concatenate([HW_LUT[states][np.newaxis],
+                            (1 - 2 * bits.astype(float)).transpose(2, 0, 1)])
+
+    def compute_weights(texts):
+        bits = np.unpackbits(texts[:, AES_SHIFT_ROWS, np.newaxis], axis=-1, bitorder='little')
+        return np.concatenate([np.ones(texts.shape + (1,)), bits], axis=-1)
+
+    return LeakageModel(text="ciphertexts", round_key=10, coefs=coefs.astype(float),
+                        compute_weights=compute_weights)
+
+
+# Leakage models of the CPA attack.
+LEAKAGE_MODELS = {
+    "sbox_output_hw": sbox_output_hw_model,
+    "last_round_hd": last_round_hd_model,
+}
+
+
+class CpaAccumulator:
+    """ Incremental statistics for the correlations of all key byte guesses.
+
+    Keeps the number of traces, the sums of the traces and of their squares, and for every key
+    byte, text byte value and weight of the leakage model the sum of the weighted traces and the
+    sums of the products of the weights. The sums of the leakages, of their squares and of their
+    products with the traces for all 16 x 256 guesses follow from these with one matrix product
+    per key byte. The memory is independent of the number of traces and the sums of every trace
+    are updated with sparse matrix products instead of per guess.
+    """
+    def __init__(self, model: LeakageModel, num_samples: int):
+        self.model = model
+        num_weights = model.num_weights
+        self.num_traces = 0
+        self.sum_x = np.zeros(num_samples)
+        self.sum_x2 = np.zeros(num_samples)
+        # Sum of weighted traces per key byte, weight and text byte value.
+        self.sums = np.zeros((NUM_KEY_BYTES, num_weights, NUM_BYTE_VALUES, num_samples))
+        # Sum of weight products per key byte, pair of weights and text byte value.
+        self.weight_sums = np.zeros((NUM_KEY_BYTES, num_weights, num_weights, NUM_BYTE_VALUES))
+
+    def update(self, texts, traces):
+        """ Adds a chunk of traces to the statistics.
+
+        Args:
+            texts: (num_traces, 16) array of the plaintexts or ciphertexts of the model.
+            traces: (num_traces, num_samples) array of traces.
+        """
+        texts = np.asarray(texts, dtype=np.uint8)
+        traces = np.asarray(traces, dtype=np.float64)
+        num_traces = len(traces)
+        num_weights = self.model.num_weights
+        weights = self.model.weights(texts)
+        self.num_traces += num_traces
+        self.sum_x += traces.sum(axis=0)
+        self.sum_x2 += (traces ** 2).sum(axis=0)
+        # Row (j * num_weights + k) * 256 + v of the weight matrix holds weight k of the traces
+        # where text byte j is v.
+        byte_offsets = np.arange(NUM_KEY_BYTES) * num_weights * NUM_BYTE_VALUES
+        rows = (byte_offsets[:, np.newaxis] +
+                np.arange(num_weights) * NUM_BYTE_VALUES +
+                texts[:, :, np.newaxis].astype(np.int64))
+        weight_matrix = scipy.sparse.csc_matrix(
+            (weights.ravel(), rows.ravel(),
+             np.arange(0, rows.size + 1, NUM_KEY_BYTES * num_weights)),
+            shape=(NUM_KEY_BYTES * num_weights * NUM_BYTE_VALUES, num_traces))
+        self.sums += (weight_matrix @ traces).reshape(self.sums.shape)
+        # Products of all pairs of weights, summed per key byte and text byte value.
+        rows = (np.arange(NUM_KEY_BYTES) * NUM_BYTE_VALUES + texts.astype(np.int64)).ravel()
+        for k in range(num_weights):
+            for m in range(k, num_weights):
+                sums = np.bincount(rows, weights=(weights[..., k] * weights[..., m]).ravel(),
+                                   minlength=NUM_KEY_BYTES * NUM_BYTE_VALUES)
+                self.weight_sums[:, k, m] += sums.reshape(NUM_KEY_BYTES, NUM_BYTE_VALUES)
+                if m != k:
+                    self.weight_sums[:, m, k] = self.weight_sums[:, k, m]
+
+    def compute_correlations(self):
+        """ Computes the correlations of all key byte guesses.
+
+        Returns:
+            A (16, 256, num_samples) array of the correlation coefficients between the leakage of
+            every guess of every key byte and the traces.
+        """
+        n = self.num_traces
+        coefs = self.model.coefs
+        num_weights = self.model.num_weights
+        # Sums of the leakages, of their squares and of their products with the traces.
+        sum_h = np.einsum('kgv,jkv->jg', coefs, self.weight_sums[:, :, 0])
+        sum_h2 = np.einsum('kgv,mgv,jkmv->jg', coefs, coefs, self.weight_sums, optimize=True)
+        coefs_flat = coefs.transpose(1, 0, 2).reshape(NUM_BYTE_VALUES,
+                                                      num_weights * NUM_BYTE_VALUES)
+        sum_xh = np.stack([coefs_flat @ sums.reshape(num_weights * NUM_BYTE_VALUES, -1)
+                           for sums in self.sums])
+        var_h = n * sum_h2 - sum_h ** 2
+        var_x = n * self.sum_x2 - self.sum_x ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = ((n * sum_xh - sum_h[..., np.newaxis] * self.sum_x) /
+                    np.sqrt(var_h[..., np.newaxis] * var_x))
+        # Constant leakages or samples do not correlate.
+        return np.nan_to_num(corr, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def compute_key_ranks(corr, key_bytes):
+    """ Computes the rank of the correct key bytes.
+
+    Every guess is scored with its maximum absolute correlation over all samples.
+
+    Args:
+        corr: (16, 256, num_samples) array of correlations, see CpaAccumulator.
+        key_bytes: The 16 correct key bytes.
+
+    Returns:
+        A tuple ``(ranks, guesses)`` with the number of guesses scoring higher than the correct
+        key byte and the best guess of every key byte.
+    """
+    scores = np.abs(corr).max(axis=2)
+    correct_scores = scores[np.arange(NUM_KEY_BYTES), np.asarray(key_bytes)]
+    ranks = (scores > correct_scores[:, np.newaxis]).sum(axis=1)
+    return ranks, scores.argmax(axis=1).astype(np.uint8)
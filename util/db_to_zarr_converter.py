@@ -91,8 +91,8 @@ def main(argv=None):
     print(project_in.get_waves(0))
     zarr_group_tile.zeros(
         name="traces",
-        shape=(0, len(project_in.get_waves(0))),
-        chunks=(num_traces, len(project_in.get_waves(0))),
+        shape=(0, project_in.num_samples()),
+        chunks=(num_traces, project_in.num_samples()),
         dtype=np.int16,
         compressor=compressor
     )
@@ -5,6 +5,103 @@
 
 import numpy as np
 
+# Upper bound for the number of trace values processed by a single np.bincount() call. This keeps
+# the temporary index arrays of compute_histograms() at a few tens of MB.
+MAX_CHUNK_VALUES = 2**22
+
+
+def compute_histograms(trace_resolution, traces, groups, chunk_size=None, out=None):
+    """ Building the full histogram tensor in a single vectorized pass.
+
+    Instead of calling np.histogram2d() once per time sample, every trace value is mapped to a
+    flattened index into the [group, sample, value] histogram of each (round, data) pair and all
+    indices are counted with a single np.bincount() call per chunk of traces.
+
+    The value stored in histograms[v][w][x][y][z] shows how many traces have value z at time y,
+    given that groups[v, w, trace] = x. Traces with values outside [0, trace_resolution] and traces
+    with a group index other than 0 or 1 are ignored. Like np.histogram2d(), the value
+    trace_resolution is counted in the last bin.
+
+    Args:
+        trace_resolution: Number of histogram bins, i.e., number of possible trace values.
+        traces: (num_traces, num_samples) array of traces.
+        groups: (num_rnds, num_data, num_traces) array holding the group index of every trace.
+        chunk_size: Number of traces processed at a time. By default, chunks are sized such that
+            they contain up to MAX_CHUNK_VALUES trace values.
+        out: Optional histograms the counts are added to in place, e.g., the histograms of
+            previous traces.
+
+    Returns:
+        The histograms with dimensions [num_rnds, num_data, 2, num_samples, trace_resolution].
+    """
+    num_leakages = 2
+    num_rnds, num_data, num_traces = groups.shape
+    num_samples = traces.shape[1]
+    assert traces.shape[0] == num_traces
+    shape = (num_rnds, num_data, num_leakages, num_samples, trace_resolution)
+    if out is None:
+        histograms = np.zeros(shape, dtype=np.uint32)
+    else:
+        assert out.shape == shape
+        histograms = out
+    if num_traces == 0 or num_samples == 0:
+        return histograms
+
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_VALUES // num_samples)
+
+    group_size = num_samples * trace_resolution
+    hist_size = num_leakages * group_size
+    sample_offsets = np.arange(num_samples, dtype=np.int64) * trace_resolution
+
+    for start in range(0, num_traces, chunk_size):
+        end = min(start + chunk_size, num_traces)
+        values = traces[start:end]
+        is_float = values.dtype.kind == 'f'
+        if is_float:
+            # np.histogram2d() includes the right edge of the last bin, but drops values between
+            # trace_resolution and trace_resolution + 1.
+            values = np.where(values == trace_resolution, trace_resolution - 1, np.floor(values))
+        # Only fix up the values if needed, checking the range is much cheaper.
+        all_values_valid = values.max() < trace_resolution and values.min() >= 0
+        # Flattened [sample, value] index, shared by all rounds and data items.
+        if all_values_valid:
+            index = values.astype(np.int64) + sample_offsets
+        else:
+            if is_float:
+                valid_values = (values >= 0) & (values < trace_resolution)
+                index = np.where(valid_values, values, 0).astype(np.int64)
+            else:
+                index = values.astype(np.int64)
+                # np.histogram2d() includes the right edge of the last bin.
+                index[index == trace_resolution] = trace_resolution - 1
+                valid_values = (index >= 0) & (index < trace_resolution)
+            index += sample_offsets
+        # With a single round and data item, the index can be updated in place.
+        if num_rnds * num_data == 1:
+            group_index = index
+        else:
+            group_index = np.empty_like(index)
+
+        for i_rnd in range(num_rnds):
+            for i_data in range(num_data):
+                group = groups[i_rnd, i_data, start:end].astype(np.int64)
+                valid_groups = (group >= 0) & (group < num_leakages)
+                np.add(index, (group * group_size)[:, np.newaxis], out=group_index)
+                if all_values_valid and np.all(valid_groups):
+                    counts = np.bincount(group_index.ravel(), minlength=hist_size)
+                else:
+                    if all_values_valid:
+                        valid = np.broadcast_to(valid_groups[:, np.newaxis], index.shape)
+                    else:
+                        valid = valid_values & valid_groups[:, np.newaxis]
+                    counts = np.bincount(group_index[valid], minlength=hist_size)
+                np.add(histograms[i_rnd, i_data],
+                       counts.reshape(num_leakages, num_samples, trace_resolution),
+                       out=histograms[i_rnd, i_data], casting='unsafe')
+
+    return histograms
+
 
 def compute_histograms_general(trace_resolution, traces, leakage):
     """ Building histograms for general fixed-vs-random TVLA.
@@ -15,19 +112,8 @@ def compute_histograms_general(trace_resolution, traces, leakage):
     time y, given that trace is in the fixed (x = 1) or random (x = 0) group. The v and w indices
     are not used but we keep them for code compatiblitly with non-general AES TVLA.
     """
-    num_leakages = 2
-    num_rnds = 1
-    num_bytes = 1
-    num_samples = traces.shape[1]
-    histograms = np.zeros((num_rnds, num_bytes, num_leakages, num_samples, trace_resolution),
-                          dtype=np.uint32)
-
-    for i_sample in range(num_samples):
-        histograms[0, 0, :, i_sample, :] = np.histogram2d(
-            leakage, traces[:, i_sample],
-            bins=[range(num_leakages + 1), range(trace_resolution + 1)])[0]
-
-    return histograms
+    return compute_histograms(trace_resolution, traces,
+                              np.asarray(leakage)[np.newaxis, np.newaxis, :])
 
 
 def compute_histograms_aes_byte(trace_resolution, rnd_list, byte_list, traces, leakage):
@@ -38,21 +124,8 @@ def compute_histograms_aes_byte(trace_resolution, rnd_list, byte_list, traces, l
     histograms[v][w][x][y][z] shows how many traces have value z at time y, given that
     HW(state byte w in AES round v) = 0 (fixed set, x = 0) or > 0 (random set, x = 1).
     """
-    num_leakages = 2
-    num_rnds = len(rnd_list)
-    num_bytes = len(byte_list)
-    num_samples = traces.shape[1]
-    histograms = np.zeros((num_rnds, num_bytes, num_leakages, num_samples, trace_resolution),
-                          dtype=np.uint32)
-
-    for i_rnd in range(num_rnds):
-        for i_byte in range(num_bytes):
-            for i_sample in range(num_samples):
-                histograms[i_rnd, i_byte, :, i_sample, :] = np.histogram2d(
-                    leakage[rnd_list[i_rnd], byte_list[i_byte], :], traces[:, i_sample],
-                    bins=[np.append(range(num_leakages), 9), range(trace_resolution + 1)])[0]
-
-    return histograms
+    groups = (np.asarray(leakage)[rnd_list][:, byte_list] > 0).astype(np.uint8)
+    return compute_histograms(trace_resolution, traces, groups)
 
 
 def compute_histograms_aes_bit(trace_resolution, rnd_list, bit_list, traces, leakage):
@@ -63,18 +136,5 @@ def compute_histograms_aes_bit(trace_resolution, rnd_list, bit_list, traces, lea
     The value stored in histograms[v][w][x][y][z] shows how many traces have value z at time y,
     given that selected bit = 0 (fixed set, x = 0) or 1 (random set, x = 1).
     """
-    num_leakages = 2
-    num_rnds = len(rnd_list)
-    num_bits = len(bit_list)
-    num_samples = traces.shape[1]
-    histograms = np.zeros((num_rnds, num_bits, num_leakages, num_samples, trace_resolution),
-                          dtype=np.uint32)
-
-    for i_rnd in range(num_rnds):
-        for i_bit in range(num_bits):
-            for i_sample in range(num_samples):
-                histograms[i_rnd, i_bit, :, i_sample, :] = np.histogram2d(
-                    leakage[rnd_list[i_rnd], bit_list[i_bit], :], traces[:, i_sample],
-                    bins=[range(num_leakages + 1), range(trace_resolution + 1)])[0]
-
-    return histograms
+    return compute_histograms(trace_resolution, traces,
+                              np.asarray(leakage)[rnd_list][:, bit_list])
@@ -27,6 +27,96 @@ def byte2bits(int_no):
     return c
 
 
+# Lookup tables for the vectorized AES leakage models.
+AES_SBOX = np.array([aes_funcs.sbox(x) for x in range(256)], dtype=np.uint8)
+AES_INV_SBOX = np.argsort(AES_SBOX).astype(np.uint8)
+# Multiplication by 2 in GF(2^8).
+AES_XTIME = np.array([((x << 1) ^ (0x1b if x & 0x80 else 0)) & 0xff for x in range(256)],
+                     dtype=np.uint8)
+# Hamming weight of a byte.
+HW_LUT = np.array([bit_count(x) for x in range(256)], dtype=np.uint8)
+# The state is stored column by column, i.e., byte k is in row k % 4 and column k // 4.
+AES_SHIFT_ROWS = np.array([4 * ((k // 4 + k % 4) % 4) + k % 4 for k in range(16)])
+AES_RCON = np.array([0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36], dtype=np.uint8)
+
+
+def aes_key_schedule(keys):
+    """
+    Computes the AES-128 round keys for a matrix of keys.
+
+    keys is an (N, 16) array of keys. The output "subkeys" has dimensions (11, N, 16), i.e.,
+    subkeys[X][Z] is the round key of AES round X for key Z.
+    """
+    keys = np.asarray(keys, dtype=np.uint8)
+    subkeys = np.empty((11,) + keys.shape, dtype=np.uint8)
+    subkeys[0] = keys
+    for j in range(1, 11):
+        # RotWord, SubWord and Rcon applied to the last word of the previous round key.
+        word = AES_SBOX[np.roll(subkeys[j - 1, :, 12:16], -1, axis=1)]
+        word[:, 0] ^= AES_RCON[j - 1]
+        for w in range(4):
+            word = word ^ subkeys[j - 1, :, 4 * w:4 * w + 4]
+            subkeys[j, :, 4 * w:4 * w + 4] = word
+    return subkeys
+
+
+def aes_inverse_key_schedule(last_round_keys):
+    """
+    Computes the AES-128 keys for a matrix of last round keys.
+
+    last_round_keys is an (N, 16) array of round keys of AES round 10. The output has dimensions
+    (N, 16), i.e., it holds the keys that aes_key_schedule() expands to these round keys.
+    """
+    subkeys = np.array(last_round_keys, dtype=np.uint8)
+    for j in range(10, 0, -1):
+        prev_subkeys = np.empty_like(subkeys)
+        for w in range(3, 0, -1):
+            prev_subkeys[:, 4 * w:4 * w + 4] = (subkeys[:, 4 * w:4 * w + 4] ^
+                                                subkeys[:, 4 * w - 4:4 * w])
+        # RotWord, SubWord and Rcon applied to the last word of the previous round key.
+        word = AES_SBOX[np.roll(prev_subkeys[:, 12:16], -1, axis=1)]
+        word[:, 0] ^= AES_RCON[j - 1]
+        prev_subkeys[:, 0:4] = subkeys[:, 0:4] ^ word
+        subkeys = prev_subkeys
+    return subkeys
+
+
+def aes_mix_columns(state):
+    """Applies AES MixColumns to an (N, 16) state matrix."""
+    columns = state.reshape(-1, 4, 4)
+    rotated = np.roll(columns, -1, axis=2)
+    all_xor = np.bitwise_xor.reduce(columns, axis=2, keepdims=True)
+    # b_r = a_r ^ (a_0 ^ a_1 ^ a_2 ^ a_3) ^ xtime(a_r ^ a_(r + 1))
+    return (columns ^ all_xor ^ AES_XTIME[columns ^ rotated]).reshape(state.shape)
+
+
+def compute_aes_states(keys, plaintexts):
+    """
+    Computes the AES-128 state after each round for a matrix of keys and plaintexts.
+
+    The output "states" has dimensions (12, N, 16). states[0] holds the plaintexts and states[X + 1]
+    the state register after AES round X. If all keys are the same, the key schedule is computed
+    only once.
+    """
+    keys = np.asarray(keys, dtype=np.uint8).reshape(-1, 16)
+    plaintexts = np.asarray(plaintexts, dtype=np.uint8).reshape(-1, 16)
+    num_traces = len(plaintexts)
+    if num_traces > 0 and np.all(keys == keys[0]):
+        subkeys = aes_key_schedule(keys[0:1])
+    else:
+        subkeys = aes_key_schedule(keys)
+
+    states = np.empty((12, num_traces, 16), dtype=np.uint8)
+    states[0] = plaintexts
+    states[1] = plaintexts ^ subkeys[0]
+    for j in range(1, 11):
+        state = AES_SBOX[states[j]][:, AES_SHIFT_ROWS]
+        if j < 10:
+            state = aes_mix_columns(state)
+        states[j + 1] = state ^ subkeys[j]
+    return states
+
+
 def compute_leakage_aes_byte(keys, plaintexts, leakage_model = 'HAMMING_WEIGHT'):
     """
     Computes byte-based AES leakage for a given list of plaintexts and keys.
@@ -38,56 +128,12 @@ def compute_leakage_aes_byte(keys, plaintexts, leakage_model = 'HAMMING_WEIGHT')
         HAMMING_WEIGHT - based on the hamming weight of the state register byte.
         HAMMING_DISTANCE - based on the hamming distance between the current and previous state.
     """
-    num_traces = len(keys)
-    leakage = np.zeros((11, 16, num_traces), dtype=np.uint8)
-
-    # Checks if all keys in the list are the same.
-    key_fixed = np.all(keys == keys[0])
-    subkey = np.zeros((11, 16))
-
-    if key_fixed:
-        for j in range(11):
-            subkey[j] = np.asarray(
-                aes_funcs.key_schedule_rounds(keys[0], 0, j))
-        subkey = subkey.astype(int)
-
-    for i in range(num_traces):
-
-        if not key_fixed:
-            for j in range(11):
-                subkey[j] = np.asarray(
-                    aes_funcs.key_schedule_rounds(keys[i], 0, j))
-            subkey = subkey.astype(int)
-
-        # Init
-        state = plaintexts[i]
-
-        # Round 0
-        old_state = state
-        state = np.bitwise_xor(state, subkey[0])
-        for k in range(16):
-            if leakage_model == 'HAMMING_DISTANCE':
-                leakage[0][k][i] = bit_count(
-                    np.bitwise_xor(state[k], old_state[k]))
-            else:
-                leakage[0][k][i] = bit_count(state[k])
-
-        # Round 1 - 10
-        for j in range(1, 11):
-            old_state = state
-            state = aes_funcs.subbytes(state)
-            state = aes_funcs.shiftrows(state)
-            if (j < 10):
-                state = aes_funcs.mixcolumns(state)
-            state = np.bitwise_xor(state, subkey[j])
-            for k in range(16):
-                if leakage_model == 'HAMMING_DISTANCE':
-                    leakage[j][k][i] = bit_count(
-                        np.bitwise_xor(state[k], old_state[k]))
-                else:
-                    leakage[j][k][i] = bit_count(state[k])
-
-    return leakage
+    states = compute_aes_states(keys, plaintexts)
+    if leakage_model == 'HAMMING_DISTANCE':
+        values = states[1:] ^ states[:-1]
+    else:
+        values = states[1:]
+    return HW_LUT[values.transpose(0, 2, 1)]
 
 
 def compute_leakage_aes_bit(keys, plaintexts, leakage_model = 'HAMMING_WEIGHT'):
@@ -101,57 +147,36 @@ def compute_leakage_aes_bit(keys, plaintexts, leakage_model = 'HAMMING_WEIGHT'):
         HAMMING_WEIGHT - based on the value of the state register bit.
         HAMMING_DISTANCE - based on the XOR between the current and previous bit value.
     """
-    num_traces = len(keys)
-    leakage = np.zeros((11, 128, num_traces), dtype=np.uint8)
-
-    # Checks if all keys in the list are the same.
-    key_fixed = np.all(keys == keys[0])
-    subkey = np.zeros((11, 16))
-
-    if key_fixed:
-        for j in range(11):
-            subkey[j] = np.asarray(
-                aes_funcs.key_schedule_rounds(keys[0], 0, j))
-        subkey = subkey.astype(int)
-
-    for i in range(num_traces):
-
-        if not key_fixed:
-            for j in range(11):
-                subkey[j] = np.asarray(
-                    aes_funcs.key_schedule_rounds(keys[i], 0, j))
-            subkey = subkey.astype(int)
-
-        # Init
-        state = plaintexts[i]
-
-        # Round 0
-        old_state = state
-        state = np.bitwise_xor(state, subkey[0])
-        for k in range(16):
-            if leakage_model == 'HAMMING_DISTANCE':
-                vec8 = byte2bits(
-                    np.bitwise_xor(state[k], old_state[k]))
-            else:
-                vec8 = byte2bits(state[k])
-            leakage[0][8 * k: 8 * k + 8, i] = vec8
-
-        # Round 1 - 10
-        for j in range(1, 11):
-            old_state = state
-            state = aes_funcs.subbytes(state)
-            state = aes_funcs.shiftrows(state)
-            if (j < 10):
-                state = aes_funcs.mixcolumns(state)
-            state = np.bitwise_xor(state, subkey[j])
-            for k in range(16):
-                if leakage_model == 'HAMMING_DISTANCE':
-                    vec8 = byte2bits(np.bitwise_xor(state[k], old_state[k]))
-                else:
-                    vec8 = byte2bits(state[k])
-                leakage[j][8 * k: 8 * k + 8, i] = vec8
-
-    return leakage
+    states = compute_aes_states(keys, plaintexts)
+    if leakage_model == 'HAMMING_DISTANCE':
+        values = states[1:] ^ states[:-1]
+    else:
+        values = states[1:]
+    # Bit Y of the state is bit Y % 8 of byte Y // 8, starting with the LSB.
+    bits = np.unpackbits(values, axis=2, bitorder='little')
+    return np.ascontiguousarray(bits.transpose(0, 2, 1))
+
+
+def as_row_matrix(dataset):
+    """Converts a list of entries (keys or plaintexts) into an (N, len) matrix."""
+    dataset = np.asarray(dataset)
+    return dataset.reshape(len(dataset), -1)
+
+
+def hash_rows(dataset):
+    """Computes a 64-bit hash of every entry of an (N, len) matrix."""
+    dataset = np.ascontiguousarray(dataset)
+    num_bytes = dataset.shape[1] * dataset.dtype.itemsize
+    # Pad the entries to a multiple of 8 bytes to process them in 64-bit words.
+    padded = np.zeros((len(dataset), -(-num_bytes // 8) * 8), dtype=np.uint8)
+    padded[:, :num_bytes] = dataset.view(np.uint8).reshape(len(dataset), num_bytes)
+    words = padded.view(np.uint64)
+    hashes = np.full(len(dataset), num_bytes, dtype=np.uint64)
+    for i_word in range(words.shape[1]):
+        hashes ^= words[:, i_word]
+        hashes *= np.uint64(0x9e3779b97f4a7c15)
+        hashes ^= hashes >> np.uint64(29)
+    return hashes
 
 
 def find_fixed_entry(dataset):
@@ -163,19 +188,19 @@ def find_fixed_entry(dataset):
     This function looks at the input list and finds the first entry that
     is repeated multiple times.
     """
-
-    for i_entry in range(len(dataset)):
+    dataset = as_row_matrix(dataset)
+    # Entries with the same hash are candidates, hash collisions are ruled out by comparing the
+    # actual entries.
+    hashes = hash_rows(dataset)
+    sorted_hashes = np.sort(hashes)
+    repeated_hashes = np.unique(sorted_hashes[1:][sorted_hashes[1:] == sorted_hashes[:-1]])
+    for i_entry in np.flatnonzero(np.isin(hashes, repeated_hashes)):
         fixed_entry = dataset[i_entry]
-        num_hits = 0
-        for i in range(len(dataset)):
-            num_hits += np.array_equal(fixed_entry, dataset[i])
-        if num_hits > 1:
-            break
+        if np.count_nonzero(np.all(dataset == fixed_entry, axis=1)) > 1:
+            return fixed_entry
 
     # If no entry repeats, then the fixed entry cannot be identified.
-    assert num_hits > 1, "Cannot identify fixed entry. Try using a longer list."
-
-    return fixed_entry
+    assert False, "Cannot identify fixed entry. Try using a longer list."
 
 
 def compute_leakage_general(dataset, fixed_entry):
@@ -187,9 +212,9 @@ def compute_leakage_general(dataset, fixed_entry):
         leakage[i] = 1 - trace i belonges to the fixed group
         leakage[i] = 0 - trace i belonges to the random group
     """
+    dataset = as_row_matrix(dataset)
+    fixed_entry = np.asarray(fixed_entry).reshape(-1)
+    if dataset.shape[1] != len(fixed_entry):
+        return np.zeros((len(dataset)), dtype=np.uint8)
 
-    leakage = np.zeros((len(dataset)), dtype=np.uint8)
-    for i in range(len(dataset)):
-        leakage[i] = np.array_equal(fixed_entry, dataset[i])
-
-    return leakage
+    return np.all(dataset == fixed_entry, axis=1).astype(np.uint8)
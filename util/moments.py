@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+from math import comb
+
+import numpy as np
+
+from util.ttest import ttest_moments
+
+# Upper bound for the number of trace values processed at a time by MomentAccumulator.update().
+MAX_CHUNK_VALUES = 2**22
+
+
+def merge_moments(n_a, mean_a, m_a, n_b, mean_b, m_b):
+    """
+    Merges two sets of central moment sums.
+
+    This uses Eq. 2.1 in "Formulas for Robust, One-Pass Parallel Computation of Covariances and
+    Arbitrary-Order Statistical Moments" by P. Pébay (https://www.osti.gov/servlets/purl/1028931),
+    which is numerically stable for arbitrary orders.
+
+    n_a and n_b hold the number of observations and must be broadcastable to mean_a and mean_b.
+    m_a and m_b hold the central moment sums of orders 2, ..., p along axis -2, i.e., m_a[..., i, :]
+    is sum((x - mean_a)**(i + 2)).
+
+    Returns the number of observations, the means and the central moment sums of the union.
+    """
+    n_a = np.asarray(n_a, dtype=np.float64)
+    n_b = np.asarray(n_b, dtype=np.float64)
+    n = n_a + n_b
+    # Avoid divisions by zero, empty sets are handled at the end.
+    n_a_safe = np.where(n_a > 0, n_a, 1)
+    n_b_safe = np.where(n_b > 0, n_b, 1)
+    n_safe = np.where(n > 0, n, 1)
+
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n_safe
+
+    max_moment = m_a.shape[-2] + 1
+    m = np.empty(np.broadcast_shapes(m_a.shape, m_b.shape))
+    for p in range(2, max_moment + 1):
+        m_p = m_a[..., p - 2, :] + m_b[..., p - 2, :]
+        for k in range(1, p - 1):
+            m_p += comb(p, k) * delta**k * ((-n_b / n_safe)**k * m_a[..., p - k - 2, :] +
+                                            (n_a / n_safe)**k * m_b[..., p - k - 2, :])
+        m_p += (n_a * n_b / n_safe * delta)**p * (1 / n_b_safe**(p - 1) -
+                                                  (-1 / n_a_safe)**(p - 1))
+        m[..., p - 2, :] = m_p
+
+    # If one of the sets is empty, the union is simply the other set.
+    empty_a = (n_a == 0)
+    empty_b = (n_b == 0) & ~empty_a
+    mean = np.where(empty_a, mean_b, np.where(empty_b, mean_a, mean))
+    m = np.where(empty_a[..., np.newaxis, :], m_b,
+                 np.where(empty_b[..., np.newaxis, :], m_a, m))
+    return n, mean, m
+
+
+class MomentAccumulator:
+    """ Running central moments for fixed-vs-random TVLA.
+
+    Instead of histograms with one bin per possible trace value, this class keeps the number of
+    traces, the mean and the central moment sums of orders 2, ..., 2 * num_orders for every round,
+    byte/bit, set and time sample. The memory consumption is thus proportional to the number of
+    samples times the number of orders and independent of the trace resolution.
+
+    Traces are added in batches. Every batch is first reduced to per-set central moments using
+    matrix products and then merged into the running moments with merge_moments().
+    """
+    def __init__(self, num_rnds, num_data, num_samples, num_orders):
+        self.num_orders = num_orders
+        self.max_moment = 2 * num_orders
+        num_leakages = 2
+        self.counts = np.zeros((num_rnds, num_data, num_leakages))
+        self.means = np.zeros((num_rnds, num_data, num_leakages, num_samples))
+        self.moments = np.zeros((num_rnds, num_data, num_leakages, self.max_moment - 1,
+                                 num_samples))
+
+    def update(self, traces, groups, chunk_size=None):
+        """ Adds a batch of traces.
+
+        Args:
+            traces: (num_traces, num_samples) array of traces.
+            groups: (num_rnds, num_data, num_traces) array holding the set of every trace, 0 for
+                the fixed set and 1 for the random set. Traces with other values are ignored.
+            chunk_size: Number of traces processed at a time.
+        """
+        num_rnds, num_data, num_leakages, num_samples = self.means.shape
+        num_traces = traces.shape[0]
+        assert groups.shape == (num_rnds, num_data, num_traces)
+        assert traces.shape[1] == num_samples
+        if chunk_size is None:
+            chunk_size = max(1, MAX_CHUNK_VALUES // max(1, num_samples))
+
+        for start in range(0, num_traces, chunk_size):
+            end = min(start + chunk_size, num_traces)
+            x = traces[start:end].astype(np.float64)
+            # Shift the values to make the power sums below numerically well-behaved.
+            shift = x.mean(axis=0)
+            x -= shift
+            # One row per round, data item and set selecting the corresponding traces.
+            group = groups[:, :, start:end].reshape(num_rnds * num_data, end - start)
+            masks = np.stack([group == i for i in range(num_leakages)], axis=1)
+            masks = masks.reshape(num_rnds * num_data * num_leakages, end - start)
+            masks = masks.astype(np.float64)
+            counts = masks.sum(axis=1)[:, np.newaxis]
+
+            # Raw power sums of the shifted values for all sets using matrix products.
+            power_sums = np.empty((self.max_moment, masks.shape[0], num_samples))
+            x_pow = x.copy()
+            for p in range(self.max_moment):
+                power_sums[p] = masks @ x_pow
+                x_pow *= x
+
+            # Convert to central moment sums around the means of the sets.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                offset = np.where(counts > 0, power_sums[0] / counts, 0)
+            moments = np.empty((masks.shape[0], self.max_moment - 1, num_samples))
+            for p in range(2, self.max_moment + 1):
+                m_p = (-offset)**p * counts
+                for k in range(1, p + 1):
+                    m_p = m_p + comb(p, k) * power_sums[k - 1] * (-offset)**(p - k)
+                moments[:, p - 2, :] = m_p
+
+            self.add_moments(counts.reshape(num_rnds, num_data, num_leakages),
+                             (shift + offset).reshape(self.means.shape),
+                             moments.reshape(self.moments.shape))
+
+    def add_moments(self, counts, means, moments):
+        """ Merges a set of counts, means and central moment sums into the running moments."""
+        self.counts, self.means, self.moments = merge_moments(
+            self.counts[..., np.newaxis], self.means, self.moments,
+            counts[..., np.newaxis], means, moments)
+        self.counts = self.counts[..., 0]
+
+    def merge(self, other):
+        """ Merges the running moments of another MomentAccumulator into this one."""
+        assert self.moments.shape == other.moments.shape
+        self.add_moments(other.counts, other.means, other.moments)
+
+    def ttest(self):
+        """ Computes Welch's t-test for orders 1, ..., num_orders.
+
+        Returns:
+            The t-test statistics with dimensions [num_orders, num_rnds, num_data, num_samples].
+            If any of the sets of a round and byte/bit is empty, the statistics are NaN.
+        """
+        n = self.counts[..., np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            central_moments = self.moments / n[..., np.newaxis]
+        ttest_trace = ttest_moments(n[:, :, 0], self.means[:, :, 0], central_moments[:, :, 0],
+                                    n[:, :, 1], self.means[:, :, 1], central_moments[:, :, 1],
+                                    self.num_orders)
+        empty = np.any(self.counts == 0, axis=2)
+        ttest_trace[:, empty] = np.nan
+        return ttest_trace
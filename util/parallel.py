@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from joblib import Parallel, delayed
+
+# A set of functions for running numpy computations in parallel on shared arrays.
+# joblib pickles the arguments and results of every job. Instead, large arrays are placed in
+# memory-mapped scratch files, which joblib passes to the workers by reference. The workers read
+# their inputs in place and write their results directly into preallocated output arrays.
+
+
+class ScratchSpace:
+    """ Temporary directory holding memory-mapped arrays shared with worker processes.
+
+    The directory is deleted when the scratch space is garbage collected, arrays still mapped into
+    memory stay valid. The scratch files are created in the default temporary directory, set
+    TMPDIR, e.g., to /dev/shm, to keep them in memory.
+    """
+    def __init__(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="ot-sca-")
+        self.num_arrays = 0
+
+    def zeros(self, shape, dtype) -> np.memmap:
+        """ Create a shared array initialized with zeros."""
+        path = Path(self.dir.name) / f"array_{self.num_arrays}.mmap"
+        self.num_arrays += 1
+        if int(np.prod(shape)) == 0:
+            # Empty files can't be memory-mapped.
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+    def copy(self, array) -> np.memmap:
+        """ Create a shared copy of an array, shared arrays are returned as is."""
+        if isinstance(array, np.memmap):
+            return array
+        shared = self.zeros(array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def release(self, array):
+        """ Delete the scratch file of a shared array of this scratch space.
+
+        The array stays valid until it is unmapped, which frees the space of the file. Arrays that
+        are not backed by a file in this scratch space are ignored.
+        """
+        if isinstance(array, np.memmap) and array.filename is not None:
+            path = Path(array.filename)
+            if path.parent == Path(self.dir.name).resolve():
+                path.unlink(missing_ok=True)
+
+
+def split_range(num_items, num_jobs, chunk_size=None):
+    """ Split range(num_items) into chunks of chunk_size items.
+
+    By default, every job gets a single, equally sized chunk.
+
+    Returns:
+        List of (start, end) tuples.
+    """
+    if chunk_size is None:
+        chunk_size = -(-num_items // max(1, num_jobs))
+    chunk_size = max(1, chunk_size)
+    return [(start, min(start + chunk_size, num_items))
+            for start in range(0, num_items, chunk_size)]
+
+
+def run_parallel(fnc, tasks, num_jobs):
+    """ Call fnc(*task) for all tasks using num_jobs processes.
+
+    With a single job, the tasks are run in this process and no arrays need to be shared.
+    """
+    if num_jobs == 1:
+        for task in tasks:
+            fnc(*task)
+    else:
+        Parallel(n_jobs=num_jobs)(delayed(fnc)(*task) for task in tasks)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import dataclasses
+import logging
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.signal
+from joblib import Parallel, delayed
+
+from util import ceca_stats, trace_alignment
+
+logger = logging.getLogger()
+
+
+@dataclass
+class TraceChunk:
+    """ A chunk of consecutive traces with one row per trace in every array.
+    """
+    waves: np.ndarray
+    plaintexts: np.ndarray
+    ciphertexts: np.ndarray
+    keys: np.ndarray
+
+    def select(self, traces_to_use):
+        """ Returns a chunk holding only the selected traces."""
+        return TraceChunk(waves=self.waves[traces_to_use],
+                          plaintexts=self.plaintexts[traces_to_use],
+                          ciphertexts=self.ciphertexts[traces_to_use],
+                          keys=self.keys[traces_to_use])
+
+    def replace_waves(self, waves):
+        """ Returns a chunk with the same texts and keys but new waves."""
+        return dataclasses.replace(self, waves=waves)
+
+
+class Stage:
+    """ Base class of the preprocessing stages.
+
+    A stage transforms a chunk of traces into a new chunk. It may drop traces or change the
+    number of samples, all parameters refer to the samples at the input of the stage. Stages are
+    copied to the worker processes, so any state must be set in prepare(), which is called with the
+    first chunk before the pipeline is run and must give the same state when called again.
+
+    Stages that need statistics of all their input traces set needs_fit. Before the pipeline is
+    run, fit() is called with every chunk of input traces of the stage in a separate pass.
+    """
+    needs_fit = False
+
+    def fit(self, chunk: TraceChunk) -> None:
+        pass
+
+    def prepare(self, chunk: TraceChunk) -> None:
+        pass
+
+    def __call__(self, chunk: TraceChunk) -> TraceChunk:
+        raise NotImplementedError
+
+
+class SigmaFilter(Stage):
+    """ Drops traces with samples over the tolerable deviation from the mean of all traces.
+
+    The mean and the standard deviation of every sample are merged over all chunks in the fit
+    pass, such that the filtered traces do not depend on the chunk size.
+    """
+    needs_fit = True
+
+    def __init__(self, num_sigmas: float):
+        self.num_sigmas = num_sigmas
+        self.stats = (0, 0, 0)
+        self.min_trace = None
+        self.max_trace = None
+
+    def fit(self, chunk):
+        self.stats = ceca_stats.merge_stats(self.stats, ceca_stats.compute_stats(chunk.waves))
+
+    def prepare(self, chunk):
+        cnt, sum_, sum_dev_prods = self.stats
+        assert cnt > 0, "The sigma filter must be fitted before it is used."
+        mean = sum_ / cnt
+        std = np.sqrt(sum_dev_prods / cnt)
+        self.max_trace = mean + self.num_sigmas * std
+        self.min_trace = mean - self.num_sigmas * std
+
+    def __call__(self, chunk):
+        return chunk.select(np.all((chunk.waves >= self.min_trace) &
+                                   (chunk.waves <= self.max_trace), axis=1))
+
+
+class Align(Stage):
+    """ Aligns the traces to a reference trace, see trace_alignment.align_traces_sad().
+
+    The reference trace is the mean of the traces 1 to num_traces_mean - 1 of the first chunk.
+    """
+    def __init__(self, low_window: int, high_window: int, max_shift: int,
+                 num_traces_mean: int = 100):
+        self.low_window = low_window
+        self.high_window = high_window
+        self.max_shift = max_shift
+        self.num_traces_mean = num_traces_mean
+        self.ref_trace = None
+
+    def prepare(self, chunk):
+        self.ref_trace = chunk.waves[1:self.num_traces_mean].mean(axis=0).astype(
+            chunk.waves.dtype)
+
+    def __call__(self, chunk):
+        waves, traces_to_use = trace_alignment.align_traces_sad(
+            chunk.waves, self.ref_trace, self.low_window, self.high_window, self.max_shift)
+        return chunk.select(traces_to_use).replace_waves(waves)
+
+
+class ElasticAlign(Stage):
+    """ Aligns the traces elastically to a reference trace with banded DTW, see
+    trace_alignment.align_traces_dtw().
+
+    Every trace is resampled to the samples of the reference trace, which is the mean of the traces
+    1 to num_traces_mean - 1 of the first chunk.
+    """
+    def __init__(self, radius: int, num_traces_mean: int = 100, batch_size: int = None):
+        self.radius = radius
+        self.num_traces_mean = num_traces_mean
+        self.batch_size = batch_size
+        self.ref_trace = None
+
+    def prepare(self, chunk):
+        self.ref_trace = chunk.waves[1:self.num_traces_mean].mean(axis=0)
+
+    def __call__(self, chunk):
+        return chunk.replace_waves(trace_alignment.align_traces_dtw(
+            chunk.waves, self.ref_trace, self.radius, self.batch_size))
+
+
+class ButterworthFilter(Stage):
+    """ Zero-phase Butterworth filter along the samples of every trace.
+
+    The cutoff frequency is relative to the Nyquist frequency, i.e., half the sampling rate.
+    """
+    def __init__(self, btype: str, cutoff: float, order: int = 4):
+        self.sos = scipy.signal.butter(order, cutoff, btype=btype, output="sos")
+
+    def __call__(self, chunk):
+        return chunk.replace_waves(scipy.signal.sosfiltfilt(self.sos, chunk.waves, axis=1))
+
+
+class LowPass(ButterworthFilter):
+    def __init__(self, cutoff: float, order: int = 4):
+        super().__init__("lowpass", cutoff, order)
+
+
+class HighPass(ButterworthFilter):
+    def __init__(self, cutoff: float, order: int = 4):
+        super().__init__("highpass", cutoff, order)
+
+
+class Decimate(Stage):
+    """ Keeps every factor-th sample, starting at sample offset.
+    """
+    def __init__(self, factor: int, offset: int = 0):
+        self.factor = factor
+        self.offset = offset
+
+    def __call__(self, chunk):
+        return chunk.replace_waves(chunk.waves[:, self.offset::self.factor])
+
+
+class Average(Stage):
+    """ Replaces every group of factor consecutive samples by its mean.
+
+    Remaining samples at the end of the traces are dropped.
+    """
+    def __init__(self, factor: int):
+        self.factor = factor
+
+    def __call__(self, chunk):
+        num_groups = chunk.waves.shape[1] // self.factor
+        waves = chunk.waves[:, :num_groups * self.factor]
+        return chunk.replace_waves(
+            waves.reshape(len(waves), num_groups, self.factor).mean(axis=2))
+
+
+class Window(Stage):
+    """ Keeps the samples from start to end, exclusive.
+    """
+    def __init__(self, start: int = 0, end: int = None):
+        self.start = start
+        self.end = end
+
+    def __call__(self, chunk):
+        return chunk.replace_waves(chunk.waves[:, self.start:self.end])
+
+
+class Absolute(Stage):
+    """ Absolute value of the samples minus an offset, e.g., after high-pass filtering.
+    """
+    def __init__(self, offset: float = 0):
+        self.offset = offset
+
+    def __call__(self, chunk):
+        return chunk.replace_waves(np.abs(chunk.waves - self.offset))
+
+
+class Integrate(Stage):
+    """ Sums up every window of consecutive samples.
+
+    Sample j of the output is the sum of the samples j to j + window - 1 of the input, i.e., the
+    output has window - 1 samples less than the input.
+    """
+    def __init__(self, window: int):
+        self.window = window
+
+    def __call__(self, chunk):
+        cumsum = np.cumsum(chunk.waves, axis=1, dtype=np.float64)
+        cumsum = np.concatenate([np.zeros((len(cumsum), 1)), cumsum], axis=1)
+        return chunk.replace_waves(cumsum[:, self.window:] - cumsum[:, :-self.window])
+
+
+# Stage types of the pipeline configuration.
+STAGE_TYPES = {
+    "sigma_filter": SigmaFilter,
+    "align": Align,
+    "elastic_align": ElasticAlign,
+    "lowpass": LowPass,
+    "highpass": HighPass,
+    "decimate": Decimate,
+    "average": Average,
+    "window": Window,
+    "abs": Absolute,
+    "integrate": Integrate,
+}
+
+
+def create_stage(stage_cfg: dict):
+    """ Creates a stage from its configuration.
+
+    Args:
+        stage_cfg: Dictionary with the type of the stage, an optional name and the parameters of
+            the stage.
+
+    Returns:
+        A tuple with the name and the stage.
+    """
+    params = dict(stage_cfg)
+    stage_type = params.pop("type", None)
+    if stage_type not in STAGE_TYPES:
+        raise RuntimeError(f"Unsupported preprocessing stage: {stage_type}. Supported stages: "
+                           f"{list(STAGE_TYPES)}")
+    name = params.pop("name", stage_type)
+    return name, STAGE_TYPES[stage_type](**params)
+
+
+def to_dtype(waves, dtype):
+    """ Converts waves to dtype, rounding and clipping them to the range of integer types."""
+    dtype = np.dtype(dtype)
+    if waves.dtype == dtype:
+        return waves
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        waves = np.clip(np.rint(waves), info.min, info.max)
+    return waves.astype(dtype)
+
+
+@dataclass
+class StageStats:
+    """ Number of input and output traces and processing time of a stage.
+    """
+    traces_in: int = 0
+    traces_out: int = 0
+    seconds: float = 0.0
+
+    def add(self, other):
+        self.traces_in += other.traces_in
+        self.traces_out += other.traces_out
+        self.seconds += other.seconds
+
+
+class Pipeline:
+    """ A pipeline of preprocessing stages streaming over chunks of traces.
+
+    Every chunk of traces is read once from the input project, processed by all stages and
+    written to the output project with a single bulk write. Stages that need statistics of all
+    their input traces are fitted in an additional pass over the traces each. Chunks are processed
+    in parallel by num_jobs processes. The number of traces and the processing time of every stage
+    are accumulated such that the throughput of every stage can be reported.
+    """
+    def __init__(self, stage_cfgs: list):
+        self.stages = [create_stage(stage_cfg) for stage_cfg in stage_cfgs]
+        names = [name for name, _ in self.stages]
+        assert len(set(names)) == len(names), "The names of the stages must be unique."
+        self.stats = {"read": StageStats()}
+        for name, stage in self.stages:
+            if stage.needs_fit:
+                self.stats[f"{name} (fit)"] = StageStats()
+            self.stats[name] = StageStats()
+        self.stats["write"] = StageStats()
+
+    def process(self, chunk: TraceChunk, prepare: bool = False, num_stages: int = None):
+        """ Runs the stages on a chunk of traces.
+
+        Args:
+            chunk: The chunk of traces.
+            prepare: Prepare every stage with its input before running it.
+            num_stages: Only run the first num_stages stages, by default all stages are run.
+
+        Returns:
+            The processed chunk and the statistics of the stages.
+        """
+        stats = {}
+        for name, stage in self.stages[:num_stages]:
+            start = time.perf_counter()
+            if prepare:
+                stage.prepare(chunk)
+            traces_in = len(chunk.waves)
+            chunk = stage(chunk)
+            stats[name] = StageStats(traces_in, len(chunk.waves), time.perf_counter() - start)
+        return chunk, stats
+
+    def run(self, project_in, project_out, chunk_size: int, num_jobs: int = 1,
+            wave_dtype=None, num_traces: int = None) -> int:
+        """ Runs the pipeline on the traces of a project.
+
+        Args:
+            project_in: The input project.
+            project_out: The output project.
+            chunk_size: Number of traces per chunk.
+            num_jobs: Number of processes.
+            wave_dtype: Type of the output waves, by default the type of the input waves.
+            num_traces: Number of input traces, by default all traces of the input project.
+
+        Returns:
+            The number of output traces.
+        """
+        if num_traces is None:
+            num_traces = project_in.num_traces()
+        if wave_dtype is None:
+            wave_dtype = project_in.dtype()
+
+        def read(start):
+            begin = time.perf_counter()
+            end = min(start + chunk_size, num_traces)
+            chunk = TraceChunk(waves=project_in.get_waves_array(start, end),
+                               plaintexts=project_in.get_plaintexts_array(start, end),
+                               ciphertexts=project_in.get_ciphertexts_array(start, end),
+                               keys=project_in.get_keys_array(start, end))
+            self.stats["read"].add(StageStats(len(chunk.waves), len(chunk.waves),
+                                              time.perf_counter() - begin))
+            return chunk
+
+        def write(chunk, stats):
+            for name, stage_stats in stats.items():
+                self.stats[name].add(stage_stats)
+            begin = time.perf_counter()
+            project_out.append_traces(to_dtype(chunk.waves, wave_dtype), chunk.plaintexts,
+                                      chunk.ciphertexts, chunk.keys)
+            self.stats["write"].add(StageStats(len(chunk.waves), len(chunk.waves),
+                                               time.perf_counter() - begin))
+            return len(chunk.waves)
+
+        def process_chunks(parallel, num_stages=None):
+            # The stages are prepared with the first chunk before the remaining chunks are
+            # distributed to the processes.
+            yield self.process(read(chunk_starts[0]), prepare=True, num_stages=num_stages)
+            for i in range(1, len(chunk_starts), num_jobs):
+                chunks = [read(start) for start in chunk_starts[i:i + num_jobs]]
+                yield from parallel(delayed(self.process)(chunk, num_stages=num_stages)
+                                    for chunk in chunks)
+
+        num_traces_out = 0
+        chunk_starts = list(range(0, num_traces, chunk_size))
+        if not chunk_starts:
+            return num_traces_out
+        with Parallel(n_jobs=num_jobs) as parallel:
+            # Fit the stages in order, such that the preceding stages are fitted when their
+            # outputs are used to fit a stage.
+            for k, (name, stage) in enumerate(self.stages):
+                if not stage.needs_fit:
+                    continue
+                begin = time.perf_counter()
+                traces_fit = 0
+                for chunk, _ in process_chunks(parallel, num_stages=k):
+                    stage.fit(chunk)
+                    traces_fit += len(chunk.waves)
+                self.stats[f"{name} (fit)"].add(StageStats(traces_fit, traces_fit,
+                                                           time.perf_counter() - begin))
+            for chunk, stats in process_chunks(parallel):
+                num_traces_out += write(chunk, stats)
+        return num_traces_out
+
+    def report(self):
+        """ Logs the number of traces and the throughput of every stage."""
+        for name, stats in self.stats.items():
+            throughput = stats.traces_in / stats.seconds if stats.seconds > 0 else float("inf")
+            logger.info(f"{name}: {stats.traces_in} -> {stats.traces_out} traces in "
+                        f"{stats.seconds:.2f}s ({throughput:.0f} traces/s)")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import scipy.signal
+
+
+def design_highpass(num_taps: int, cutoff: float):
+    """ Designs a linear-phase FIR high-pass filter.
+
+    Args:
+        num_taps: Number of taps, must be odd.
+        cutoff: Cutoff frequency relative to the Nyquist frequency, i.e., half the sampling rate.
+
+    Returns:
+        The taps of the filter.
+    """
+    if num_taps % 2 == 0:
+        raise ValueError("The number of taps of the high-pass filter must be odd.")
+    return scipy.signal.firwin(num_taps, cutoff, pass_zero="highpass")
+
+
+def compute_envelope(wave, start: int, end: int, taps, window: int):
+    """ Computing the envelope of samples start to end of a long wave.
+
+    The envelope is the moving average over window samples of the absolute value of the wave
+    after high-pass filtering. Both the filter and the moving average are centered on every
+    sample. Only the samples start to end of the wave plus the overlap needed for the filter and
+    the moving average are read and converted (overlap-save), such that the envelope of a long wave
+    can be computed in chunks with the same result as for the whole wave. The wave is extended by
+    repeating its first and last sample at the ends.
+
+    Args:
+        wave: The wave, e.g., a memory-mapped array.
+        start: First sample of the envelope.
+        end: End of the envelope, exclusive.
+        taps: The taps of the linear-phase filter, see design_highpass().
+        window: Number of samples of the moving average.
+
+    Returns:
+        The envelope of the samples start to end.
+    """
+    half_taps = len(taps) // 2
+    left = half_taps + window // 2
+    right = half_taps + (window - 1) // 2
+    read_start = max(start - left, 0)
+    read_end = min(end + right, len(wave))
+    samples = np.asarray(wave[read_start:read_end], dtype=np.float64)
+    samples = np.pad(samples, (read_start - (start - left), end + right - read_end), mode="edge")
+    filtered = np.abs(scipy.signal.fftconvolve(samples, taps, mode="valid"))
+    cumsum = np.concatenate([[0], np.cumsum(filtered)])
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def find_boundaries(wave, taps, window: int, min_distance: int, chunk_samples: int):
+    """ Finding the boundaries between the iterations of a long wave.
+
+    The boundaries are the local minima of the envelope, see compute_envelope(), where minima that
+    are less than min_distance samples apart are merged by keeping the lower one. The envelope is
+    computed and searched in chunks of chunk_samples samples, such that only a chunk of the
+    filtered wave is held in memory at a time. Up to floating-point rounding, the boundaries do not
+    depend on the chunk size.
+
+    Args:
+        wave: The wave, e.g., a memory-mapped array.
+        taps: The taps of the high-pass filter, see design_highpass().
+        window: Number of samples of the moving average.
+        min_distance: Minimum number of samples between two boundaries.
+        chunk_samples: Number of samples processed at a time.
+
+    Yields:
+        The sample indices of the boundaries in increasing order.
+    """
+    last = None
+    last_value = None
+    num_samples = len(wave)
+    for start in range(0, num_samples, chunk_samples):
+        end = min(start + chunk_samples, num_samples)
+        # One additional envelope sample on both sides to compare the samples at the edges of
+        # the chunk with their neighbours.
+        envelope = compute_envelope(wave, start - 1, end + 1, taps, window)
+        candidates = np.flatnonzero((envelope[1:-1] < envelope[:-2]) &
+                                    (envelope[1:-1] <= envelope[2:]))
+        for candidate, value in zip(candidates + start, envelope[candidates + 1]):
+            if last is not None and candidate - last < min_distance:
+                if value < last_value:
+                    last, last_value = candidate, value
+                continue
+            if last is not None:
+                yield last
+            last, last_value = candidate, value
+    if last is not None:
+        yield last
+
+
+def number_iterations(boundaries, period: float):
+    """ Numbering the iterations starting at the boundaries.
+
+    If the distance between two boundaries is a multiple of the expected period, the boundaries of
+    the iterations in between were missed and the iteration number is incremented accordingly.
+
+    Args:
+        boundaries: The boundaries in increasing order.
+        period: Expected number of samples of an iteration.
+
+    Returns:
+        The iteration number of every boundary.
+    """
+    if len(boundaries) == 0:
+        return np.zeros(0, dtype=int)
+    gaps = np.maximum(np.rint(np.diff(boundaries) / period), 1).astype(int)
+    return np.concatenate([[0], np.cumsum(gaps)])
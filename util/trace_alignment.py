@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+
+# Upper bound for the number of warping path choices stored at a time by align_traces_dtw(). The
+# choices are stored as one byte each, this keeps them at a few hundred MB.
+MAX_DTW_CHOICES = 2**28
+
+
+def compute_sad(traces, ref_window, low_window, max_shift):
+    """ Computing the Sum of Absolute Differences (SAD) between a reference window and the shifted
+    windows of all traces.
+
+    Like the ResyncSAD preprocessing of ChipWhisperer, the window starting at low_window is shifted
+    by -max_shift to max_shift - 1 samples. The SADs of all traces are computed at once for every
+    shift.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        ref_window: Samples of the reference trace in the window.
+        low_window: First sample of the window.
+        max_shift: Maximum shift of the window.
+
+    Returns:
+        A (num_traces, 2 * max_shift) array, where entry (i, j) is the SAD of trace i for a shift
+        of j - max_shift samples.
+    """
+    traces = np.asarray(traces)
+    # Integer traces are compared exactly.
+    dtype = np.int64 if np.issubdtype(traces.dtype, np.integer) else np.float64
+    ref_window = np.asarray(ref_window, dtype=dtype)
+    window_len = len(ref_window)
+    if low_window - max_shift < 0 or low_window + window_len + max_shift > traces.shape[1]:
+        raise ValueError("Invalid window or maximum shift, the shifted window must be within "
+                         "the traces.")
+    sad = np.empty((traces.shape[0], 2 * max_shift), dtype=dtype)
+    for shift in range(-max_shift, max_shift):
+        start = low_window + shift
+        sad[:, shift + max_shift] = np.abs(
+            traces[:, start:start + window_len].astype(dtype) - ref_window).sum(axis=1)
+    return sad
+
+
+def shift_traces(traces, shifts):
+    """ Shifting every trace by a number of samples, padding with zeros.
+
+    Sample j of shifted trace i is sample j + shifts[i] of trace i.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        shifts: Number of samples to shift every trace by.
+
+    Returns:
+        The shifted (num_traces, num_samples) traces.
+    """
+    num_samples = traces.shape[1]
+    indices = np.arange(num_samples) + np.asarray(shifts)[:, np.newaxis]
+    valid = (indices >= 0) & (indices < num_samples)
+    shifted = np.take_along_axis(traces, np.clip(indices, 0, num_samples - 1), axis=1)
+    shifted[~valid] = 0
+    return shifted
+
+
+def align_traces_sad(traces, ref_trace, low_window, high_window, max_shift):
+    """ Aligning traces to a reference trace using the Sum of Absolute Differences (SAD).
+
+    This is a batched implementation of the ResyncSAD preprocessing of ChipWhisperer that works
+    directly on arrays: Every trace is shifted such that the SAD between its window and the window
+    of the reference trace is minimal. As in ResyncSAD, traces whose minimum SAD is above the mean
+    SAD of the reference trace over all shifts are discarded.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        ref_trace: The reference trace.
+        low_window: First sample of the window.
+        high_window: End of the window, exclusive.
+        max_shift: Maximum shift of the window.
+
+    Returns:
+        A tuple ``(aligned_traces, traces_to_use)``, where
+            - ``aligned_traces`` holds the aligned traces that are not discarded, and
+            - ``traces_to_use`` is a boolean array indicating which traces are not discarded.
+    """
+    ref_trace = np.asarray(ref_trace)
+    ref_window = ref_trace[low_window:high_window]
+    ref_sad = compute_sad(ref_trace[np.newaxis], ref_window, low_window, max_shift)[0]
+    ref_loc = np.argmin(ref_sad)
+    sad = compute_sad(traces, ref_window, low_window, max_shift)
+    locs = np.argmin(sad, axis=1)
+    traces_to_use = sad[np.arange(len(locs)), locs] <= ref_sad.mean()
+    aligned_traces = shift_traces(np.asarray(traces)[traces_to_use],
+                                  locs[traces_to_use] - ref_loc)
+    return aligned_traces, traces_to_use
+
+
+def band_offsets(diag, radius):
+    """ Offsets i - j of the cells (i, j) of an anti-diagonal i + j = diag within the band.
+
+    The offsets of an anti-diagonal have the same parity as the anti-diagonal. They are stored in
+    radius + 1 entries, the last entry is outside of the band for every other anti-diagonal.
+    """
+    return -radius + (diag + radius) % 2 + 2 * np.arange(radius + 1)
+
+
+def compute_dtw_choices(traces, ref_trace, radius):
+    """ Computing the banded Dynamic Time Warping (DTW) between a reference trace and all traces.
+
+    Cell (i, j) of the cost matrix pairs sample i of the reference trace with sample j of a trace,
+    the cost is their absolute difference. Only cells with |i - j| <= radius are considered
+    (Sakoe-Chiba band). The cumulative costs are computed along the anti-diagonals i + j of the
+    cost matrix, where every cell only depends on the two preceding anti-diagonals. This allows to
+    compute an anti-diagonal of the band for all traces at once.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        ref_trace: The reference trace with num_samples samples.
+        radius: Radius of the band.
+
+    Returns:
+        A (2 * num_samples - 1, num_traces, radius + 1) array of choices, where entry (d, t, m)
+        holds the predecessor of cell (i, j) on the warping path of trace t: 0 for (i - 1, j - 1),
+        1 for (i - 1, j) and 2 for (i, j - 1). The cell is given by i + j = d and
+        i - j = band_offsets(d, radius)[m].
+    """
+    traces = np.asarray(traces, dtype=np.float64)
+    ref_trace = np.asarray(ref_trace, dtype=np.float64)
+    num_traces, num_samples = traces.shape
+    assert len(ref_trace) == num_samples, "The reference trace must have num_samples samples."
+    width = radius + 1
+    choices = np.empty((2 * num_samples - 1, num_traces, width), dtype=np.uint8)
+    # Cumulative costs of the two preceding anti-diagonals, padded with an infinite cost on both
+    # sides. The virtual cell (-1, -1) precedes cell (0, 0).
+    costs_2 = np.full((num_traces, width + 2), np.inf)
+    costs_2[:, 1 + radius // 2] = 0
+    costs_1 = np.full((num_traces, width + 2), np.inf)
+    costs = np.full((num_traces, width + 2), np.inf)
+    for diag in range(2 * num_samples - 1):
+        offsets = band_offsets(diag, radius)
+        rows = (diag + offsets) // 2
+        cols = (diag - offsets) // 2
+        valid = ((offsets <= radius) & (rows >= 0) & (rows < num_samples) & (cols >= 0) &
+                 (cols < num_samples))
+        # The offsets of the preceding anti-diagonal are shifted by one, the predecessors
+        # (i - 1, j) and (i, j - 1) are either at the same or at the neighbouring entries.
+        shift = int(offsets[0] == -radius)
+        pred_up = costs_1[:, 1 - shift:width + 1 - shift]
+        pred_left = costs_1[:, 2 - shift:width + 2 - shift]
+        best = costs_2[:, 1:width + 1].copy()
+        choice = choices[diag]
+        choice[:] = 0
+        for pred, pred_choice in [(pred_up, 1), (pred_left, 2)]:
+            better = pred < best
+            choice[better] = pred_choice
+            np.minimum(best, pred, out=best)
+        best += np.abs(ref_trace[np.clip(rows, 0, num_samples - 1)] -
+                       traces[:, np.clip(cols, 0, num_samples - 1)])
+        best[:, ~valid] = np.inf
+        costs[:, 1:width + 1] = best
+        costs_2, costs_1, costs = costs_1, costs, costs_2
+    return choices
+
+
+def warp_traces(traces, choices, radius):
+    """ Resampling traces along their warping paths.
+
+    Sample i of a warped trace is the mean of all samples of the trace that are paired with sample
+    i of the reference trace on the warping path.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        choices: The choices returned by compute_dtw_choices().
+        radius: Radius of the band.
+
+    Returns:
+        The warped (num_traces, num_samples) traces.
+    """
+    num_traces, num_samples = traces.shape
+    sums = np.zeros((num_traces, num_samples))
+    cnts = np.zeros((num_traces, num_samples))
+    # Follow the warping paths of all traces back from cell (n - 1, n - 1) to cell (0, 0).
+    diags = np.full(num_traces, 2 * num_samples - 2)
+    offsets = np.zeros(num_traces, dtype=int)
+    active = np.arange(num_traces)
+    while len(active):
+        rows = (diags + offsets) // 2
+        sums[active, rows] += traces[active, (diags - offsets) // 2]
+        cnts[active, rows] += 1
+        step = choices[diags, active, (offsets + radius - (diags + radius) % 2) // 2]
+        diags = diags - np.where(step == 0, 2, 1)
+        offsets = offsets - (step == 1) + (step == 2)
+        done = diags < 0
+        active, diags, offsets = active[~done], diags[~done], offsets[~done]
+    return sums / cnts
+
+
+def align_traces_dtw(traces, ref_trace, radius, batch_size=None):
+    """ Aligning traces elastically to a reference trace using banded Dynamic Time Warping (DTW).
+
+    Every trace is warped along the path of minimum cost within a band of the given radius around
+    the diagonal, see compute_dtw_choices(), and resampled to the samples of the reference trace,
+    see warp_traces(). Traces are processed in batches.
+
+    Args:
+        traces: (num_traces, num_samples) array of traces.
+        ref_trace: The reference trace with num_samples samples.
+        radius: Radius of the band, i.e., the maximum shift between a trace and the reference.
+        batch_size: Number of traces aligned at a time. By default, batches are sized such that up
+            to MAX_DTW_CHOICES choices are stored.
+
+    Returns:
+        The aligned (num_traces, num_samples) traces.
+    """
+    traces = np.asarray(traces)
+    num_traces, num_samples = traces.shape
+    if batch_size is None:
+        batch_size = max(1, MAX_DTW_CHOICES // ((2 * num_samples - 1) * (radius + 1)))
+    aligned_traces = np.empty((num_traces, num_samples))
+    for start in range(0, num_traces, batch_size):
+        batch = traces[start:start + batch_size]
+        choices = compute_dtw_choices(batch, ref_trace, radius)
+        aligned_traces[start:start + batch_size] = warp_traces(batch, choices, radius)
+    return aligned_traces
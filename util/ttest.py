@@ -3,9 +3,14 @@
 # Licensed under the Apache License, Version 2.0, see LICENSE for details.
 # SPDX-License-Identifier: Apache-2.0
 
+from math import comb
+
 import numpy as np
 from scipy.stats import ttest_ind_from_stats
 
+# Upper bound for the number of histogram bins converted to float64 at a time by hist_moments().
+MAX_CHUNK_VALUES = 2**22
+
 # A set of functions for working with histograms.
 # The distributions are stored in two matrices x and y with dimensions (M, N) where:
 # - M equals the number of time samples times the number of orders, and
@@ -131,3 +136,124 @@ def ttest_hist_xy(x_a, y_a, x_b, y_b, num_orders):
     ttest = ttest1_hist_xy(x_a_ord, y_a_ord, x_b_ord, y_b_ord)
 
     return np.reshape(ttest, (num_orders, num_samples))
+
+
+def hist_moments(y, max_moment, x_axis=None):
+    """
+    Computes the number of observations, the means and the central moments of histograms.
+
+    Instead of replicating the value axis for every histogram, the power sums of the values are
+    computed by multiplying the histograms with a small (N, max_moment + 1) Vandermonde matrix. To
+    keep the conversion into central moments numerically stable, the values are first shifted by
+    the mean of the histogram rounded to the value axis. Histograms with the same shift share a
+    Vandermonde matrix.
+
+    y is a (M, N) matrix holding the distributions, one histogram per row. x_axis is a (N, )
+    vector holding the increasing values, by default 0,..., N-1.
+
+    Returns the number of observations and the means as (M, ) vectors and the central moments of
+    orders 2,..., max_moment as (max_moment - 1, M) matrix, i.e., cm[i] = E[(X - E[X])**(i + 2)].
+    """
+    num_rows, num_values = y.shape
+    if x_axis is None:
+        x_axis = np.arange(num_values)
+    x_axis = np.asarray(x_axis, dtype=np.float64)
+
+    n = np.empty(num_rows)
+    mean = np.empty(num_rows)
+    cm = np.empty((max_moment - 1, num_rows))
+    chunk_size = max(1, MAX_CHUNK_VALUES // max(1, num_values))
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        y_chunk = y[start:end].astype(np.float64)
+        n_chunk = y_chunk.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = (y_chunk @ x_axis) / n_chunk
+        # Snap the shifts to the value axis such that there are only few distinct shifts.
+        shift = x_axis[np.minimum(np.searchsorted(x_axis, shift), num_values - 1)]
+        # Power sums sum(y * (x - shift)**p) for p = 0,..., max_moment.
+        sums = np.empty((end - start, max_moment + 1))
+        for value in np.unique(shift):
+            rows = shift == value
+            vandermonde = np.empty((num_values, max_moment + 1))
+            vandermonde[:, 0] = 1
+            for p in range(1, max_moment + 1):
+                vandermonde[:, p] = vandermonde[:, p - 1] * (x_axis - value)
+            sums[rows] = y_chunk[rows] @ vandermonde
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw = sums / n_chunk[:, np.newaxis]
+        delta = raw[:, 1]
+        n[start:end] = n_chunk
+        mean[start:end] = shift + delta
+        # Convert the raw moments around the shift into central moments.
+        for p in range(2, max_moment + 1):
+            cm_p = np.zeros(end - start)
+            for k in range(p + 1):
+                cm_p += comb(p, k) * raw[:, k] * (-delta)**(p - k)
+            cm[p - 2, start:end] = cm_p
+
+    return n, mean, cm
+
+
+def ttest_hist(y_a, y_b, num_orders, x_axis=None):
+    """
+    Welch's t-test for orders 1,..., num_orders based on histograms.
+
+    This computes the same statistics as ttest_hist_xy() but derives the central moments from
+    power sums using hist_moments(), without replicating the value axis.
+
+    y_a and y_b are (M, N) matrices holding the distributions, one distribution per row.
+    x_axis is a (N, ) vector holding the values, by default 0,..., N-1.
+
+    The return value is (num_orders, M)
+    """
+    n_a, mean_a, cm_a = hist_moments(y_a, 2 * num_orders, x_axis)
+    n_b, mean_b, cm_b = hist_moments(y_b, 2 * num_orders, x_axis)
+    return ttest_moments(n_a, mean_a, cm_a, n_b, mean_b, cm_b, num_orders)
+
+
+def ttest_moments(n_a, mean_a, cm_a, n_b, mean_b, cm_b, num_orders):
+    """
+    Welch's t-test for orders 1,..., num_orders based on central moments.
+
+    This computes the same statistics as ttest_hist_xy() but starts from the number of
+    observations, the means and the central moments of the two distributions instead of their
+    histograms.
+
+    mean_a and mean_b are (..., M) arrays holding the means.
+    cm_a and cm_b are (..., 2*num_orders - 1, M) arrays holding the central moments of orders
+    2,..., 2*num_orders, i.e., cm_a[..., i, :] = E[(X - E[X])**(i + 2)].
+    n_a and n_b hold the number of observations and must be broadcastable to mean_a and mean_b.
+
+    The return value is (num_orders, ..., M)
+    """
+
+    def order_stats(mu, cm):
+        # Mean and variance of the pre-processed values for every order, i.e., X for the first
+        # order, (X - mu)**2 for the second order and ((X - mu) / sigma)**i for higher orders.
+        mean = np.empty((num_orders,) + mu.shape)
+        var = np.empty((num_orders,) + mu.shape)
+        mean[0] = mu
+        var[0] = cm[..., 0, :]
+        if num_orders > 1:
+            mean[1] = cm[..., 0, :]
+            var[1] = cm[..., 2, :] - cm[..., 0, :]**2
+        for i_order in range(2, num_orders):
+            order = i_order + 1
+            mean[i_order] = cm[..., order - 2, :] / cm[..., 0, :]**(order / 2)
+            var[i_order] = cm[..., 2 * order - 2, :] / cm[..., 0, :]**order - mean[i_order]**2
+        # Rounding errors must not lead to negative variances.
+        return mean, np.maximum(var, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu1, var1 = order_stats(mean_a, cm_a)
+        mu2, var2 = order_stats(mean_b, cm_b)
+        return ttest_ind_from_stats(mu1,
+                                    np.sqrt(var1),
+                                    np.broadcast_to(n_a, mean_a.shape),
+                                    mu2,
+                                    np.sqrt(var2),
+                                    np.broadcast_to(n_b, mean_b.shape),
+                                    equal_var=False,
+                                    alternative='two-sided')[0]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright lowRISC contributors.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+from typing import Optional
+
+import numpy as np
+
+from util.leakage_models import compute_leakage_general, find_fixed_entry
+from util.moments import MomentAccumulator
+
+logger = logging.getLogger()
+
+# Number of traces used to identify the fixed entry, like analysis/tvla.py does.
+NUM_FIXED_ENTRY_TRACES = 20
+
+
+class TvlaMonitor:
+    """ Live fixed-vs-random TVLA for a running capture.
+
+    The capture loop passes every batch of waves together with the data distinguishing the fixed
+    and the random set, i.e., the keys for fixed-vs-random key and the plaintexts for
+    fixed-vs-random data captures. Like the GENERAL_KEY and GENERAL_DATA tests of
+    analysis/tvla.py, the fixed entry is identified from the first traces. The running central
+    moments of both sets are updated with every batch using MomentAccumulator.
+
+    Every report_interval traces, the maximum absolute t-test value of every order is logged and
+    the monitor decides whether the capture can be stopped:
+    - Leakage is confirmed if the threshold is exceeded in num_confirmations consecutive reports.
+    - No leakage is detected if trace_budget traces have been captured and the statistics of all
+      orders are below the threshold. This is checked once when the budget is reached and then
+      in every report.
+    """
+    def __init__(self, report_interval: int = 10000, threshold: float = 4.5,
+                 num_orders: int = 2, trace_budget: Optional[int] = None,
+                 num_confirmations: int = 2):
+        self.report_interval = report_interval
+        self.threshold = threshold
+        self.num_orders = num_orders
+        self.trace_budget = trace_budget
+        self.num_confirmations = num_confirmations
+        self.moments = None
+        self.fixed_entry = None
+        # Traces received before the fixed entry is known.
+        self.pending_waves = []
+        self.pending_data = []
+        self.num_traces = 0
+        self.next_report = report_interval
+        self.num_leaking_reports = 0
+        self.budget_checked = False
+        # One entry per report with the number of traces and max |t| per order.
+        self.history = []
+        self.result = None
+
+    def update(self, waves, data) -> bool:
+        """ Adds a batch of traces.
+
+        Args:
+            waves: (num_traces, num_samples) array of waves.
+            data: Keys or plaintexts of the traces, one entry per trace.
+
+        Returns:
+            True if the capture can be stopped.
+        """
+        waves = np.asarray(waves)
+        if self.fixed_entry is None:
+            self.pending_waves.append(waves)
+            self.pending_data.extend(data)
+            if len(self.pending_data) < NUM_FIXED_ENTRY_TRACES:
+                return False
+            self.fixed_entry = find_fixed_entry(self.pending_data[:NUM_FIXED_ENTRY_TRACES])
+            waves = np.concatenate(self.pending_waves)
+            data = self.pending_data
+            self.pending_waves = []
+            self.pending_data = []
+            self.moments = MomentAccumulator(1, 1, waves.shape[1], self.num_orders)
+
+        groups = compute_leakage_general(data, self.fixed_entry)
+        self.moments.update(waves, groups[np.newaxis, np.newaxis, :])
+        self.num_traces += len(waves)
+
+        on_interval = self.num_traces >= self.next_report
+        # The stop condition is checked once when the trace budget is reached, afterwards only
+        # every report_interval traces.
+        budget_reached = (self.trace_budget is not None and not self.budget_checked and
+                          self.num_traces >= self.trace_budget)
+        if budget_reached:
+            self.budget_checked = True
+        if on_interval:
+            self.next_report = (self.num_traces // self.report_interval + 1) * self.report_interval
+        if on_interval or budget_reached:
+            self.report(on_interval)
+        return self.result is not None
+
+    def max_ttest(self) -> np.ndarray:
+        """ Maximum absolute t-test value of every order, NaN if a set is still empty."""
+        ttest = np.abs(self.moments.ttest()[:, 0, 0, :])
+        if np.all(np.isnan(ttest)):
+            return np.full(self.num_orders, np.nan)
+        return np.nanmax(ttest, axis=1)
+
+    def report(self, on_interval: bool = True) -> None:
+        """ Logs the current statistics and checks the stop conditions.
+
+        Args:
+            on_interval: Whether the report is on a report_interval boundary. Only these reports
+                count towards the confirmation of leakage.
+        """
+        max_ttest = self.max_ttest()
+        self.history.append((self.num_traces, max_ttest.tolist()))
+        logger.info(f"TVLA monitor: {self.num_traces} traces, max |t| per order: "
+                    f"{np.array2string(max_ttest, precision=2)}")
+        if on_interval:
+            if np.any(max_ttest > self.threshold):
+                self.num_leaking_reports += 1
+            else:
+                self.num_leaking_reports = 0
+
+        if self.num_leaking_reports >= self.num_confirmations:
+            self.result = "leakage"
+            logger.info(f"TVLA monitor: Leakage above {self.threshold} confirmed after "
+                        f"{self.num_traces} traces.")
+        elif (self.trace_budget is not None and self.num_traces >= self.trace_budget and
+              np.all(max_ttest <= self.threshold)):
+            self.result = "no_leakage"
+            logger.info(f"TVLA monitor: No leakage above {self.threshold} after "
+                        f"{self.num_traces} traces.")
+
+    def summary(self) -> dict:
+        """ Summary of the monitor to be stored in the project metadata."""
+        return {"result": self.result,
+                "num_traces": self.num_traces,
+                "threshold": self.threshold,
+                "num_orders": self.num_orders,
+                "trace_budget": self.trace_budget,
+                "history": self.history}
+
+
+def create_tvla_monitor(capture_cfg: dict, capture_mode: str):
+    """ Creates the TVLA monitor configured in the tvla_monitor entry of the capture config.
+
+    Returns:
+        The monitor or None if it's not configured or the capture isn't fixed-vs-random.
+    """
+    monitor_cfg = capture_cfg.get("tvla_monitor")
+    if monitor_cfg is None:
+        return None
+    if "fvsr" not in capture_mode:
+        logger.warning(f"The TVLA monitor requires a fixed-vs-random capture, not {capture_mode}. "
+                       "Disabling it.")
+        return None
+    return TvlaMonitor(**monitor_cfg)